@@ -0,0 +1,165 @@
+'''
+Benchmark the collector end to end against a synthetic fleet (fakeFleet.py), fully offline.
+Reports wall time per cycle, api calls per operation, peak memory and records per second, appends
+the result to a json lines file and compares it with the last saved run of the same fleet.
+--replay runs against an api recording (SM_RECORD_FILE) instead of the synthetic fleet.
+Collector settings come from the usual SM_ environment variables, e.g.
+
+    SM_MAX_WORKERS=8 python3 benchmark.py --clusters 10 --services 200 --tasks 10 --latency 0.02
+'''
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import subprocess
+import contextlib
+from datetime import datetime, timezone
+
+os.environ.setdefault('AWS_REGION', 'us-east-1')
+
+import serviceMetrics
+from fakeFleet import FakeFleet
+
+# counts what the collector would have written to stdout without keeping it
+class NullStream(io.TextIOBase):
+
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, text):
+        self.bytes += len(text)
+        return len(text)
+
+def GetRevision():
+
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return ''
+
+def GetLastResult(resultsFile, fleet):
+
+    last = None
+    if os.path.exists(resultsFile):
+        with open(resultsFile) as f:
+            for line in f:
+                result = json.loads(line)
+                if result['fleet'] == fleet and result['settings'] == GetSettings():
+                    last = result
+
+    return last
+
+def GetSettings():
+
+    return {k: v for k, v in sorted(os.environ.items()) if k.startswith('SM_')}
+
+parser = argparse.ArgumentParser(description='benchmark the collector against a synthetic ECS / EC2 fleet')
+parser.add_argument('--clusters', type=int, default=3)
+parser.add_argument('--services', type=int, default=50, help='services per cluster')
+parser.add_argument('--tasks', type=int, default=5, help='average tasks per service')
+parser.add_argument('--ec2-ratio', type=float, default=0.3, help='share of services on the EC2 launch type')
+parser.add_argument('--revisions', type=int, default=4, help='task definition revisions per service')
+parser.add_argument('--instances', type=int, default=4, help='container instances per cluster')
+parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every api call')
+parser.add_argument('--jitter', type=float, default=0.0, help='max random seconds added on top of the latency')
+parser.add_argument('--throttle', type=float, default=0.0, help='share of api calls failed with ThrottlingException')
+parser.add_argument('--cycles', type=int, default=1, help='collection cycles, caches stay warm between cycles')
+parser.add_argument('--seed', type=int, default=1)
+parser.add_argument('--replay', default='', help='replay this api recording instead of the synthetic fleet')
+parser.add_argument('--replay-latency', action='store_true', help='sleep the recorded latency of each replayed call')
+parser.add_argument('--results', default='benchmark-results.jsonl', help='file the results are appended to')
+args = parser.parse_args()
+
+fleetArgs = {
+    'clusters': args.clusters,
+    'services': args.services,
+    'tasks': args.tasks,
+    'ec2Ratio': args.ec2_ratio,
+    'revisions': args.revisions,
+    'instancesPerCluster': args.instances,
+    'latency': args.latency,
+    'latencyJitter': args.jitter,
+    'throttleRate': args.throttle,
+    'seed': args.seed
+}
+services = 0
+tasks = 0
+if args.replay != '':
+    fleetArgs = {'replay': os.path.abspath(args.replay), 'replayLatency': args.replay_latency}
+    replay = serviceMetrics.ApiReplay(args.replay, honorLatency=args.replay_latency)
+    replay.load()
+    serviceMetrics.SetClients(serviceMetrics.ReplayClient('ecs', replay), serviceMetrics.ReplayClient('ec2', replay))
+else:
+    fleet = FakeFleet(**fleetArgs)
+    services = len(fleet.services)
+    tasks = len(fleet.tasks)
+    serviceMetrics.SetClients(fleet, fleet)
+serviceMetrics.pricingTable.load()
+if serviceMetrics.ROLLUP_MODE != 'off':
+    serviceMetrics.taskMinuteBuffer.open()
+
+stream = NullStream()
+serviceMetrics.recordWriter.stream = stream
+cycleSeconds = []
+records = 0
+
+tracemalloc.start()
+with contextlib.redirect_stdout(stream):
+    for cycle in range(args.cycles):
+        start = time.perf_counter()
+        serviceMetrics.CollectServiceMetrics(useCachedStages=cycle != 0)
+        cycleSeconds.append(time.perf_counter() - start)
+        records += serviceMetrics.recordWriter.records
+_, peakBytes = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+
+wallSeconds = sum(cycleSeconds)
+apiStats = serviceMetrics.collectorMetrics.api
+result = {
+    'dateTime': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    'revision': GetRevision(),
+    'python': sys.version.split()[0],
+    'fleet': fleetArgs,
+    'settings': GetSettings(),
+    'cycles': args.cycles,
+    'services': services,
+    'tasks': tasks,
+    'wallSeconds': round(wallSeconds, 4),
+    'cycleSeconds': [round(s, 4) for s in cycleSeconds],
+    'records': records,
+    'recordsPerSecond': round(records / wallSeconds, 1) if wallSeconds > 0 else 0,
+    'outputBytes': stream.bytes,
+    'peakMemoryMb': round(peakBytes / 1048576, 2),
+    'apiCalls': {k: v.calls for k, v in sorted(apiStats.items())},
+    'apiCallsTotal': sum(v.calls for v in apiStats.values()),
+    'throttled': {k: v.throttles for k, v in sorted(apiStats.items()) if v.throttles != 0},
+    'stageSeconds': {k: round(v, 4) for k, v in serviceMetrics.collectorMetrics.stageSeconds.items()}
+}
+
+last = GetLastResult(args.results, fleetArgs)
+with open(args.results, 'a') as f:
+    f.write(json.dumps(result) + '\n')
+
+if args.replay != '':
+    print('replay: ', args.replay)
+else:
+    print('fleet: ', services, 'services, ', tasks, 'tasks in ', args.clusters, 'clusters')
+print('wall time: ', result['wallSeconds'], 's  per cycle: ', result['cycleSeconds'])
+print('records: ', records, '  records per second: ', result['recordsPerSecond'])
+print('peak memory: ', result['peakMemoryMb'], 'MB')
+print('api calls: ', result['apiCallsTotal'])
+for operation, calls in result['apiCalls'].items():
+    print('    ', operation, calls, ' throttled: ', result['throttled'].get(operation, 0))
+print('last cycle stage seconds: ', result['stageSeconds'])
+
+if last != None:
+    print()
+    print('compared with ', last['revision'], ' (', last['dateTime'], ')')
+    for key in ['wallSeconds', 'recordsPerSecond', 'peakMemoryMb', 'apiCallsTotal']:
+        change = (result[key] - last[key]) / last[key] * 100 if last[key] else 0
+        print('    ', key, last[key], '->', result[key], ' (', format(change, '+.1f'), '% )')
@@ -0,0 +1,257 @@
+'''
+In process stand in for the ECS / EC2 clients used by the collector. Generates a synthetic fleet of
+clusters x services x tasks (mixed FARGATE / EC2, several task definition revisions per service) and
+answers the list / describe calls with the same page sizes, batch limits and error shapes as the real
+apis, with optional per call latency and throttling
+'''
+
+import time
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from botocore.exceptions import ClientError
+
+ACCOUNT_ID = '123456789012'
+INSTANCE_TYPES = ['m5.large', 'm5.xlarge', 'c5.xlarge', 'c5.2xlarge', 'r5.large']
+FLEET_START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+def ClientErrorFor(code, operation):
+
+    return ClientError({'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'RetryAttempts': 0}}, operation)
+
+def GetPage(items, resultKey, nextToken, maxResults, defaultPageSize, tokenKey='nextToken'):
+
+    start = int(nextToken or 0)
+    size = maxResults or defaultPageSize
+    resp = {resultKey: items[start:start + size]}
+    if start + size < len(items):
+        resp[tokenKey] = str(start + size)
+
+    return resp
+
+class FakeFleet():
+
+    def __init__(self, clusters=3, services=20, tasks=5, ec2Ratio=0.3, revisions=4, instancesPerCluster=4,
+                 latency=0.0, latencyJitter=0.0, throttleRate=0.0, region='us-east-1', seed=1):
+        self.region = region
+        self.latency = latency
+        self.latencyJitter = latencyJitter
+        self.throttleRate = throttleRate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.throttled = {}
+
+        self.clusterArns = []
+        self.clusters = {}
+        self.serviceArnsByCluster = {}
+        self.services = {}
+        self.taskArnsByService = {}
+        self.tasks = {}
+        self.taskDefinitions = {}
+        self.containerInstanceArnsByCluster = {}
+        self.containerInstances = {}
+        self.instances = {}
+
+        arnPrefix = 'arn:aws:ecs:' + region + ':' + ACCOUNT_ID + ':'
+        for c in range(clusters):
+            clusterName = 'cluster-' + str(c)
+            clusterArn = arnPrefix + 'cluster/' + clusterName
+            self.clusterArns.append(clusterArn)
+            self.serviceArnsByCluster[clusterArn] = []
+
+            containerInstanceArns = []
+            if ec2Ratio > 0:
+                for i in range(instancesPerCluster):
+                    containerInstanceArn = arnPrefix + 'container-instance/' + clusterName + '/ci-' + str(i)
+                    instanceId = 'i-' + format(c * 100000 + i, '017x')
+                    containerInstanceArns.append(containerInstanceArn)
+                    self.instances[instanceId] = self.rng.choice(INSTANCE_TYPES)
+                    self.containerInstances[containerInstanceArn] = {
+                        'containerInstanceArn': containerInstanceArn,
+                        'ec2InstanceId': instanceId,
+                        'status': 'ACTIVE',
+                        'registeredResources': [
+                            {'name': 'CPU', 'type': 'INTEGER', 'integerValue': 4096},
+                            {'name': 'MEMORY', 'type': 'INTEGER', 'integerValue': 15000}
+                        ],
+                        'remainingResources': [
+                            {'name': 'CPU', 'type': 'INTEGER', 'integerValue': self.rng.randrange(0, 4096, 256)},
+                            {'name': 'MEMORY', 'type': 'INTEGER', 'integerValue': self.rng.randrange(0, 15000, 500)}
+                        ],
+                        'runningTasksCount': 0,
+                        'pendingTasksCount': 0
+                    }
+            self.containerInstanceArnsByCluster[clusterArn] = containerInstanceArns
+
+            runningTasks = 0
+            for s in range(services):
+                serviceName = clusterName + '-svc-' + str(s)
+                serviceArn = arnPrefix + 'service/' + clusterName + '/' + serviceName
+                launchType = 'EC2' if containerInstanceArns != [] and self.rng.random() < ec2Ratio else 'FARGATE'
+
+                taskDefArns = []
+                for r in range(1, max(revisions, 1) + 1):
+                    taskDefArn = arnPrefix + 'task-definition/' + serviceName + ':' + str(r)
+                    taskDefArns.append(taskDefArn)
+                    self.taskDefinitions[taskDefArn] = self.BuildTaskDefinition(taskDefArn, s, r)
+                # a rolling deployment leaves a few tasks on the previous revision
+                current = taskDefArns[-1]
+                previous = taskDefArns[-2] if len(taskDefArns) > 1 else current
+
+                taskCount = max(tasks + self.rng.randint(-tasks // 2, tasks // 2), 0)
+                taskArns = []
+                for t in range(taskCount):
+                    taskArn = arnPrefix + 'task/' + clusterName + '/' + format(self.rng.getrandbits(128), '032x')
+                    taskArns.append(taskArn)
+                    task = {
+                        'taskArn': taskArn,
+                        'clusterArn': clusterArn,
+                        'taskDefinitionArn': previous if t % 10 == 9 else current,
+                        'group': 'service:' + serviceName,
+                        'launchType': launchType,
+                        'lastStatus': 'RUNNING',
+                        'desiredStatus': 'RUNNING',
+                        'healthStatus': self.rng.choice(['HEALTHY', 'HEALTHY', 'HEALTHY', 'UNKNOWN', 'UNHEALTHY']),
+                        'availabilityZone': region + self.rng.choice('abc'),
+                        'cpu': str(self.rng.choice([256, 512, 1024, 2048])),
+                        'memory': str(self.rng.choice([512, 1024, 2048, 4096])),
+                        'startedAt': FLEET_START + timedelta(minutes=self.rng.randrange(0, 60 * 24 * 30)),
+                        'containers': [{'name': 'app', 'lastStatus': 'RUNNING'}],
+                        'tags': []
+                    }
+                    if launchType == 'EC2':
+                        containerInstanceArn = containerInstanceArns[t % len(containerInstanceArns)]
+                        task['containerInstanceArn'] = containerInstanceArn
+                        self.containerInstances[containerInstanceArn]['runningTasksCount']+=1
+                    self.tasks[taskArn] = task
+                runningTasks += taskCount
+
+                tags = []
+                if s % 5 != 0:
+                    tags.append({'key': 'Service', 'value': 'team-' + str(s % 7) + '-' + serviceName})
+                self.services[serviceArn] = {
+                    'serviceArn': serviceArn,
+                    'serviceName': serviceName,
+                    'clusterArn': clusterArn,
+                    'status': 'ACTIVE',
+                    'launchType': launchType,
+                    'desiredCount': taskCount,
+                    'runningCount': taskCount,
+                    'pendingCount': 0,
+                    'taskDefinition': current,
+                    'deployments': [{'id': 'ecs-svc/' + str(s), 'status': 'PRIMARY', 'taskDefinition': current,
+                                     'desiredCount': taskCount, 'runningCount': taskCount, 'pendingCount': 0}],
+                    'createdAt': FLEET_START,
+                    'events': [{'id': str(e), 'message': 'steady state'} for e in range(5)],
+                    'tags': tags
+                }
+                self.serviceArnsByCluster[clusterArn].append(serviceArn)
+                self.taskArnsByService[(clusterArn, serviceName)] = taskArns
+
+            self.clusters[clusterArn] = {
+                'clusterArn': clusterArn,
+                'clusterName': clusterName,
+                'status': 'ACTIVE',
+                'activeServicesCount': services,
+                'runningTasksCount': runningTasks,
+                'pendingTasksCount': 0,
+                'registeredContainerInstancesCount': len(containerInstanceArns),
+                'tags': [{'key': 'aws:cloudformation:stack-name', 'value': 'stack-' + clusterName}]
+            }
+
+    def BuildTaskDefinition(self, taskDefArn, service, revision):
+
+        environment = [{'name': 'MT_REQUEST_TIMEOUT', 'value': str(30 + revision)}]
+        if service % 2 == 0:
+            environment.append({'name': 'TS_DEFAULT_WORKERS_PER_MODEL', 'value': str(service % 4 + 1)})
+            environment.append({'name': 'TS_JOB_QUEUE_SIZE', 'value': '100'})
+
+        return {
+            'taskDefinitionArn': taskDefArn,
+            'revision': revision,
+            'containerDefinitions': [
+                {'name': 'app', 'environment': environment},
+                {'name': 'sidecar', 'environment': []}
+            ]
+        }
+
+    # count the call, sleep for the configured latency and throttle a share of the calls
+    def Call(self, operation):
+
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            throttle = self.throttleRate > 0 and self.rng.random() < self.throttleRate
+            delay = self.latency + (self.rng.random() * self.latencyJitter if self.latencyJitter > 0 else 0)
+            if throttle:
+                self.throttled[operation] = self.throttled.get(operation, 0) + 1
+
+        if delay > 0:
+            time.sleep(delay)
+        if throttle:
+            raise ClientErrorFor('ThrottlingException', operation)
+
+    def CheckBatch(self, operation, items, limit):
+
+        if len(items) == 0 or len(items) > limit:
+            raise ClientErrorFor('InvalidParameterException', operation)
+
+    def list_clusters(self, nextToken=None, maxResults=None):
+        self.Call('list_clusters')
+        return GetPage(self.clusterArns, 'clusterArns', nextToken, maxResults, 100)
+
+    def describe_clusters(self, clusters, include=None):
+        self.Call('describe_clusters')
+        self.CheckBatch('describe_clusters', clusters, 100)
+        out = []
+        for clusterArn in clusters:
+            cluster = dict(self.clusters[clusterArn])
+            if include == None or 'TAGS' not in include:
+                del cluster['tags']
+            out.append(cluster)
+        return {'clusters': out, 'failures': []}
+
+    def list_services(self, cluster, nextToken=None, maxResults=None, launchType=None, schedulingStrategy=None):
+        self.Call('list_services')
+        return GetPage(self.serviceArnsByCluster[cluster], 'serviceArns', nextToken, maxResults, 10)
+
+    def describe_services(self, cluster, services, include=None):
+        self.Call('describe_services')
+        self.CheckBatch('describe_services', services, 10)
+        out = []
+        for serviceArn in services:
+            service = dict(self.services[serviceArn])
+            service['events'] = list(service['events'])
+            if include == None or 'TAGS' not in include:
+                del service['tags']
+            out.append(service)
+        return {'services': out, 'failures': []}
+
+    def list_tasks(self, cluster, serviceName=None, launchType=None, nextToken=None, maxResults=None, desiredStatus=None):
+        self.Call('list_tasks')
+        return GetPage(self.taskArnsByService.get((cluster, serviceName), []), 'taskArns', nextToken, maxResults, 100)
+
+    def describe_tasks(self, cluster, tasks, include=None):
+        self.Call('describe_tasks')
+        self.CheckBatch('describe_tasks', tasks, 100)
+        return {'tasks': [dict(self.tasks[taskArn]) for taskArn in tasks if taskArn in self.tasks], 'failures': []}
+
+    def describe_task_definition(self, taskDefinition, include=None):
+        self.Call('describe_task_definition')
+        if taskDefinition not in self.taskDefinitions:
+            raise ClientErrorFor('ClientException', 'describe_task_definition')
+        return {'taskDefinition': self.taskDefinitions[taskDefinition], 'tags': []}
+
+    def list_container_instances(self, cluster, nextToken=None, maxResults=None, status=None):
+        self.Call('list_container_instances')
+        return GetPage(self.containerInstanceArnsByCluster[cluster], 'containerInstanceArns', nextToken, maxResults, 100)
+
+    def describe_container_instances(self, cluster, containerInstances, include=None):
+        self.Call('describe_container_instances')
+        self.CheckBatch('describe_container_instances', containerInstances, 100)
+        return {'containerInstances': [self.containerInstances[arn] for arn in containerInstances], 'failures': []}
+
+    def describe_instances(self, InstanceIds=None, NextToken=None, MaxResults=None):
+        self.Call('describe_instances')
+        instances = [{'InstanceId': i, 'InstanceType': self.instances[i]} for i in InstanceIds or [] if i in self.instances]
+        return {'Reservations': [{'Instances': instances}]}
@@ -2,32 +2,280 @@
 Get all ECS Service info for an account and format the log data to stdout in json struct
 '''
 
-import boto3
 import time
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 import json
-import pytz
+import sys
+import csv
+import io
+import threading
+import mmap
+import random
+import functools
+import gzip
+import copy
+import pickle
+import queue
+import hashlib
+import atexit
+import re
+import fnmatch
+from array import array
+from bisect import bisect_left
+from operator import attrgetter
+from collections import OrderedDict, deque
 from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future
+from concurrent.futures import wait as WaitForFutures
+
+# start of the import, the import to first record latency is measured from here
+IMPORT_TIME = time.perf_counter()
+
+# read an integer setting from the environment, falling back to the default on bad input
+def GetEnvInt(name, default, minimum=None):
+
+    value = default
+    try:
+        value = int(os.environ.get(name, default))
+    except ValueError as e:
+        print('invalid ' + name + ' value, using default value: ', default)
+
+    if minimum != None:
+        value = max(minimum, value)
+
+    return value
+
+def GetEnvFloat(name, default, minimum=None):
+
+    value = default
+    try:
+        value = float(os.environ.get(name, default))
+    except ValueError as e:
+        print('invalid ' + name + ' value, using default value: ', default)
+
+    if minimum != None:
+        value = max(minimum, value)
+
+    return value
+
+# print cycle timing and cache stats after each cycle
+DEBUG = GetEnvInt('SM_DEBUG', 0)
+
+# skip task level calls for services whose state did not change since the last cycle, with a full
+# refresh of every service every SM_TASK_REFRESH_INTERVAL seconds (SM_FULL_REFRESH_CYCLES cycles by default)
+INCREMENTAL = GetEnvInt('SM_INCREMENTAL', 0)
+FULL_REFRESH_CYCLES = GetEnvInt('SM_FULL_REFRESH_CYCLES', 10, minimum=1)
+
+# collection interval (the task counts) and the refresh interval of the slower stages in seconds.
+# the cluster list and inventory default to the collection interval so every cycle collects them,
+# the incremental full refresh defaults to every SM_FULL_REFRESH_CYCLES cycles, the interval is the only
+# setting the refresh follows
+PROC_INTERVAL = GetEnvFloat('SM_PROC_INTERVAL', 60.0, minimum=1.0)
+CLUSTER_LIST_INTERVAL = GetEnvFloat('SM_CLUSTER_LIST_INTERVAL', PROC_INTERVAL, minimum=1.0)
+INVENTORY_INTERVAL = GetEnvFloat('SM_INVENTORY_INTERVAL', PROC_INTERVAL, minimum=1.0)
+TASK_REFRESH_INTERVAL = GetEnvFloat('SM_TASK_REFRESH_INTERVAL', FULL_REFRESH_CYCLES * PROC_INTERVAL, minimum=1.0)
+
+# what to do when a cycle runs past its next tick: skip, coalesce or catchup
+OVERRUN_POLICY = os.environ.get('SM_OVERRUN_POLICY', 'skip').lower()
+# max random delay in seconds added to each collection tick
+SCHEDULE_JITTER = GetEnvFloat('SM_SCHEDULE_JITTER', 0.0, minimum=0.0)
+
+# max number of concurrent client calls per collection stage, 1 keeps the serial path
+MAX_WORKERS = GetEnvInt('SM_MAX_WORKERS', 1, minimum=1)
+
+# task definition cache size (entries) and optional file to persist it across restarts
+TASKDEF_CACHE_SIZE = GetEnvInt('SM_TASKDEF_CACHE_SIZE', 1000, minimum=1)
+TASKDEF_CACHE_FILE = os.environ.get('SM_TASKDEF_CACHE_FILE', '')
+
+# pricing table used to fill in serviceCostPerMinute, costs stay 0 if the file is missing
+PRICING_FILE = os.environ.get('SM_PRICING_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pricing.json'))
+
+# enrich and log each service as soon as it is described instead of stage by stage
+STREAMING = GetEnvInt('SM_STREAMING', 0)
+
+# also log one record per cluster with the cluster level totals
+CLUSTER_RECORDS = GetEnvInt('SM_CLUSTER_RECORDS', 0)
+
+# services to collect, matched right after describe_services so the others skip every task level call:
+# comma separated terms that all have to match, tag:<key>[=<pattern>], cluster:<pattern>,
+# launchType:<pattern>, stack:<pattern> or service:<pattern>, | separated alternatives and a leading !
+# to negate. A service without a Service tag is never logged, so it is never collected either
+SERVICE_SELECTOR = os.environ.get('SM_SERVICE_SELECTOR', '')
+
+# per service task count history and 5m / 1h / 1d rollups: off, append (rollup records next to the
+# per minute records) or only (rollup records instead of the per minute service records)
+ROLLUP_MODE = os.environ.get('SM_ROLLUP_MODE', 'off').lower()
+ROLLUP_SLOTS = GetEnvInt('SM_ROLLUP_SLOTS', 60, minimum=1)
+ROLLUP_MAX_SERVICES = GetEnvInt('SM_ROLLUP_MAX_SERVICES', 2000, minimum=1)
+ROLLUP_FILE = os.environ.get('SM_ROLLUP_FILE', '')
+
+# also log a recordType: collectorStats record per cycle with the stage timings and api call stats
+STATS_RECORDS = GetEnvInt('SM_STATS_RECORDS', 0)
+# serve the collector stats in prometheus text format on this port, 0 turns the endpoint off
+METRICS_PORT = GetEnvInt('SM_METRICS_PORT', 0, minimum=0)
+
+# regions and assumed role accounts covered by one collector, each region / account pair is collected
+# by its own worker process and the output is merged in this order. Empty lists keep the single
+# process collection of AWS_REGION with the default credentials
+REGIONS = [r.strip() for r in os.environ.get('SM_REGIONS', '').split(',') if r.strip() != '']
+ROLE_ARNS = [r.strip() for r in os.environ.get('SM_ROLE_ARNS', '').split(',') if r.strip() != '']
+# seconds before the assumed role credentials expire that they are renewed
+ROLE_SESSION_SECONDS = 3600
+ROLE_RENEW_SECONDS = 300
+
+# split the collection across replicas: each replica collects the clusters (and the services of
+# clusters with more than SM_SHARD_SERVICES_THRESHOLD services) that hash to it. SM_REPLICA_COUNT=auto
+# finds the index / count from the running tasks of this collector's own ecs service
+REPLICA_COUNT = os.environ.get('SM_REPLICA_COUNT', '1').lower()
+REPLICA_INDEX = GetEnvInt('SM_REPLICA_INDEX', 0, minimum=0)
+SHARD_SERVICES_THRESHOLD = GetEnvInt('SM_SHARD_SERVICES_THRESHOLD', 200, minimum=1)
+
+# client side rate limit per api operation in calls per second and its burst size. With a rate of 0
+# an operation runs unlimited until its first throttle, after that the limit adapts (cut on every
+# throttle, raised slowly on success up to the rate that first throttled)
+API_RATE = GetEnvFloat('SM_API_RATE', 0.0, minimum=0.0)
+API_BURST = GetEnvInt('SM_API_BURST', 20, minimum=1)
+# retries of throttled / failed read calls, with exponential backoff and full jitter
+API_MAX_RETRIES = GetEnvInt('SM_API_MAX_RETRIES', 5, minimum=0)
+API_BACKOFF_BASE = 0.1
+API_BACKOFF_CAP = 10.0
+API_MIN_RATE = 0.5
+API_RATE_DECREASE = 0.7
+API_RATE_INCREASE = 2.0
+# throttles of calls made before the last cut landed are the same overload, cut at most once per period
+API_CUT_SECONDS = 1.0
+
+# record every api call (operation, parameters, response, latency) to this gzip json lines file,
+# or replay a recording instead of calling aws. Replay sleeps the recorded latencies if SM_REPLAY_LATENCY is set
+RECORD_FILE = os.environ.get('SM_RECORD_FILE', '')
+REPLAY_FILE = os.environ.get('SM_REPLAY_FILE', '')
+REPLAY_LATENCY = GetEnvInt('SM_REPLAY_LATENCY', 0)
+
+# ecs task / service state change events applied between polls: stdin, dir:<path> (every file is one
+# event or json lines, removed once read) or file:<path> (tailed). With a source the per minute records
+# come from the event updated index and the full poll only runs every SM_RECONCILE_INTERVAL seconds
+EVENT_SOURCE = os.environ.get('SM_EVENT_SOURCE', '')
+EVENT_INTERVAL = GetEnvFloat('SM_EVENT_INTERVAL', 1.0, minimum=0.1)
+RECONCILE_INTERVAL = GetEnvFloat('SM_RECONCILE_INTERVAL', 900.0, minimum=1.0)
+
+# run a single collection cycle and exit (cron / scheduled task) instead of the scheduler loop
+ONE_SHOT = GetEnvInt('SM_ONE_SHOT', 0)
+# warm start state (task definition cache, service snapshot, cluster list and inventories) saved
+# after every cycle and loaded on start, so a short lived run does not start from a cold collection
+STATE_FILE = os.environ.get('SM_STATE_FILE', '')
+
+# task level metrics from the describe_tasks responses: off, service (task age percentiles, health
+# counts, per availability zone task counts and summed reservations added to each service record)
+# or task (also one recordType: task record per task)
+TASK_METRICS = os.environ.get('SM_TASK_METRICS', 'off').lower()
+
+# full logs every service record each cycle, delta only the services whose record changed since it was
+# last logged, plus recordType: serviceRemoved records and a full heartbeat every SM_HEARTBEAT_CYCLES cycles
+EMIT_MODE = os.environ.get('SM_EMIT_MODE', 'full').lower()
+HEARTBEAT_CYCLES = GetEnvInt('SM_HEARTBEAT_CYCLES', 10, minimum=1)
+
+# log line format (json, logfmt, csv or emf) and how many lines are buffered per stdout write
+OUTPUT_FORMAT = os.environ.get('SM_OUTPUT_FORMAT', 'json').lower()
+OUTPUT_BUFFER_LINES = GetEnvInt('SM_OUTPUT_BUFFER_LINES', 500, minimum=1)
+
+# output sinks written by a background thread instead of the collection path: comma separated list of
+# stdout, file:<path> (gzip, rotated), udp:<host>:<port> and tcp:<host>:<port>. Empty keeps the
+# synchronous stdout writes. The queue holds up to SM_SINK_QUEUE_LINES lines, when it is full the
+# collection blocks, the oldest queued lines are dropped or new lines are spilled to SM_SINK_SPILL_FILE
+SINKS = os.environ.get('SM_SINKS', '')
+SINK_QUEUE_LINES = GetEnvInt('SM_SINK_QUEUE_LINES', 10000, minimum=1)
+SINK_POLICY = os.environ.get('SM_SINK_POLICY', 'block').lower()
+SINK_SPILL_FILE = os.environ.get('SM_SINK_SPILL_FILE', 'sink-spill.jsonl')
+SINK_FILE_MAX_BYTES = GetEnvInt('SM_SINK_FILE_MAX_BYTES', 100 * 1048576, minimum=1024)
+SINK_FILE_BACKUPS = GetEnvInt('SM_SINK_FILE_BACKUPS', 5, minimum=0)
+SINK_SPILL_READ_LINES = 1000
+SINK_RECONNECT_SECONDS = 5.0
+UDP_MAX_DATAGRAM = 65000
+# how long the exit waits for queued lines to be written
+SINK_CLOSE_SECONDS = 30.0
+
+# time budget of a collection cycle in seconds (0: no deadline). The budget is split across the collection
+# stages, calls that can not finish in their stage's share are cancelled and the services they leave
+# incomplete are logged with their last known values and dataStatus stale (or partial without any)
+CYCLE_BUDGET = GetEnvFloat('SM_CYCLE_BUDGET', 0.0, minimum=0.0)
+# connect / read timeout of every api call, defaults to a sixth of the cycle budget when one is set
+CALL_TIMEOUT = GetEnvFloat('SM_CALL_TIMEOUT', max(CYCLE_BUDGET / 6, 1.0) if CYCLE_BUDGET > 0 else 0.0, minimum=0.0)
+CONNECT_TIMEOUT_CAP = 5.0
+# share of the budget kept back for logging the records, and how long past a stage's deadline
+# calls already in flight are waited for before they are left behind
+DEADLINE_RESERVE = 0.1
+DEADLINE_GRACE_SECONDS = 0.5
+# collection stages in run order and their share of the budget that is left when they start
+STAGE_BUDGET_WEIGHTS = [
+    ('GetClusters', 1),
+    ('GetServiceList', 1),
+    ('CollectServiceData', 2),
+    ('GetTaskArns', 2),
+    ('GetFargateInfo', 3),
+    ('GetTaskDetails', 1),
+]
+
+# max page / batch sizes allowed by each api call
+LIST_PAGE_SIZE = 100
+DESCRIBE_SERVICES_BATCH_SIZE = 10
+DESCRIBE_TASKS_BATCH_SIZE = 100
+DESCRIBE_CONTAINER_INSTANCES_BATCH_SIZE = 100
+DESCRIBE_CLUSTERS_BATCH_SIZE = 100
+DESCRIBE_INSTANCES_BATCH_SIZE = 100
 
 # set up boto client(s)
 
 # set up region for boto3 clients 
-region = 'us-east-1'
-try:
-    region = os.environ.get('AWS_REGION')
-except Exception as e:
-    print('could not find region via environment variable AWS_REGION, using default value: ', region)
+region = os.environ.get('AWS_REGION') or 'us-east-1'
+
+# clients are shared by all worker threads, size the connection pool to match.
+# retries are left to ThrottledClient so backoff and rate limits are shared by every thread.
+# built per client so botocore is only imported along with boto3
+def GetClientConfig():
+
+    from botocore.config import Config
+
+    clientConfig = Config(max_pool_connections=max(MAX_WORKERS, 10), retries={'mode': 'standard', 'max_attempts': 1})
+    if CALL_TIMEOUT > 0:
+        clientConfig = clientConfig.merge(Config(connect_timeout=min(CALL_TIMEOUT, CONNECT_TIMEOUT_CAP), read_timeout=CALL_TIMEOUT))
+
+    return clientConfig
+
+# one boto3 session for every client, boto3 is only imported once the first client is needed
+# so replays, benchmarks and the import itself stay cheap
+session = None
+sessionLock = threading.Lock()
 
-# set up default client
-ecs_client = boto3.client('ecs', region_name='us-east-1')
-ec2_client = boto3.client('ec2', region_name='us-east-1')
+def GetSession():
 
-if region != None:
-    ecs_client = boto3.client('ecs', region_name=str(region))
-    ec2_client = boto3.client('ec2', region_name=str(region))
+    global session
 
-#print('region used: ', region)
+    with sessionLock:
+        if session == None:
+            import boto3
+            session = boto3.session.Session(region_name=region)
+
+    return session
+
+# client created on its first call
+class LazyClient():
+
+    def __init__(self, serviceName):
+        self.serviceName = serviceName
+        self.client = None
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        with self.lock:
+            if self.client == None:
+                self.client = GetSession().client(self.serviceName, config=GetClientConfig())
+
+        return getattr(self.client, name)
 
 @dataclass
 class ServiceData():
@@ -35,7 +283,9 @@ class ServiceData():
     serviceName: str = ''
     serviceArn: str = ''
     taskArns: list = field(default_factory=list)
+    taskStatuses: dict = field(default_factory=dict) # task arn -> describe_tasks lastStatus, event mode only
     taskDefinitions: list = field(default_factory=list)
+    containerInstanceArns: list = field(default_factory=list) # container instance of each task, EC2 only
     cfStackName: str = ''
     containerType: str = '' # ec2 or fargate
     fargateMem: int = 0
@@ -57,6 +307,11 @@ class ServiceData():
     defaultWorkersPerModel: int = 0 #tsDefaultWorkersPerModel
     queueSize: int = 0 #tsQueueSize
     serviceCostPerMinute: float = 0.00
+    stateFingerprint: str = '' # describe_services state the task level fields were collected for
+    unchanged: bool = False # task level fields reused from the previous cycle
+    taskColumns: object = None # TaskColumns of the described tasks, SM_TASK_METRICS only
+    dataStatus: str = '' # partial: a call for the service failed or ran out of time, stale: last known values
+    selected: bool = True # has a Service tag and matches SM_SERVICE_SELECTOR, the others skip the task level calls
 
     def printData(self):
         print('==== SERVICE DATA ITEM ====')
@@ -88,11 +343,53 @@ class ServiceData():
         print('serviceCostPerMin: ', self.serviceCostPerMinute)
         print()
 
+@dataclass
+class ClusterMetadata():
+    clusterArn: str = ''
+    clusterName: str = ''
+    cfStackName: str = ''
+    tags: dict = field(default_factory=dict)
+    activeServicesCount: int = 0
+    runningTasksCount: int = 0
+    pendingTasksCount: int = 0
+    registeredContainerInstancesCount: int = 0
+
+@dataclass
+class ContainerInstanceData():
+    containerInstanceArn: str = ''
+    ec2InstanceId: str = ''
+    instanceType: str = ''
+    registeredCpu: int = 0
+    registeredMemory: int = 0
+    remainingCpu: int = 0
+    remainingMemory: int = 0
+    runningTasksCount: int = 0
+
+# container instances of one cluster, indexed by container instance arn and ec2 instance id
+@dataclass
+class ClusterInventory():
+    clusterArn: str = ''
+    byContainerInstanceArn: dict = field(default_factory=dict)
+    byEc2InstanceId: dict = field(default_factory=dict)
+    hourlyCostPerTask: dict = None # container instance arn -> instance price split across its tasks
+    collectedAt: float = 0.0
+
+    # instances in a cluster should all match, report the first one
+    def getInstanceType(self):
+        for instance in self.byContainerInstanceArn.values():
+            if instance.instanceType != '':
+                return instance.instanceType
+        return ''
+
 @dataclass
 class ClusterData():
     clusterArn: str = ''
     serviceArnList: list = field(default_factory=list)
     serviceDataList: list = field(default_factory=list)
+    metadata: ClusterMetadata = field(default_factory=ClusterMetadata)
+    inventory: ClusterInventory = None # only built for clusters running EC2 services
+    owned: bool = True # this replica logs the cluster level records
+    dataStatus: str = '' # partial: the service list or a describe_services batch could not be read this cycle
 
     def printData(self):
         print('clusterArn: ', self.clusterArn)
@@ -100,477 +397,3783 @@ class ClusterData():
         print('services: ', self.serviceArnList)
         for item in self.serviceDataList:
             print(item.printData())
-        
 
-def ConvertListToJsonLogFormat(inputList):
-    
-    for cluster in inputList:
-        clusterArn = cluster.clusterArn
-        sep = '/'
-        head, sep, tail = clusterArn.partition('/')
-        clusterName = tail
+# fixed bucket latency histogram, percentiles are reported as the upper bound of their bucket
+class LatencyHistogram():
 
-        if cluster.serviceDataList != []:
-            
-            for service in cluster.serviceDataList:
-                logTime = time.time()
-
-                jsonData = {}
-
-                jsonData['serviceTag'] = service.serviceTag
-                jsonData['clusterName'] = clusterName
-                jsonData['cloudFormationStackName'] = service.cfStackName
-                jsonData['containerType'] = service.containerType
-                if service.containerType == 'FARGATE':
-                   jsonData['FarGateMemory'] = service.fargateMem
-                   jsonData['FarGatevCPU'] = service.fargateVcpu
-                if service.containerType == 'EC2':
-                    jsonData['EC2InstanceType'] = service.ec2InstanceType
-                jsonData['desiredTasks'] = service.desiredTasks
-                jsonData['runningTasks'] = service.runningTasks
-                jsonData['pendingTasks'] = service.pendingTasks
-                jsonData['desiredTaskMinutes'] = service.desiredTaskMinutes
-                jsonData['runningTaskMinutes'] = service.runningTaskMinutes
-                jsonData['pendingTaskMinutes'] = service.pendingTaskMinutes
-                jsonData['desiredTaskSeconds'] = service.desiredTaskSeconds
-                jsonData['runningTaskSeconds'] = service.runningTaskSeconds
-                jsonData['pendingTaskSeconds'] = service.pendingTaskSeconds
-                jsonData['desiredTaskMS'] = service.desiredTaskMs
-                jsonData['runningTaskMS'] = service.runningTaskMs
-                jsonData['pendingTaskMS'] = service.pendingTaskMs
-                if service.timeoutSecs != 0:
-                    jsonData['timeoutSecs'] = service.timeoutSecs
-                if service.defaultWorkersPerModel != 0:
-                    jsonData['defaultWorkersPerModel'] = service.defaultWorkersPerModel
-                if service.queueSize != 0:
-                    jsonData['queueSize'] = service.queueSize
-                jsonData['serviceCostPerMinute'] = service.serviceCostPerMinute
-                dateTime = datetime.now(pytz.UTC)
-                formattedTime = dateTime.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-                jsonData['dateTime1'] = formattedTime
-
-                # only log data with valid service tags
-                if service.serviceTag != '':
-                    print(json.dumps(jsonData, default=str))
-                #    print()
-                #else:
-                #    print('=================================') 
-                #    print('serviceTag empty, item dropped! ')
-                #    print('clusterName: ', clusterName)
-                #    print('=================================')
+    BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
 
-def GetClusterList():
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.total = 0
+        self.sumMs = 0.0
+        self.maxMs = 0.0
+        self.lock = threading.Lock()
 
-    resp = {}
-    try:
-        resp = ecs_client.list_clusters()
-        
-    except Exception as e:
-        print('error during client call: ', e)
+    def observe(self, seconds):
+        ms = seconds * 1000
+        with self.lock:
+            self.counts[bisect_left(self.BUCKETS_MS, ms)] += 1
+            self.total+=1
+            self.sumMs += ms
+            self.maxMs = max(self.maxMs, ms)
 
-    clusterList = resp['clusterArns']
+    def percentile(self, p):
+        if self.total == 0:
+            return 0.0
 
-    return clusterList
+        rank = p / 100 * self.total
+        seen = 0
+        for i in range(len(self.counts)):
+            seen += self.counts[i]
+            if seen >= rank:
+                return min(float(self.BUCKETS_MS[i]), round(self.maxMs, 3)) if i < len(self.BUCKETS_MS) else round(self.maxMs, 3)
 
-def GetServiceList(clusterList):
+        return self.maxMs
 
-    dataItemList = []
+    def summary(self):
+        summary = {}
+        summary['count'] = self.total
+        summary['avgMs'] = round(self.sumMs / self.total, 3) if self.total != 0 else 0.0
+        summary['p50Ms'] = self.percentile(50)
+        summary['p90Ms'] = self.percentile(90)
+        summary['p99Ms'] = self.percentile(99)
+        summary['maxMs'] = round(self.maxMs, 3)
+        return summary
 
-    for item in clusterList:
-        
-        dataItem = ClusterData()
-        resp = {}
-        
+# error codes the apis return when a call is rate limited
+THROTTLE_ERROR_CODES = ['Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException']
+
+def GetErrorCode(e):
+
+    response = getattr(e, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code', '')
+
+    return ''
+
+# per operation api stats, kept for the life of the process
+@dataclass
+class ApiCallStats():
+    calls: int = 0
+    errors: int = 0
+    throttles: int = 0
+    retries: int = 0
+    coalesced: int = 0 # calls answered by an identical call already in flight
+    latency: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+# collector self instrumentation: wall time per stage, api call counts / latency / retries / throttles
+# per operation and records emitted. Stage times and the cycle counters are reset every cycle,
+# the api stats and totals are cumulative so they can be scraped as prometheus counters
+class CollectorMetrics():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.api = {}
+        self.stageSeconds = {}
+        self.cycleApi = {}
+        self.cycles = 0
+        self.cycleSeconds = 0.0
+        self.cycleStart = 0.0
+        self.recordsTotal = 0
+        self.cycleRecords = 0
+
+    def beginCycle(self):
+        with self.lock:
+            self.stageSeconds = {}
+            self.cycleApi = {}
+            self.cycleStart = time.perf_counter()
+
+    def endCycle(self, records):
+        with self.lock:
+            self.cycles+=1
+            self.cycleSeconds = time.perf_counter() - self.cycleStart
+            self.cycleRecords = records
+            self.recordsTotal += records
+
+    def recordStage(self, name, seconds):
+        with self.lock:
+            self.stageSeconds[name] = self.stageSeconds.get(name, 0.0) + seconds
+
+    def getApiStats(self, operation):
+        stats = self.api.get(operation)
+        if stats == None:
+            with self.lock:
+                stats = self.api.setdefault(operation, ApiCallStats())
+        return stats
+
+    def recordApiCall(self, operation, seconds, resp=None, error=None):
+        stats = self.getApiStats(operation)
+        stats.latency.observe(seconds)
+
+        retries = 0
+        metadata = resp.get('ResponseMetadata') if isinstance(resp, dict) else None
+        if error != None and isinstance(getattr(error, 'response', None), dict):
+            metadata = error.response.get('ResponseMetadata')
+        if metadata != None:
+            retries = int(metadata.get('RetryAttempts', 0))
+
+        with self.lock:
+            stats.calls+=1
+            stats.retries += retries
+            cycleCounts = self.cycleApi.setdefault(operation, [0, 0, 0, 0, 0]) # calls, errors, throttles, retries, coalesced
+            cycleCounts[0]+=1
+            cycleCounts[3] += retries
+            if error != None:
+                stats.errors+=1
+                cycleCounts[1]+=1
+                if GetErrorCode(error) in THROTTLE_ERROR_CODES:
+                    stats.throttles+=1
+                    cycleCounts[2]+=1
+
+    def recordRetry(self, operation):
+        stats = self.getApiStats(operation)
+        with self.lock:
+            stats.retries+=1
+            self.cycleApi.setdefault(operation, [0, 0, 0, 0, 0])[3]+=1
+
+    # throttled attempts the sdk retried on its own, these never surface as errors
+    def recordThrottledRetry(self, operation):
+        stats = self.getApiStats(operation)
+        with self.lock:
+            stats.throttles+=1
+            self.cycleApi.setdefault(operation, [0, 0, 0, 0, 0])[2]+=1
+
+    def recordCoalesced(self, operation):
+        stats = self.getApiStats(operation)
+        with self.lock:
+            stats.coalesced+=1
+            self.cycleApi.setdefault(operation, [0, 0, 0, 0, 0])[4]+=1
+
+    def formatCycleRecord(self):
+        jsonData = {}
+        jsonData['recordType'] = 'collectorStats'
+        jsonData['cycleSeconds'] = round(self.cycleSeconds, 3)
+        jsonData['records'] = self.cycleRecords
+        jsonData['apiCalls'] = sum(c[0] for c in self.cycleApi.values())
+        jsonData['apiErrors'] = sum(c[1] for c in self.cycleApi.values())
+        jsonData['apiThrottles'] = sum(c[2] for c in self.cycleApi.values())
+        jsonData['apiRetries'] = sum(c[3] for c in self.cycleApi.values())
+        jsonData['apiCoalesced'] = sum(c[4] for c in self.cycleApi.values())
+        jsonData['stageSeconds'] = {k: round(v, 3) for k, v in self.stageSeconds.items()}
+        api = {}
+        for operation, counts in sorted(self.cycleApi.items()):
+            latency = self.api[operation].latency
+            api[operation] = {
+                'calls': counts[0],
+                'errors': counts[1],
+                'throttles': counts[2],
+                'retries': counts[3],
+                'coalesced': counts[4],
+                'p50Ms': latency.percentile(50),
+                'p99Ms': latency.percentile(99)
+            }
+        jsonData['api'] = api
+        return jsonData
+
+    def renderPrometheus(self):
+        lines = []
+        lines.append('# TYPE service_metrics_cycles_total counter')
+        lines.append('service_metrics_cycles_total ' + str(self.cycles))
+        lines.append('# TYPE service_metrics_cycle_seconds gauge')
+        lines.append('service_metrics_cycle_seconds ' + repr(self.cycleSeconds))
+        lines.append('# TYPE service_metrics_records_emitted_total counter')
+        lines.append('service_metrics_records_emitted_total ' + str(self.recordsTotal))
+        lines.append('# TYPE service_metrics_stage_seconds gauge')
+        for name, seconds in sorted(self.stageSeconds.items()):
+            lines.append('service_metrics_stage_seconds{stage="' + name + '"} ' + repr(seconds))
+
+        for metric, attr in [('calls', 'calls'), ('errors', 'errors'), ('throttles', 'throttles'), ('retries', 'retries'), ('coalesced', 'coalesced')]:
+            lines.append('# TYPE service_metrics_api_' + metric + '_total counter')
+            for operation, stats in sorted(self.api.items()):
+                lines.append('service_metrics_api_' + metric + '_total{operation="' + operation + '"} ' + str(getattr(stats, attr)))
+
+        lines.append('# TYPE service_metrics_api_latency_seconds histogram')
+        for operation, stats in sorted(self.api.items()):
+            latency = stats.latency
+            cumulative = 0
+            for i in range(len(LatencyHistogram.BUCKETS_MS)):
+                cumulative += latency.counts[i]
+                le = repr(LatencyHistogram.BUCKETS_MS[i] / 1000)
+                lines.append('service_metrics_api_latency_seconds_bucket{operation="' + operation + '",le="' + le + '"} ' + str(cumulative))
+            lines.append('service_metrics_api_latency_seconds_bucket{operation="' + operation + '",le="+Inf"} ' + str(latency.total))
+            lines.append('service_metrics_api_latency_seconds_sum{operation="' + operation + '"} ' + repr(latency.sumMs / 1000))
+            lines.append('service_metrics_api_latency_seconds_count{operation="' + operation + '"} ' + str(latency.total))
+
+        return '\n'.join(lines) + '\n'
+
+collectorMetrics = CollectorMetrics()
+
+# time every call of a collection stage, calls made from worker threads add up
+def TimedStage(func):
+
+    name = func.__name__
+
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
         try:
-            resp = ecs_client.list_services(
-                cluster=item,
-                maxResults=100
-            )
-        
-        except Exception as e:
-            print('error during client call: ', e)
+            return func(*args, **kwargs)
+        finally:
+            collectorMetrics.recordStage(name, time.perf_counter() - start)
 
-        dataItem.clusterArn = item
-        dataItem.serviceArnList = resp['serviceArns']
+    return timed
 
-        dataItemList.append(dataItem)
+class DeadlineExceeded(Exception):
+    pass
 
-    return dataItemList
+# deadline of the running collection cycle. Each stage gets its weight's share of the budget that is
+# left when it starts, so time a stage does not use goes to the later ones. Every api call checks the
+# deadline of the current stage first, so a stage that runs out stops at its next call
+class CycleDeadline():
 
-def GetServiceInfo(clusterArn, serviceList):
-    nullServiceInputCount = 0
-    resp = {}
+    def __init__(self, budget, stageWeights):
+        self.budget = budget
+        self.stageWeights = stageWeights
+        self.end = None
+        self.stageEnd = None
+        self.stageName = 'cycle'
+        self.expiredStages = []
+        self.abandoned = 0
 
-    try: 
-        resp = ecs_client.describe_services(
-            cluster=clusterArn,
-            services=serviceList,
-            include=['TAGS']
-        )
+    def begin(self):
+        self.stageName = 'cycle'
+        self.expiredStages = []
+        self.abandoned = 0
+        if self.budget > 0:
+            self.end = time.monotonic() + self.budget * (1 - DEADLINE_RESERVE)
+            self.stageEnd = self.end
 
-        # clean data
-        for item in resp['services']:
-            del item['events']
+    def beginStage(self, name):
+        if self.end == None:
+            return
 
-    except Exception as e:
-        nullServiceInputCount+=1
+        names = [stage for stage, weight in self.stageWeights]
+        weights = [weight for stage, weight in self.stageWeights]
+        i = names.index(name)
+        now = time.monotonic()
+        self.stageName = name
+        self.stageEnd = now + max(self.end - now, 0.0) * weights[i] / sum(weights[i:])
 
-    if serviceList != 0 and resp != {}:
-        return resp['services']
-    else:
-        return []
+    def endCycle(self):
+        self.end = None
+        self.stageEnd = None
 
-# return a list of lists where the composing list sizes are 10 max
-def SplitServicesIntoListofTen(inputList):
-    outputList = []
-    listOfTen = []
+    def expired(self):
+        return self.stageEnd != None and time.monotonic() >= self.stageEnd
 
-    count = 1
-    for item in inputList:
+    # seconds left in the current stage, None without a deadline
+    def remaining(self):
+        if self.stageEnd == None:
+            return None
+        return max(self.stageEnd - time.monotonic(), 0.0)
 
-        listOfTen.append(item)
-        if count % 10 == 0:
-            outputList.append(listOfTen)
-            listOfTen=[]
-        count+=1
-        if item == inputList[-1]:
-            outputList.append(listOfTen)
+    def check(self, seconds=0.0):
+        if self.stageEnd != None and time.monotonic() + seconds >= self.stageEnd:
+            if self.stageName not in self.expiredStages:
+                self.expiredStages.append(self.stageName)
+            raise DeadlineExceeded(self.stageName + ' ran out of time')
 
-    return outputList
+cycleDeadline = CycleDeadline(CYCLE_BUDGET, STAGE_BUDGET_WEIGHTS)
 
-def CollectServiceData(inputList):
+# print a failed call (calls cut off by the deadline are expected) and mark the service / cluster it was for
+def HandleCallError(e, data=None):
 
-    itemCount = 0
-    errorCount = 0
-    
-    for item in inputList:
-        itemCount+=1
-
-        servicesResp = []
-        serviceDataList = []
-        stackName = ''
-
-        if item.serviceArnList != [] and len(item.serviceArnList) <= 10:
-            servicesResp = GetServiceInfo(item.clusterArn, item.serviceArnList)
-            stackName = GetStackNameFromClusterId(item.clusterArn)            
-
-        else: # service list is greater than 10 
-            listOfTenServicesList =  SplitServicesIntoListofTen(item.serviceArnList)
-            stackName = GetStackNameFromClusterId(item.clusterArn)
-            respTotal = []
-            for i in listOfTenServicesList:
-                respPart = GetServiceInfo(item.clusterArn, i)
-                respTotal+=respPart
-            
-            servicesResp = respTotal
-
-        for entry in servicesResp:
-
-            serviceData = ServiceData()
-            serviceTag = ''
-            ec2InstanceType = ''
-            # safe guard tag check
+    if data != None:
+        data.dataStatus = 'partial'
+    if not isinstance(e, DeadlineExceeded):
+        print('error during client call: ', e)
+
+# wraps a boto3 (or stand in) client so every api call is timed and counted by operation
+class InstrumentedClient():
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = {}
+        self.eventsRegistered = False
+
+    # done on the first call so lazy clients are not created up front
+    def registerEvents(self):
+        self.eventsRegistered = True
+        events = getattr(getattr(self.client, 'meta', None), 'events', None)
+        if events != None:
+            events.register('needs-retry.*', self.onNeedsRetry)
+
+    def onNeedsRetry(self, response=None, operation=None, **kwargs):
+        if response != None and operation != None:
+            if response[1].get('Error', {}).get('Code', '') in THROTTLE_ERROR_CODES:
+                from botocore import xform_name
+                collectorMetrics.recordThrottledRetry(xform_name(operation.name))
+
+    def __getattr__(self, name):
+        call = self.calls.get(name)
+        if call != None:
+            return call
+
+        attr = getattr(self.client, name)
+        if name.startswith('_') or not callable(attr) or name in ['get_paginator', 'get_waiter', 'can_paginate']:
+            return attr
+        if not self.eventsRegistered:
+            self.registerEvents()
+
+        def call(**kwargs):
+            start = time.perf_counter()
+            try:
+                resp = attr(**kwargs)
+            except Exception as e:
+                collectorMetrics.recordApiCall(name, time.perf_counter() - start, error=e)
+                raise
+            collectorMetrics.recordApiCall(name, time.perf_counter() - start, resp)
+            return resp
+
+        self.calls[name] = call
+
+        return call
+
+# responses carry datetimes, they are tagged so replay hands back the same types
+def EncodeRecordedValue(value):
+
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, (bytes, bytearray)):
+        return {'$bytes': value.decode('latin-1')}
+
+    return str(value)
+
+def DecodeRecordedValue(obj):
+
+    if '$datetime' in obj and len(obj) == 1:
+        return datetime.fromisoformat(obj['$datetime'])
+    if '$bytes' in obj and len(obj) == 1:
+        return obj['$bytes'].encode('latin-1')
+
+    return obj
+
+def GetCallKey(service, operation, params):
+
+    return service + ' ' + operation + ' ' + json.dumps(params, sort_keys=True, default=EncodeRecordedValue)
+
+# api calls of the cycle, written as one gzip member at the end of the cycle so a crash
+# never leaves a truncated stream behind and recordings of several cycles just append
+class ApiRecorder():
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.lock = threading.Lock()
+        self.lines = []
+
+    def record(self, service, operation, params, seconds, resp=None, error=None):
+        entry = {'service': service, 'operation': operation, 'params': params, 'latency': round(seconds, 6)}
+        if error != None:
+            if isinstance(getattr(error, 'response', None), dict):
+                entry['error'] = error.response
+            else:
+                entry['error'] = {'Error': {'Code': type(error).__name__, 'Message': str(error)}}
+        else:
+            resp = dict(resp)
+            metadata = resp.pop('ResponseMetadata', {})
+            resp['ResponseMetadata'] = {'RetryAttempts': metadata.get('RetryAttempts', 0)}
+            entry['response'] = resp
+
+        line = json.dumps(entry, default=EncodeRecordedValue) + '\n'
+        with self.lock:
+            self.lines.append(line)
+
+    def flush(self):
+        with self.lock:
+            lines = self.lines
+            self.lines = []
+
+        if lines != []:
             try:
-                
-                if entry['tags']:
-                    for index in entry['tags']:
-                        if index['key'] == 'Service':
-                            serviceTag = index['value']
+                with gzip.open(self.fileName, 'at') as f:
+                    f.writelines(lines)
+            except Exception as e:
+                print('error writing api recording: ', e)
+
+apiRecorder = ApiRecorder(RECORD_FILE)
+
+# passes every call through to the client and records it
+class RecordingClient():
 
+    def __init__(self, client, service, recorder):
+        self.client = client
+        self.service = service
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name.startswith('_') or not callable(attr) or name in ['get_paginator', 'get_waiter', 'can_paginate']:
+            return attr
+
+        def call(**kwargs):
+            start = time.perf_counter()
+            try:
+                resp = attr(**kwargs)
             except Exception as e:
-                errorCount+=1
-                            
-            serviceData.serviceTag = serviceTag
-            serviceData.serviceName = str(entry['serviceName'])
-            serviceData.serviceArn = str(entry['serviceArn'])
-            serviceData.cfStackName = stackName
-            serviceData.containerType = str(entry['launchType'])
-            if str(entry['launchType']) == 'EC2':
-                ec2InstanceType = GetEc2InstanceTypeFromClusterId(item.clusterArn)
-            serviceData.ec2InstanceType = ec2InstanceType
-            serviceData.desiredTasks = int(entry['desiredCount'])
-            serviceData.runningTasks = int(entry['runningCount'])
-            serviceData.pendingTasks = int(entry['pendingCount'])
-            serviceData.desiredTaskMinutes = int(entry['desiredCount']) * 1
-            serviceData.runningTaskMinutes = int(entry['runningCount']) * 1
-            serviceData.pendingTaskMinutes = int(entry['pendingCount']) * 1
-            serviceData.desiredTaskSeconds = int(entry['desiredCount']) * 60
-            serviceData.runningTaskSeconds = int(entry['runningCount']) * 60
-            serviceData.pendingTaskSeconds = int(entry['pendingCount']) * 60
-            serviceData.desiredTaskMs = (int(entry['desiredCount']) * 60) * 1000
-            serviceData.runningTaskMs = (int(entry['runningCount']) * 60) * 1000
-            serviceData.pendingTaskMs = (int(entry['pendingCount']) * 60) * 1000
-            serviceData.serviceCostPerMinute = float(0.00)
-            
-            serviceDataList.append(serviceData)
-
-        item.serviceDataList = serviceDataList                    
-
-    return inputList            
+                self.recorder.record(self.service, name, kwargs, time.perf_counter() - start, error=e)
+                raise
+            self.recorder.record(self.service, name, kwargs, time.perf_counter() - start, resp)
+            return resp
 
-def GetTaskArns(clusterDataList):
+        return call
 
-    for cluster in clusterDataList:
-        serviceDataList = []
-        clusterArn = cluster.clusterArn
+# recorded calls indexed by service, operation and parameters. Calls with the same key are replayed
+# in recorded order, once they run out the last one repeats so several cycles can replay one recording
+class ApiReplay():
 
-        if cluster.serviceDataList != []:
-            
-            for service in cluster.serviceDataList:
-                resp = {}
-
-                try:
-                    resp = ecs_client.list_tasks(
-                        cluster=clusterArn,
-                        serviceName=service.serviceName,
-                        launchType=service.containerType,
-                        maxResults=100 # FUTURE: this might be a problem for summarization scaling in the future 
-                    )
-                    
-                    taskArnList = resp['taskArns']
-                    #print(taskArnList)
-                    service.taskArns = taskArnList
-                    
-                except Exception as e:
-                    print('error during client call: ', e)
+    def __init__(self, fileName, honorLatency=False):
+        self.fileName = fileName
+        self.honorLatency = honorLatency
+        self.lock = threading.Lock()
+        self.calls = None
+        self.positions = {}
 
-                serviceDataList.append(service)
-        
-        cluster.serviceDataList = serviceDataList
+    def load(self):
+        calls = {}
+        with gzip.open(self.fileName, 'rt') as f:
+            for line in f:
+                entry = json.loads(line, object_hook=DecodeRecordedValue)
+                key = GetCallKey(entry['service'], entry['operation'], entry['params'])
+                calls.setdefault(key, []).append(entry)
+        self.calls = calls
 
-    return clusterDataList                    
+    def call(self, service, operation, params):
+        with self.lock:
+            if self.calls == None:
+                self.load()
+            key = GetCallKey(service, operation, params)
+            entries = self.calls.get(key)
+            if entries == None:
+                raise GetReplayError({'Error': {'Code': 'ReplayMissingCall', 'Message': 'no recorded call for ' + key}}, operation)
+            position = self.positions.get(key, 0)
+            self.positions[key] = position + 1
+            entry = entries[min(position, len(entries) - 1)]
 
-def GetFargateInfo(clusterDataList):
-    
-    for cluster in clusterDataList:
-        serviceDataList = []
-        clusterArn = cluster.clusterArn
+        if self.honorLatency:
+            time.sleep(entry['latency'])
+        if 'error' in entry:
+            raise GetReplayError(entry['error'], operation)
 
-        if cluster.serviceDataList != []:
-            
-            for service in cluster.serviceDataList:
-    
-               if service.taskArns != []:
-                    resp = {}
-                    
-                    try:
-                        resp = ecs_client.describe_tasks(
-                            cluster=clusterArn,
-                            tasks=service.taskArns,
-                            include=['TAGS']
-                        )
-
-                        taskDefs = []
-                        # grab fargate and taskDef data
-                        if service.containerType != 'EC2':
-                            
-                            mem = 0
-                            cpu = 0
-                            for task in resp['tasks']:
-                                mem += int(task['memory'])
-                                cpu += int(task['cpu'])
-                                taskDefs.append(task['taskDefinitionArn'])
-
-                            service.fargateMem =  mem
-                            service.fargateVcpu = cpu
-                            service.taskDefinitions = taskDefs
-
-                        # just grab taskDef data
-                        else:
-                            for task in resp['tasks']:
-                                taskDefs.append(task['taskDefinitionArn'])
-                            
-                            service.taskDefinitions = taskDefs
-
-                    except Exception as e:
-                        print('error during client call: ', e)
-
-               serviceDataList.append(service)
-  
-        cluster.serviceDataList = serviceDataList
-    
-    return clusterDataList
+        return entry['response']
 
-def GetStackNameFromClusterId(clusterArn):
+# botocore is only imported once a replayed call fails
+def GetReplayError(error, operation):
 
-    stackName = ''
+    from botocore.exceptions import ClientError
 
-    resp = {}
-    try:
-        resp = ecs_client.describe_clusters(
-            clusters=[clusterArn],
-            include=['ATTACHMENTS','CONFIGURATIONS','SETTINGS','STATISTICS','TAGS']
-        )
+    return ClientError(error, operation)
 
-    except Exception as e:
-        print('error during client call: ', e)
+apiReplay = ApiReplay(REPLAY_FILE, honorLatency=REPLAY_LATENCY != 0)
 
-    tags = resp['clusters'][0]['tags']
+# stand in for a boto3 client that answers from a recording
+class ReplayClient():
 
-    for item in tags:
-        if item['key'] == 'aws:cloudformation:stack-name':
-            stackName = item['value']
+    def __init__(self, service, replay):
+        self.service = service
+        self.replay = replay
 
-    return stackName
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
 
-def GetEc2InstanceTypeFromClusterId(clusterArn):
+        def call(**kwargs):
+            return self.replay.call(self.service, name, kwargs)
 
-    ec2InstanceType = ''
+        return call
 
-    # list container instances for each cluster
-    # describe the container instances for each cluster
-    # get the underlying EC2 instance type from the container desc 
-    # double check that the first one grabbed is good (they should all match in the cluster)
-    resp = {}
-    try:
-        resp = ecs_client.list_container_instances(
-            cluster=clusterArn,
-        )
+# error codes worth another attempt besides the throttles
+RETRYABLE_ERROR_CODES = THROTTLE_ERROR_CODES + ['ServiceUnavailable', 'ServiceUnavailableException', 'InternalError', 'InternalFailure', 'ServerException', 'RequestTimeout']
 
-    except Exception as e:
-        print('error during client call: ', e)
+# only reads are retried, they are safe to repeat
+def IsReadOperation(operation):
 
-    containerList = resp['containerInstanceArns']
+    return operation.startswith('describe_') or operation.startswith('list_') or operation.startswith('get_')
 
-    if containerList != []:
+def IsRetryableError(e):
+
+    # only a loaded botocore can have raised its connection errors
+    if 'botocore.exceptions' in sys.modules:
+        from botocore.exceptions import ConnectionError as BotoConnectionError, HTTPClientError
+        if isinstance(e, (BotoConnectionError, HTTPClientError)):
+            return True
+
+    return GetErrorCode(e) in RETRYABLE_ERROR_CODES
+
+# token bucket of one api operation. The rate is cut by API_RATE_DECREASE on a throttle (at most once
+# per API_CUT_SECONDS) and raised by API_RATE_INCREASE / rate per successful call (API_RATE_INCREASE
+# calls per second every second), so it keeps probing upwards once the throttling stops. A configured
+# rate is the ceiling, an unlimited operation has none
+class OperationLimiter():
+
+    def __init__(self, rate, burst):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.maxRate = rate # 0: no ceiling
+        self.cutAt = 0.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.windowStart = self.updated
+        self.windowCalls = 0
+        self.observedRate = 0.0
+
+    # take a token, returns how long the caller has to wait for it
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+
+            # call rate of the last second, the starting point once an unlimited operation throttles
+            self.windowCalls+=1
+            if now - self.windowStart >= 1.0:
+                self.observedRate = self.windowCalls / (now - self.windowStart)
+                self.windowStart = now
+                self.windowCalls = 0
+
+            if self.rate == 0:
+                return 0.0
+
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+
+            return -self.tokens / self.rate
+
+    def onThrottle(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.rate == 0:
+                elapsed = max(now - self.windowStart, 1.0)
+                self.rate = max(self.observedRate, self.windowCalls / elapsed, API_MIN_RATE)
+                self.updated = now
+                self.tokens = min(self.tokens, 1.0)
+            elif now - self.cutAt < API_CUT_SECONDS:
+                return
+            self.rate = max(self.rate * API_RATE_DECREASE, API_MIN_RATE)
+            self.cutAt = now
+
+    def onSuccess(self):
+        if self.rate != 0 and (self.maxRate == 0 or self.rate < self.maxRate):
+            with self.lock:
+                rate = self.rate + API_RATE_INCREASE / self.rate
+                self.rate = min(rate, self.maxRate) if self.maxRate != 0 else rate
+
+# rate limits, retries and coalesces the calls of a client, shared by every worker thread:
+# one token bucket per operation, throttled or failed reads are retried with exponential backoff
+# and full jitter, and identical calls already in flight wait for the same response
+class ThrottledClient():
+
+    def __init__(self, client, rate=API_RATE, burst=API_BURST, maxRetries=API_MAX_RETRIES):
+        self.client = client
+        self.rate = rate
+        self.burst = burst
+        self.maxRetries = maxRetries
+        self.lock = threading.Lock()
+        self.limiters = {}
+        self.inFlight = {}
+        self.calls = {}
+
+    def getLimiter(self, operation):
+        with self.lock:
+            limiter = self.limiters.get(operation)
+            if limiter == None:
+                limiter = self.limiters[operation] = OperationLimiter(self.rate, self.burst)
+        return limiter
+
+    def callWithRetries(self, operation, call, kwargs):
+        limiter = self.getLimiter(operation)
+        retries = self.maxRetries if IsReadOperation(operation) else 0
+
+        attempt = 0
+        while True:
+            cycleDeadline.check()
+            wait = limiter.reserve()
+            if wait > 0:
+                cycleDeadline.check(wait)
+                time.sleep(wait)
+            try:
+                resp = call(**kwargs)
+                limiter.onSuccess()
+                return resp
+            except Exception as e:
+                if GetErrorCode(e) in THROTTLE_ERROR_CODES:
+                    limiter.onThrottle()
+                if attempt >= retries or not IsRetryableError(e):
+                    raise
+            backoff = random.uniform(0, min(API_BACKOFF_CAP, API_BACKOFF_BASE * 2 ** attempt))
+            cycleDeadline.check(backoff)
+            time.sleep(backoff)
+            attempt+=1
+            collectorMetrics.recordRetry(operation)
+
+    def callCoalesced(self, operation, call, kwargs):
+        key = GetCallKey('', operation, kwargs)
+        with self.lock:
+            entry = self.inFlight.get(key)
+            leader = entry == None
+            if leader:
+                entry = self.inFlight[key] = [Future(), 0] # response, followers
+            else:
+                entry[1]+=1
+
+        future = entry[0]
+        if not leader:
+            collectorMetrics.recordCoalesced(operation)
+            # callers change the responses they get (e.g. dropping service events), hand out a copy
+            return copy.deepcopy(future.result())
 
-        resp2 = {}
         try:
-            resp2 = ecs_client.describe_container_instances(
-                cluster=clusterArn,
-                containerInstances=containerList
-            )
+            resp = self.callWithRetries(operation, call, kwargs)
         except Exception as e:
-            print('error during client call: ', e)
+            with self.lock:
+                del self.inFlight[key]
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.inFlight[key]
+            followers = entry[1]
+        future.set_result(resp)
+
+        # the followers copy the stored response, the leader's caller gets its own copy as well
+        return copy.deepcopy(resp) if followers != 0 else resp
+
+    def __getattr__(self, name):
+        call = self.calls.get(name)
+        if call != None:
+            return call
+
+        attr = getattr(self.client, name)
+        if name.startswith('_') or not callable(attr) or name in ['get_paginator', 'get_waiter', 'can_paginate']:
+            return attr
+
+        def call(**kwargs):
+            if IsReadOperation(name):
+                return self.callCoalesced(name, attr, kwargs)
+            return self.callWithRetries(name, attr, kwargs)
+
+        self.calls[name] = call
+
+        return call
+
+# install the clients every collection stage uses, wrapped with the recording, instrumentation and
+# rate limiting layers. Every attempt is recorded and instrumented, retries happen above them
+def SetClients(ecsClient, ec2Client):
+
+    global ecs_client, ec2_client
+
+    if RECORD_FILE != '':
+        ecsClient = RecordingClient(ecsClient, 'ecs', apiRecorder)
+        ec2Client = RecordingClient(ec2Client, 'ec2', apiRecorder)
+
+    ecs_client = ThrottledClient(InstrumentedClient(ecsClient))
+    ec2_client = ThrottledClient(InstrumentedClient(ec2Client))
+
+if REPLAY_FILE != '':
+    SetClients(ReplayClient('ecs', apiReplay), ReplayClient('ec2', apiReplay))
+else:
+    SetClients(LazyClient('ecs'), LazyClient('ec2'))
+
+def StartMetricsServer(port):
+
+    # only needed with the endpoint turned on, kept out of the import
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
 
-        instanceIdList = []
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
 
-        for item in resp2['containerInstances']:
-            instanceIdList.append(item['ec2InstanceId'])
+            body = collectorMetrics.renderPrometheus()
+            if sinkWriter != None:
+                body += sinkWriter.renderPrometheus()
+            body = body.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # stdout is the log stream, keep access logs out of it
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('', port), MetricsRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+# size bounded lru cache of the settings pulled out of each task definition revision,
+# a revision arn is immutable so entries never need to be refreshed
+class TaskDefinitionCache():
+
+    def __init__(self, maxSize, cacheFile=''):
+        self.maxSize = maxSize
+        self.cacheFile = cacheFile
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def get(self, taskDefArn):
+        with self.lock:
+            entry = self.entries.get(taskDefArn)
+            if entry == None:
+                self.misses+=1
+                return None
+
+            self.entries.move_to_end(taskDefArn)
+            self.hits+=1
+            return entry
+
+    def put(self, taskDefArn, entry):
+        with self.lock:
+            self.entries[taskDefArn] = entry
+            self.entries.move_to_end(taskDefArn)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def resetStats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+    def load(self):
+        if self.cacheFile == '' or not os.path.exists(self.cacheFile):
+            return
 
-        resp3 = {}
         try:
-            resp3 = ec2_client.describe_instances(
-                InstanceIds=instanceIdList
-            )
+            with open(self.cacheFile) as f:
+                entries = json.load(f)
+            # file is written least recently used first
+            for taskDefArn, entry in entries.items():
+                self.put(taskDefArn, entry)
+            self.dirty = False
+
         except Exception as e:
-            print('error during client call: ', e)
+            print('could not load task definition cache: ', e)
 
-        instanceTypeList = []
+    def save(self):
+        if self.cacheFile == '' or not self.dirty:
+            return
 
-        reservations = resp3['Reservations']
-        for r in reservations:
-            for instances in r['Instances']:
-                instanceTypeList.append(instances['InstanceType'])
+        try:
+            with self.lock:
+                entries = dict(self.entries)
+                self.dirty = False
+            tmpFile = self.cacheFile + '.tmp'
+            with open(tmpFile, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmpFile, self.cacheFile)
+
+        except Exception as e:
+            print('could not save task definition cache: ', e)
 
-        # check if all items in the list are identical
-        #identical = instanceTypeList[1:] == instanceTypeList[:-1]
-        #print('truth: ', identical, ' value: ', instanceTypeList)
+# lives for the whole process so only new task definition revisions hit the api
+taskDefCache = TaskDefinitionCache(TASKDEF_CACHE_SIZE, TASKDEF_CACHE_FILE)
 
-        ec2InstanceType = instanceTypeList[0]
-    
-    return ec2InstanceType
+# fields derived from the task level calls, carried over for unchanged services
+TASK_DERIVED_FIELDS = ['taskArns', 'taskStatuses', 'taskDefinitions', 'containerInstanceArns', 'fargateMem', 'fargateVcpu', 'timeoutSecs', 'defaultWorkersPerModel', 'queueSize', 'taskColumns']
 
+# previous cycle's services by service arn, used by the incremental mode
+class ServiceSnapshot():
 
-def GetTaskDetails(clusterDataList):
-    
-    for cluster in clusterDataList:
-        serviceDataList = []
-        clusterArn = cluster.clusterArn
+    def __init__(self, refreshInterval, clock=time.time):
+        self.refreshInterval = refreshInterval
+        self.clock = clock
+        self.services = {}
+        self.nextServices = {}
+        self.refreshedAt = None
+        self.fullRefresh = True
+        self.refreshRequested = False
+        self.reused = 0
+
+    # the scheduler's taskRefresh job requests the full refresh on its tick, runs without a scheduler
+    # (one-shot, lambda) fall back on the age of the last one
+    def beginCycle(self):
+        now = self.clock()
+        self.nextServices = {}
+        self.fullRefresh = self.refreshRequested or self.refreshedAt == None or now - self.refreshedAt >= self.refreshInterval
+        if self.fullRefresh:
+            self.refreshedAt = now
+        self.refreshRequested = False
+        self.reused = 0
+
+    # force the next cycle to re-collect every service
+    def requestFullRefresh(self):
+        self.refreshRequested = True
+
+    # copy the task level fields over if the service state matches the last cycle
+    def reuse(self, service):
+        if self.fullRefresh:
+            return False
 
-        if cluster.serviceDataList != []:
-            
+        previous = self.services.get(service.serviceArn)
+        if previous == None or previous.stateFingerprint != service.stateFingerprint or previous.dataStatus != '':
+            return False
+
+        for name in TASK_DERIVED_FIELDS:
+            setattr(service, name, getattr(previous, name))
+        service.unchanged = True
+        self.reused+=1
+
+        return True
+
+    def add(self, service):
+        self.nextServices[service.serviceArn] = service
+
+    # replace the snapshot so services removed since the last cycle drop out
+    def commit(self):
+        self.services = self.nextServices
+        self.nextServices = {}
+
+    def update(self, clusterDataList):
+        for cluster in clusterDataList:
             for service in cluster.serviceDataList:
-    
-               # only GPU services are using torch serv ?!?!?!
-               #service.containerType != 'FARGATE' and 
-               if service.taskDefinitions != []:
-                    resp = {}
-                    
-                    try:
-                        resp = ecs_client.describe_task_definition(
-                            taskDefinition=str(service.taskDefinitions[0]), # all tasks have the same config, grab the first and move on
-                            include=['TAGS']
-                        )
-                        defaultWorkersKey = 'TS_DEFAULT_WORKERS_PER_MODEL'
-                        requestTimeoutKey = 'MT_REQUEST_TIMEOUT'
-                        queueSizeKey = 'TS_JOB_QUEUE_SIZE'
-                        tsTimeoutSecs = 0
-                        tsDefaultWorkersPerModel = 0
-                        tsQueueSize = 0
-                        
-                        taskDef = resp['taskDefinition']
-                        for item in taskDef['containerDefinitions']:
-                            env = item['environment']
-                            for var in item['environment']:
-                                if var['name'] == defaultWorkersKey:
-                                    tsDefaultWorkersPerModel = var['value']
-                                    #print(var['name'], var['value'])
-                                if var['name'] == requestTimeoutKey:
-                                    tsTimeoutSecs = var['value']
-                                    #print(var['name'], var['value'])
-                                if var['name'] == queueSizeKey:
-                                    tsQueueSize = var['value']
-                                    #print(var['name'], var['value'])
-                                    
-                        service.timeoutSecs = int(tsTimeoutSecs)
-                        service.defaultWorkersPerModel = int(tsDefaultWorkersPerModel)
-                        service.queueSize = int(tsQueueSize)
-                        
-                    except Exception as e:
-                        print('error during client call: ', e)  
-
-               serviceDataList.append(service)
-  
-        cluster.serviceDataList = serviceDataList
-    
-    return clusterDataList
+                self.add(service)
+        self.commit()
 
-def logToScreen(inputList):
+serviceSnapshot = ServiceSnapshot(TASK_REFRESH_INTERVAL)
 
-    for item in inputList:
-        item.printData()
+# last complete values of every service, filled in for services a cycle under the deadline left incomplete
+class LastKnownServices():
 
+    def __init__(self):
+        self.services = {} # service arn -> last complete ServiceData
+        self.clusters = {} # cluster arn -> service arns of the last full service list
+        self.stale = 0
+        self.partial = 0
 
-def CollectServiceMetrics():
+    def beginCycle(self):
+        self.stale = 0
+        self.partial = 0
 
-    clusterList = GetClusterList()
-    clusterDataList = GetServiceList(clusterList)  
-    clusterAndServiceDataList = CollectServiceData(clusterDataList)
-    cstDataList = GetTaskArns(clusterAndServiceDataList)
-    cstUpdatedDataList = GetFargateInfo(cstDataList)
-    cstUpdatedDataList = GetTaskDetails(cstUpdatedDataList)
-    ConvertListToJsonLogFormat(cstUpdatedDataList)
+    def fillService(self, service):
+        if service.dataStatus == '':
+            self.services[service.serviceArn] = service
+            return service
 
-if __name__ == "__main__":
+        previous = self.services.get(service.serviceArn)
+        if previous == None:
+            self.partial+=1
+            return service
+
+        for name in TASK_DERIVED_FIELDS:
+            setattr(service, name, getattr(previous, name))
+        service.dataStatus = 'stale'
+        self.stale+=1
+
+        return service
+
+    # services the list or describe calls did not return in time are logged with their last known values
+    def fillCluster(self, cluster):
+        for service in cluster.serviceDataList:
+            self.fillService(service)
+
+        if cluster.dataStatus == '':
+            serviceArns = set(cluster.serviceArnList)
+            for serviceArn in self.clusters.get(cluster.clusterArn, set()) - serviceArns:
+                self.services.pop(serviceArn, None)
+            self.clusters[cluster.clusterArn] = serviceArns
+        else:
+            serviceArns = self.clusters.get(cluster.clusterArn, set())
+
+        described = set(service.serviceArn for service in cluster.serviceDataList)
+        for serviceArn in sorted(serviceArns - described):
+            previous = self.services.get(serviceArn)
+            if previous != None:
+                service = copy.copy(previous)
+                service.dataStatus = 'stale'
+                cluster.serviceDataList.append(service)
+                self.stale+=1
+
+    def fill(self, clusterDataList):
+        for cluster in clusterDataList:
+            self.fillCluster(cluster)
+
+lastKnownServices = LastKnownServices()
+
+# results of the slower collection stages, kept between cycles until their stage expires them
+class CollectionState():
+
+    def __init__(self):
+        self.clusterList = None
+        self.lastClusterList = None
+        self.clusterListFailed = False # the last read of the cluster list failed
+        self.clusterListTime = 0.0
+        self.clusterIndex = {}
+        self.inventories = {}
+
+    def expireClusters(self):
+        if self.clusterList != None:
+            self.lastClusterList = self.clusterList
+        self.clusterList = None
+
+    def expireInventories(self):
+        self.inventories = {}
+
+    def expireAll(self):
+        self.expireClusters()
+        self.expireInventories()
+
+    # stages collected longer ago than their interval, for runs the scheduler does not expire
+    # (a warm start or a warm lambda invocation)
+    def expireAged(self, now):
+        if self.clusterList != None and now - self.clusterListTime >= CLUSTER_LIST_INTERVAL:
+            self.expireClusters()
+        self.inventories = {arn: inventory for arn, inventory in self.inventories.items() if now - inventory.collectedAt < INVENTORY_INTERVAL}
+
+collectionState = CollectionState()
+
+# rendezvous (highest random weight) hashing of clusters and services onto replicas: a key belongs to
+# the replica with the highest hash of key + replica, so when the replica count changes only the keys
+# won or lost by the added / removed replicas move
+class ShardAssignment():
+
+    def __init__(self, index, count):
+        self.auto = count == 'auto'
+        self.index = index
+        self.count = 1
+        if not self.auto:
+            try:
+                self.count = max(int(count), 1)
+            except ValueError as e:
+                print('invalid SM_REPLICA_COUNT value, using default value: 1')
+        if self.index >= self.count:
+            print('SM_REPLICA_INDEX out of range, using default value: 0')
+            self.index = 0
+
+    def getWeight(self, key, replica):
+        digest = hashlib.blake2b((key + '#' + str(replica)).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+
+    def owns(self, key):
+        if self.count == 1:
+            return True
+        owner = max(range(self.count), key=lambda replica: self.getWeight(key, replica))
+        return owner == self.index
+
+    # large clusters are split by service, the rest go to one replica whole
+    def isSplit(self, metadata):
+        return self.count > 1 and metadata.activeServicesCount > SHARD_SERVICES_THRESHOLD
+
+    def ownsService(self, clusterArn, serviceName, metadata=None):
+        if metadata != None and self.isSplit(metadata):
+            return self.owns(clusterArn + '/' + serviceName)
+        return self.owns(clusterArn)
+
+    # index / count from the running tasks of the collector's own service, sorted by task arn
+    def refresh(self):
+        if not self.auto:
+            return
+
+        try:
+            import urllib.request
+            with urllib.request.urlopen(os.environ['ECS_CONTAINER_METADATA_URI_V4'] + '/task', timeout=2) as resp:
+                task = json.load(resp)
+            taskArns = sorted(PaginateCall(
+                ecs_client.list_tasks,
+                'taskArns',
+                cluster=task['Cluster'],
+                family=task['Family'],
+                desiredStatus='RUNNING'
+            ))
+            if task['TaskARN'] in taskArns:
+                self.index = taskArns.index(task['TaskARN'])
+                self.count = len(taskArns)
+
+        except Exception as e:
+            print('could not find the replica index, keeping ' + str(self.index) + ' of ' + str(self.count) + ': ', e)
+
+shardAssignment = ShardAssignment(REPLICA_INDEX, REPLICA_COUNT)
+
+# clusters this replica collects: the ones it owns and every cluster split by service
+def GetShardClusterList(clusterList, clusterIndex):
+
+    shardList = []
+    for clusterArn in clusterList:
+        metadata = clusterIndex.get(clusterArn, ClusterMetadata(clusterArn=clusterArn))
+        if shardAssignment.isSplit(metadata) or shardAssignment.owns(clusterArn):
+            shardList.append(clusterArn)
+
+    return shardList
+
+# fingerprint the parts of a describe_services entry the task level fields depend on
+def GetServiceStateFingerprint(entry):
+
+    deployments = []
+    for deployment in entry.get('deployments', []):
+        deployments.append([
+            deployment.get('id'),
+            deployment.get('status'),
+            deployment.get('taskDefinition'),
+            deployment.get('desiredCount'),
+            deployment.get('runningCount'),
+            deployment.get('pendingCount'),
+            deployment.get('updatedAt')
+        ])
+
+    state = [
+        entry.get('taskDefinition'),
+        entry.get('updatedAt'),
+        entry.get('desiredCount'),
+        entry.get('runningCount'),
+        entry.get('pendingCount'),
+        deployments
+    ]
+
+    return json.dumps(state, default=str)
+
+
+def GetClusterName(clusterArn):
+
+    head, sep, tail = clusterArn.partition('/')
+
+    return tail
+
+def FormatClusterRecord(cluster, clusterName):
+
+    metadata = cluster.metadata
+    jsonData = {}
+    jsonData['recordType'] = 'cluster'
+    jsonData['clusterName'] = clusterName
+    jsonData['cloudFormationStackName'] = metadata.cfStackName
+    jsonData['activeServices'] = metadata.activeServicesCount
+    jsonData['runningTasks'] = metadata.runningTasksCount
+    jsonData['pendingTasks'] = metadata.pendingTasksCount
+    jsonData['registeredContainerInstances'] = metadata.registeredContainerInstancesCount
+    if CYCLE_BUDGET > 0 and cluster.dataStatus != '':
+        jsonData['dataStatus'] = cluster.dataStatus
+
+    return jsonData
+
+def FormatCapacityRecord(cluster, clusterName):
+
+    instances = cluster.inventory.byContainerInstanceArn.values()
+    registeredCpu = sum(i.registeredCpu for i in instances)
+    registeredMemory = sum(i.registeredMemory for i in instances)
+    remainingCpu = sum(i.remainingCpu for i in instances)
+    remainingMemory = sum(i.remainingMemory for i in instances)
+    jsonData = {}
+    jsonData['recordType'] = 'capacity'
+    jsonData['clusterName'] = clusterName
+    jsonData['EC2InstanceType'] = cluster.inventory.getInstanceType()
+    jsonData['containerInstances'] = len(instances)
+    jsonData['runningTasks'] = sum(i.runningTasksCount for i in instances)
+    jsonData['registeredCpu'] = registeredCpu
+    jsonData['remainingCpu'] = remainingCpu
+    jsonData['registeredMemory'] = registeredMemory
+    jsonData['remainingMemory'] = remainingMemory
+    if registeredCpu != 0:
+        jsonData['cpuUtilization'] = round((registeredCpu - remainingCpu) / registeredCpu * 100, 2)
+    if registeredMemory != 0:
+        jsonData['memoryUtilization'] = round((registeredMemory - remainingMemory) / registeredMemory * 100, 2)
+    if CYCLE_BUDGET > 0 and cluster.dataStatus != '':
+        jsonData['dataStatus'] = cluster.dataStatus
+
+    return jsonData
+
+# service log record fields in output order: (log key, ServiceData attribute, only logged when)
+SERVICE_RECORD_FIELDS = [
+    ('serviceTag', 'serviceTag', None),
+    ('clusterName', None, None), # set from the cluster arn
+    ('cloudFormationStackName', 'cfStackName', None),
+    ('containerType', 'containerType', None),
+    ('FarGateMemory', 'fargateMem', 'FARGATE'),
+    ('FarGatevCPU', 'fargateVcpu', 'FARGATE'),
+    ('EC2InstanceType', 'ec2InstanceType', 'EC2'),
+    ('desiredTasks', 'desiredTasks', None),
+    ('runningTasks', 'runningTasks', None),
+    ('pendingTasks', 'pendingTasks', None),
+    ('desiredTaskMinutes', 'desiredTaskMinutes', None),
+    ('runningTaskMinutes', 'runningTaskMinutes', None),
+    ('pendingTaskMinutes', 'pendingTaskMinutes', None),
+    ('desiredTaskSeconds', 'desiredTaskSeconds', None),
+    ('runningTaskSeconds', 'runningTaskSeconds', None),
+    ('pendingTaskSeconds', 'pendingTaskSeconds', None),
+    ('desiredTaskMS', 'desiredTaskMs', None),
+    ('runningTaskMS', 'runningTaskMs', None),
+    ('pendingTaskMS', 'pendingTaskMs', None),
+    ('timeoutSecs', 'timeoutSecs', 'nonzero'),
+    ('defaultWorkersPerModel', 'defaultWorkersPerModel', 'nonzero'),
+    ('queueSize', 'queueSize', 'nonzero'),
+    ('serviceCostPerMinute', 'serviceCostPerMinute', None),
+]
+if CYCLE_BUDGET > 0:
+    SERVICE_RECORD_FIELDS.append(('dataStatus', 'dataStatus', 'nonzero'))
+
+# build the service record encoder once: a single attrgetter pulls every field in one call
+# and the conditional fields are grouped so each record only does a few checks
+def CompileServiceRecordEncoder(fields):
+
+    keys = [key for key, attr, when in fields]
+    getter = attrgetter(*[attr if attr != None else 'serviceName' for key, attr, when in fields])
+    containerTypeKeys = {}
+    nonzeroKeys = []
+    for key, attr, when in fields:
+        if when == 'nonzero':
+            nonzeroKeys.append(key)
+        elif when != None:
+            containerTypeKeys.setdefault(when, []).append(key)
+
+    def encode(service, clusterName):
+        jsonData = dict(zip(keys, getter(service)))
+        jsonData['clusterName'] = clusterName
+        for containerType, typeKeys in containerTypeKeys.items():
+            if service.containerType != containerType:
+                for key in typeKeys:
+                    del jsonData[key]
+        for key in nonzeroKeys:
+            if not jsonData[key]:
+                del jsonData[key]
+        return jsonData
+
+    return encode
+
+FormatServiceRecord = CompileServiceRecordEncoder(SERVICE_RECORD_FIELDS)
+
+# record keys left out of the delta fingerprint, they change every cycle without the service changing
+DELTA_IGNORED_KEYS = ['taskAgeP50Secs', 'taskAgeP90Secs', 'taskAgeMaxSecs']
+
+# fingerprint of the last logged record of each service for the delta emit mode. A service is logged
+# when it is new, its fingerprint changed or the cycle is a heartbeat, services not seen in a cycle get a
+# serviceRemoved record. With the per cycle deltaCycle record the backend can forward fill every
+# service's last record into a complete per minute series
+class ServiceDeltaFilter():
+
+    def __init__(self, heartbeatCycles):
+        self.heartbeatCycles = heartbeatCycles
+        self.services = {} # service arn -> (fingerprint, serviceTag, clusterName)
+        self.encoder = json.JSONEncoder(default=str)
+        self.cycles = 0
+        self.beginCycle()
+
+    def beginCycle(self):
+        self.heartbeat = self.cycles % self.heartbeatCycles == 0
+        self.seen = set()
+        self.keptClusters = set() # clusters whose service list was not read, their services are not removed
+        self.changed = 0
+        self.unchanged = 0
+
+    def getFingerprint(self, jsonData):
+        values = [(key, value) for key, value in jsonData.items() if key not in DELTA_IGNORED_KEYS]
+        return hashlib.blake2b(self.encoder.encode(values).encode(), digest_size=8).digest()
+
+    # true if the service record has to be logged this cycle
+    def check(self, serviceArn, jsonData, clusterName):
+        fingerprint = self.getFingerprint(jsonData)
+        previous = self.services.get(serviceArn)
+        self.services[serviceArn] = (fingerprint, jsonData['serviceTag'], clusterName)
+        self.seen.add(serviceArn)
+
+        if self.heartbeat or previous == None or previous[0] != fingerprint:
+            self.changed+=1
+            return True
+
+        self.unchanged+=1
+        return False
+
+    def keepCluster(self, clusterName):
+        self.keptClusters.add(clusterName)
+
+    # removed services and the cycle summary, closes the cycle. keepAll when the cluster list
+    # could not be read, a missing service is only removed if its cluster's list came back
+    def endCycle(self, keepAll=False):
+        removed = []
+        if not keepAll:
+            removed = [serviceArn for serviceArn, entry in self.services.items() if serviceArn not in self.seen and entry[2] not in self.keptClusters]
+        for serviceArn in removed:
+            fingerprint, serviceTag, clusterName = self.services.pop(serviceArn)
+            yield {'recordType': 'serviceRemoved', 'serviceTag': serviceTag, 'clusterName': clusterName}
+
+        yield {
+            'recordType': 'deltaCycle',
+            'heartbeat': self.heartbeat,
+            'changedServices': self.changed,
+            'unchangedServices': self.unchanged,
+            'removedServices': len(removed)
+        }
+        self.cycles+=1
+
+if EMIT_MODE not in ['full', 'delta']:
+    print('unknown SM_EMIT_MODE value, using default value: full')
+    EMIT_MODE = 'full'
+
+if TASK_METRICS not in ['off', 'service', 'task']:
+    print('unknown SM_TASK_METRICS value, using default value: off')
+    TASK_METRICS = 'off'
+
+serviceDeltaFilter = ServiceDeltaFilter(HEARTBEAT_CYCLES)
+
+# the service record followed by its task level metrics / records, ages are taken at the cycle's log time.
+# in delta mode nothing is logged for a service whose record did not change
+def FormatServiceRecords(service, clusterName):
+
+    jsonData = FormatServiceRecord(service, clusterName)
+    if service.taskColumns == None:
+        if EMIT_MODE != 'delta' or serviceDeltaFilter.check(service.serviceArn, jsonData, clusterName):
+            yield jsonData
+        return
+
+    now = recordWriter.logTimeMs / 1000
+    jsonData.update(service.taskColumns.summary(now))
+    if EMIT_MODE == 'delta' and not serviceDeltaFilter.check(service.serviceArn, jsonData, clusterName):
+        return
+    yield jsonData
+
+    if TASK_METRICS == 'task':
+        yield from service.taskColumns.formatTaskRecords(service.serviceTag, clusterName, now)
+
+# rollup windows (name, minutes) and the service counters they aggregate (counter, summed log key)
+ROLLUP_WINDOWS = [('5m', 5), ('1h', 60), ('1d', 1440)]
+ROLLUP_COUNTERS = [
+    ('desiredTasks', 'desiredTaskMinutes'),
+    ('runningTasks', 'runningTaskMinutes'),
+    ('pendingTasks', 'pendingTaskMinutes'),
+]
+
+# cluster / capacity / rollup record fields that are not part of the service records
+EXTRA_RECORD_KEYS = [
+    'recordType', 'activeServices', 'registeredContainerInstances', 'containerInstances',
+    'registeredCpu', 'remainingCpu', 'registeredMemory', 'remainingMemory', 'cpuUtilization', 'memoryUtilization',
+    'window', 'windowStart', 'samples',
+    'region', 'accountId',
+    'cycleSeconds', 'records', 'apiCalls', 'apiErrors', 'apiThrottles', 'apiRetries', 'apiCoalesced', 'stageSeconds', 'api', 'sinks',
+    'taskAgeP50Secs', 'taskAgeP90Secs', 'taskAgeMaxSecs', 'healthyTasks', 'unhealthyTasks', 'unknownHealthTasks',
+    'reservedCpu', 'reservedMemory', 'tasksPerAz',
+    'taskId', 'lastStatus', 'healthStatus', 'availabilityZone', 'cpu', 'memory', 'ageSecs',
+    'heartbeat', 'changedServices', 'unchangedServices', 'removedServices',
+    'expiredStages', 'abandonedCalls', 'staleServices', 'partialServices', 'prunedServices', 'dataStatus',
+    'taskDefCacheHits', 'taskDefCacheMisses'
+]
+for counter, sumKey in ROLLUP_COUNTERS:
+    EXTRA_RECORD_KEYS += [counter + 'Min', counter + 'Max', counter + 'Avg']
+
+# units of the numeric log keys published as cloudwatch metrics by the emf format
+EMF_METRIC_UNITS = {
+    'FarGateMemory': 'Megabytes',
+    'FarGatevCPU': 'None',
+    'desiredTasks': 'Count',
+    'runningTasks': 'Count',
+    'pendingTasks': 'Count',
+    'desiredTaskMinutes': 'Count',
+    'runningTaskMinutes': 'Count',
+    'pendingTaskMinutes': 'Count',
+    'desiredTaskSeconds': 'Seconds',
+    'runningTaskSeconds': 'Seconds',
+    'pendingTaskSeconds': 'Seconds',
+    'desiredTaskMS': 'Milliseconds',
+    'runningTaskMS': 'Milliseconds',
+    'pendingTaskMS': 'Milliseconds',
+    'serviceCostPerMinute': 'None',
+    'activeServices': 'Count',
+    'registeredContainerInstances': 'Count',
+    'containerInstances': 'Count',
+    'registeredCpu': 'None',
+    'remainingCpu': 'None',
+    'registeredMemory': 'Megabytes',
+    'remainingMemory': 'Megabytes',
+    'cpuUtilization': 'Percent',
+    'memoryUtilization': 'Percent',
+    'taskAgeP50Secs': 'Seconds',
+    'taskAgeP90Secs': 'Seconds',
+    'taskAgeMaxSecs': 'Seconds',
+    'healthyTasks': 'Count',
+    'unhealthyTasks': 'Count',
+    'unknownHealthTasks': 'Count',
+    'reservedCpu': 'None',
+    'reservedMemory': 'Megabytes',
+}
+for counter, sumKey in ROLLUP_COUNTERS:
+    EMF_METRIC_UNITS[counter + 'Min'] = 'Count'
+    EMF_METRIC_UNITS[counter + 'Max'] = 'Count'
+    EMF_METRIC_UNITS[counter + 'Avg'] = 'Count'
+
+# one json document per line, same output as json.dumps(jsonData, default=str)
+class JsonLinesEncoder():
+
+    def __init__(self):
+        # json.dumps builds a new encoder per call when default is passed, reuse one instead
+        self.encoder = json.JSONEncoder(default=str)
+
+    def header(self):
+        return None
+
+    def encode(self, jsonData, logTimeMs):
+        return self.encoder.encode(jsonData)
+
+# key=value pairs, strings are quoted when they are empty or contain spaces, quotes or '='
+class LogfmtEncoder():
+
+    def __init__(self):
+        self.keyPrefixes = {}
+
+    def header(self):
+        return None
+
+    def encodeValue(self, value):
+        if isinstance(value, str):
+            if value == '' or ' ' in value or '=' in value or '"' in value:
+                return json.dumps(value)
+            return value
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, (int, float)):
+            return repr(value)
+        return json.dumps(value, default=str)
+
+    def encode(self, jsonData, logTimeMs):
+        parts = []
+        for key, value in jsonData.items():
+            prefix = self.keyPrefixes.get(key)
+            if prefix == None:
+                prefix = self.keyPrefixes[key] = key + '='
+            parts.append(prefix + self.encodeValue(value))
+        return ' '.join(parts)
+
+# fixed column csv, the header is written once at the start of the stream and keys that are
+# not part of a record are left empty
+class CsvEncoder():
+
+    def __init__(self):
+        columns = [key for key, attr, when in SERVICE_RECORD_FIELDS]
+        columns += [key for key in EXTRA_RECORD_KEYS if key not in columns]
+        columns.append('dateTime1')
+        self.columns = columns
+        self.buffer = io.StringIO()
+        self.writer = csv.DictWriter(self.buffer, fieldnames=columns, extrasaction='ignore', lineterminator='')
+        self.headerWritten = False
+
+    def getLine(self):
+        line = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return line
+
+    def header(self):
+        if self.headerWritten:
+            return None
+        self.headerWritten = True
+        self.writer.writeheader()
+        return self.getLine()
+
+    def encode(self, jsonData, logTimeMs):
+        self.writer.writerow(jsonData)
+        return self.getLine()
+
+# cloudwatch embedded metric format, the metric directive is built once per set of metric keys
+class EmfEncoder():
+
+    def __init__(self, namespace='ServiceMetrics'):
+        self.namespace = namespace
+        self.directives = {}
+        self.encoder = json.JSONEncoder(default=str)
+
+    def header(self):
+        return None
+
+    def getDirective(self, jsonData):
+        metricKeys = tuple(key for key in jsonData if key in EMF_METRIC_UNITS)
+        dimensions = tuple(key for key in ('accountId', 'region', 'clusterName', 'serviceTag') if key in jsonData)
+        directive = self.directives.get((metricKeys, dimensions))
+        if directive == None:
+            directive = {
+                'Namespace': self.namespace,
+                'Dimensions': [list(dimensions)],
+                'Metrics': [{'Name': key, 'Unit': EMF_METRIC_UNITS[key]} for key in metricKeys]
+            }
+            self.directives[(metricKeys, dimensions)] = directive
+        return directive
+
+    def encode(self, jsonData, logTimeMs):
+        emfData = {'_aws': {'Timestamp': logTimeMs, 'CloudWatchMetrics': [self.getDirective(jsonData)]}}
+        emfData.update(jsonData)
+        return self.encoder.encode(emfData)
+
+OUTPUT_ENCODERS = {
+    'json': JsonLinesEncoder,
+    'logfmt': LogfmtEncoder,
+    'csv': CsvEncoder,
+    'emf': EmfEncoder,
+}
+
+# output sinks of the background writer, each one takes a batch of encoded lines
+class StdoutSink():
+
+    def __init__(self):
+        self.name = 'stdout'
+
+    def write(self, lines):
+        sys.stdout.write('\n'.join(lines) + '\n')
+        sys.stdout.flush()
+
+    def close(self):
+        sys.stdout.flush()
+
+# gzip compressed local file, rotated to <name>.1<ext> .. <name>.<backups><ext> once it reaches maxBytes.
+# every batch is sync flushed so a crash loses at most the batch being written
+class RotatingFileSink():
+
+    def __init__(self, fileName, maxBytes, backups):
+        self.name = 'file:' + fileName
+        self.fileName = fileName
+        self.maxBytes = maxBytes
+        self.backups = backups
+        self.file = None
+
+    def getBackupName(self, i):
+        root, ext = os.path.splitext(self.fileName)
+        if ext == '.gz':
+            root, inner = os.path.splitext(root)
+            ext = inner + ext
+        return root + '.' + str(i) + ext
+
+    def write(self, lines):
+        if self.file == None:
+            self.file = gzip.open(self.fileName, 'at', encoding='utf-8')
+        self.file.write('\n'.join(lines) + '\n')
+        self.file.flush()
+
+        if os.path.getsize(self.fileName) >= self.maxBytes:
+            self.rotate()
+
+    def rotate(self):
+        self.close()
+        if self.backups == 0:
+            os.remove(self.fileName)
+            return
+
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(self.getBackupName(i)):
+                os.replace(self.getBackupName(i), self.getBackupName(i + 1))
+        os.replace(self.fileName, self.getBackupName(1))
+
+    def close(self):
+        if self.file != None:
+            self.file.close()
+            self.file = None
+
+# one datagram per line to a local collector (statsd / syslog style), long lines are truncated
+class UdpSink():
+
+    def __init__(self, host, port):
+        self.name = 'udp:' + host + ':' + str(port)
+        self.address = (host, port)
+        self.socket = None
+
+    def write(self, lines):
+        if self.socket == None:
+            import socket
+
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # resolves the host once instead of on every datagram
+            self.socket.connect(self.address)
+
+        for line in lines:
+            self.socket.send(line.encode()[:UDP_MAX_DATAGRAM])
+
+    def close(self):
+        if self.socket != None:
+            self.socket.close()
+            self.socket = None
+
+# newline delimited lines over one tcp connection, reconnected on error at most every SINK_RECONNECT_SECONDS
+class TcpSink():
+
+    def __init__(self, host, port):
+        self.name = 'tcp:' + host + ':' + str(port)
+        self.address = (host, port)
+        self.socket = None
+        self.retryAt = 0.0
+
+    def connect(self):
+        import socket
+
+        if time.monotonic() < self.retryAt:
+            raise OSError('not connected, waiting to reconnect')
+        self.retryAt = time.monotonic() + SINK_RECONNECT_SECONDS
+        self.socket = socket.create_connection(self.address, timeout=SINK_RECONNECT_SECONDS)
+
+    def write(self, lines):
+        data = ('\n'.join(lines) + '\n').encode()
+
+        # a connection the collector closed is only noticed on send, retry once on a new one
+        for attempt in range(2):
+            if self.socket == None:
+                self.connect()
+            try:
+                self.socket.sendall(data)
+                return
+            except OSError:
+                self.close()
+                if attempt == 1:
+                    raise
+
+    def close(self):
+        if self.socket != None:
+            self.socket.close()
+            self.socket = None
+
+# bounded queue of encoded lines written to the sinks by a background thread, so a slow sink only
+# stalls the collection when the queue is full and the policy is block. drop-oldest drops the oldest
+# queued batches to make room, spill appends new lines to a local file (kept across restarts) that is
+# written out in order once the queue has drained
+class AsyncSinkWriter():
+
+    def __init__(self, sinks, maxLines, policy, spillFile):
+        self.sinks = sinks
+        self.maxLines = maxLines
+        self.policy = policy
+        self.spillFile = spillFile
+        self.condition = threading.Condition()
+        self.batches = deque()
+        self.queuedLines = 0
+        self.busy = False
+        self.spilling = False
+        self.closed = False
+        self.thread = None
+        self.lag = LatencyHistogram()
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.delayed = 0
+        self.blockedSeconds = 0.0
+        self.queueHighWater = 0
+        self.errors = {}
+
+    def getDrainFile(self):
+        return self.spillFile + '.draining'
+
+    # started with the first batch so importing the module never starts a thread
+    def start(self):
+        self.spilling = os.path.exists(self.spillFile) or os.path.exists(self.getDrainFile())
+        self.thread = threading.Thread(target=self.run, name='sink-writer', daemon=True)
+        self.thread.start()
+
+    def put(self, lines):
+        if lines == []:
+            return
+
+        start = time.perf_counter()
+        with self.condition:
+            if self.thread == None:
+                self.start()
+            self.enqueued += len(lines)
+
+            # once spilling every batch goes to the spill file until it is drained, keeping the order
+            if self.policy == 'spill' and (self.spilling or self.queuedLines + len(lines) > self.maxLines):
+                with open(self.spillFile, 'a') as f:
+                    f.write('\n'.join(lines) + '\n')
+                self.spilled += len(lines)
+                self.spilling = True
+                self.condition.notify_all()
+                return
+
+            if self.policy == 'drop-oldest':
+                while self.batches and self.queuedLines + len(lines) > self.maxLines:
+                    dropped, queuedAt = self.batches.popleft()
+                    self.queuedLines -= len(dropped)
+                    self.dropped += len(dropped)
+
+            else:
+                blocked = False
+                while self.batches and self.queuedLines + len(lines) > self.maxLines:
+                    blocked = True
+                    self.condition.wait()
+                if blocked:
+                    self.delayed += len(lines)
+                    self.blockedSeconds += time.perf_counter() - start
+
+            self.batches.append((lines, time.perf_counter()))
+            self.queuedLines += len(lines)
+            self.queueHighWater = max(self.queueHighWater, self.queuedLines)
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.batches and not self.spilling and not self.closed:
+                    self.condition.wait()
+
+                lines = None
+                if self.batches:
+                    lines, queuedAt = self.batches.popleft()
+                    self.queuedLines -= len(lines)
+                elif self.spilling:
+                    # a drain file left by an earlier run is written out before the current spill file
+                    if not os.path.exists(self.getDrainFile()):
+                        if os.path.exists(self.spillFile):
+                            os.replace(self.spillFile, self.getDrainFile())
+                        self.spilling = False
+                else:
+                    return
+                self.busy = True
+                # wakes producers blocked on a full queue
+                self.condition.notify_all()
+
+            if lines != None:
+                self.writeLines(lines)
+                self.lag.observe(time.perf_counter() - queuedAt)
+            else:
+                self.drainSpillFile()
+
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+    def drainSpillFile(self):
+        if not os.path.exists(self.getDrainFile()):
+            return
+
+        with open(self.getDrainFile()) as f:
+            lines = []
+            for line in f:
+                lines.append(line.rstrip('\n'))
+                if len(lines) >= SINK_SPILL_READ_LINES:
+                    self.writeLines(lines)
+                    lines = []
+            if lines != []:
+                self.writeLines(lines)
+        os.remove(self.getDrainFile())
+
+    # a failing sink loses the batch, the other sinks still get it
+    def writeLines(self, lines):
+        for sink in self.sinks:
+            try:
+                sink.write(lines)
+            except Exception as e:
+                with self.condition:
+                    self.errors[sink.name] = self.errors.get(sink.name, 0) + 1
+                # stdout may be the failing sink
+                print('error during sink write: ', sink.name, e, file=sys.stderr)
+
+        with self.condition:
+            self.written += len(lines)
+
+    # wait until every queued and spilled line is written
+    def drain(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.batches and not self.busy and not self.spilling, timeout)
+
+    def close(self, timeout=None):
+        self.drain(timeout)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread != None:
+            self.thread.join(timeout)
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                print('error during sink close: ', sink.name, e, file=sys.stderr)
+
+    def getStats(self):
+        with self.condition:
+            return {
+                'queuedLines': self.queuedLines,
+                'queueHighWater': self.queueHighWater,
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'spilled': self.spilled,
+                'delayed': self.delayed,
+                'blockedSeconds': round(self.blockedSeconds, 3),
+                'writeErrors': dict(self.errors),
+                'lagP50Ms': self.lag.percentile(50),
+                'lagP99Ms': self.lag.percentile(99)
+            }
+
+    def renderPrometheus(self):
+        stats = self.getStats()
+        lines = []
+        lines.append('# TYPE service_metrics_sink_queued_lines gauge')
+        lines.append('service_metrics_sink_queued_lines ' + str(stats['queuedLines']))
+        for key in ['enqueued', 'written', 'dropped', 'spilled', 'delayed']:
+            lines.append('# TYPE service_metrics_sink_' + key + '_lines_total counter')
+            lines.append('service_metrics_sink_' + key + '_lines_total ' + str(stats[key]))
+        lines.append('# TYPE service_metrics_sink_blocked_seconds_total counter')
+        lines.append('service_metrics_sink_blocked_seconds_total ' + repr(self.blockedSeconds))
+        lines.append('# TYPE service_metrics_sink_write_errors_total counter')
+        for name, errors in sorted(stats['writeErrors'].items()):
+            lines.append('service_metrics_sink_write_errors_total{sink="' + name + '"} ' + str(errors))
+
+        return '\n'.join(lines) + '\n'
+
+def OpenSink(spec):
+
+    if spec == 'stdout':
+        return StdoutSink()
+    if spec.startswith('file:'):
+        return RotatingFileSink(spec[5:], SINK_FILE_MAX_BYTES, SINK_FILE_BACKUPS)
+    if spec.startswith('udp:') or spec.startswith('tcp:'):
+        host, _, port = spec[4:].rpartition(':')
+        try:
+            port = int(port)
+        except ValueError as e:
+            print('invalid SM_SINKS port, sink ignored: ', spec)
+            return None
+        return UdpSink(host, port) if spec.startswith('udp:') else TcpSink(host, port)
+
+    print('unknown SM_SINKS entry, sink ignored: ', spec)
+    return None
+
+# background sink writer of SM_SINKS, None keeps the synchronous stdout writes
+def OpenSinkWriter(sinkList):
+
+    sinks = []
+    for spec in sinkList.split(','):
+        if spec.strip() != '':
+            sink = OpenSink(spec.strip())
+            if sink != None:
+                sinks.append(sink)
+
+    if sinks == []:
+        return None
+
+    policy = SINK_POLICY
+    if policy not in ['block', 'drop-oldest', 'spill']:
+        print('unknown SM_SINK_POLICY value, using default value: block')
+        policy = 'block'
+
+    return AsyncSinkWriter(sinks, SINK_QUEUE_LINES, policy, SINK_SPILL_FILE)
+
+# encodes records with one timestamp per cycle and writes them to stdout in buffered batches,
+# or hands the batches to the background sink writer
+class RecordWriter():
+
+    def __init__(self, encoder, bufferLines, stream=None):
+        self.encoder = encoder
+        self.bufferLines = bufferLines
+        self.stream = stream
+        self.sink = None
+        self.lines = []
+        # keys added to every record (region / accountId of a fan out worker)
+        self.tags = {}
+        self.writeHeader = True
+        self.firstRecordTime = None
+        self.beginCycle()
+
+    def beginCycle(self):
+        dateTime = datetime.now(timezone.utc)
+        self.logTime = dateTime.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        self.logTimeMs = int(dateTime.timestamp() * 1000)
+        self.logMinute = self.logTimeMs // 60000
+        self.records = 0
+        self.encodeSeconds = 0.0
+
+    def write(self, jsonData):
+        start = time.perf_counter()
+
+        if self.writeHeader:
+            header = self.encoder.header()
+            if header != None:
+                self.lines.append(header)
+        if self.tags:
+            jsonData.update(self.tags)
+        jsonData['dateTime1'] = self.logTime
+        self.lines.append(self.encoder.encode(jsonData, self.logTimeMs))
+
+        self.encodeSeconds += time.perf_counter() - start
+        self.records+=1
+
+        if len(self.lines) >= self.bufferLines:
+            self.flush()
+
+    def flush(self):
+        if self.lines == []:
+            return
+
+        if self.sink != None:
+            self.sink.put(self.lines)
+        else:
+            # resolve stdout at write time so redirected output is honoured
+            stream = self.stream or sys.stdout
+            stream.write('\n'.join(self.lines) + '\n')
+            stream.flush()
+        self.lines = []
+        if self.firstRecordTime == None:
+            self.firstRecordTime = time.perf_counter()
+
+if OUTPUT_FORMAT not in OUTPUT_ENCODERS:
+    print('unknown SM_OUTPUT_FORMAT value, using default value: json')
+    OUTPUT_FORMAT = 'json'
+
+recordWriter = RecordWriter(OUTPUT_ENCODERS[OUTPUT_FORMAT](), OUTPUT_BUFFER_LINES)
+sinkWriter = OpenSinkWriter(SINKS)
+if sinkWriter != None:
+    recordWriter.sink = sinkWriter
+    # one-shot runs exit straight after the cycle, write out what is still queued first
+    atexit.register(sinkWriter.close, SINK_CLOSE_SECONDS)
+
+def LogRecord(jsonData):
+
+    recordWriter.write(jsonData)
+
+@TimedStage
+def ConvertListToJsonLogFormat(inputList):
+    
+    for cluster in inputList:
+        clusterName = GetClusterName(cluster.clusterArn)
+        if EMIT_MODE == 'delta' and cluster.dataStatus != '':
+            serviceDeltaFilter.keepCluster(clusterName)
+
+        if CLUSTER_RECORDS and cluster.owned:
+            LogRecord(FormatClusterRecord(cluster, clusterName))
+
+        if CLUSTER_RECORDS and cluster.owned and cluster.inventory != None:
+            LogRecord(FormatCapacityRecord(cluster, clusterName))
+
+        for service in cluster.serviceDataList:
+            # only log data with valid service tags (and matching SM_SERVICE_SELECTOR)
+            if service.selected:
+                if ROLLUP_MODE != 'only':
+                    for jsonData in FormatServiceRecords(service, clusterName):
+                        LogRecord(jsonData)
+                if ROLLUP_MODE != 'off':
+                    taskMinuteBuffer.record(service, clusterName, recordWriter.logMinute)
+
+# split a list into consecutive batches of at most batchSize items
+def SplitIntoBatches(inputList, batchSize):
+
+    return [inputList[i:i + batchSize] for i in range(0, len(inputList), batchSize)]
+
+# call a list / describe api and follow its next token until every page is read
+def PaginateCall(clientCall, resultKey, **kwargs):
+
+    results = []
+    # ec2 uses pascal case keys, ecs uses camel case
+    tokenKey = 'NextToken' if resultKey[0].isupper() else 'nextToken'
+
+    while True:
+        resp = clientCall(**kwargs)
+        results += resp[resultKey]
+
+        nextToken = resp.get(tokenKey)
+        if not nextToken:
+            break
+        kwargs[tokenKey] = nextToken
+
+    return results
+
+# call a describe api once per api sized batch of ids and join the results
+def DescribeInBatches(clientCall, idKey, idList, resultKey, batchSize, **kwargs):
+
+    results = []
+    for batch in SplitIntoBatches(idList, batchSize):
+        kwargs[idKey] = batch
+        resp = clientCall(**kwargs)
+        results += resp[resultKey]
+
+    return results
+
+# None if the list could not be read
+@TimedStage
+def GetClusterList():
+
+    clusterList = None
+    try:
+        clusterList = PaginateCall(
+            ecs_client.list_clusters,
+            'clusterArns',
+            maxResults=LIST_PAGE_SIZE
+        )
+
+    except Exception as e:
+        HandleCallError(e)
+
+    return clusterList
+
+# stage items are a cluster arn, a ClusterData or a (cluster arn, ServiceData) pair, the stages
+# replace the fields they fill so a shallow copy keeps a worker off the original
+def CopyStageItem(item):
+
+    if isinstance(item, tuple):
+        return tuple(copy.copy(value) for value in item)
+
+    return copy.copy(item)
+
+def MergeStageItem(item, itemCopy):
+
+    for original, worked in zip(item, itemCopy) if isinstance(item, tuple) else [(item, itemCopy)]:
+        if hasattr(original, '__dict__'):
+            vars(original).update(vars(worked))
+
+# run func over each item on the worker pool, results keep the input order.
+# under a cycle deadline items still running when the stage is out of time are left behind and
+# unfinished(item) (or the item itself) takes the place of their result
+def RunConcurrently(func, inputList, unfinished=None):
+
+    if MAX_WORKERS <= 1 or len(inputList) <= 1:
+        return [func(item) for item in inputList]
+
+    timeout = cycleDeadline.remaining()
+    if timeout == None:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(inputList))) as executor:
+            return list(executor.map(func, inputList))
+
+    # the workers get copies of the items and only finished ones are written back, a worker left
+    # behind cannot change data that is logged in the meantime
+    copies = [CopyStageItem(item) for item in inputList]
+    executor = ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(inputList)))
+    futures = [executor.submit(func, item) for item in copies]
+    done, notDone = WaitForFutures(futures, timeout=timeout + DEADLINE_GRACE_SECONDS)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    results = []
+    for item, itemCopy, future in zip(inputList, copies, futures):
+        if future in done:
+            result = future.result()
+            MergeStageItem(item, itemCopy)
+            results.append(item if result is itemCopy else result)
+        else:
+            cycleDeadline.abandoned+=1
+            results.append(unfinished(item) if unfinished != None else item)
+
+    return results
+
+# unfinished result of a per service stage: the service is left incomplete
+def MarkPairPartial(pair):
+
+    pair[1].dataStatus = 'partial'
+
+    return pair
+
+# lazy version of RunConcurrently, yields results in input order while keeping at most
+# window items in flight so memory does not grow with the size of the input
+def StreamConcurrently(func, inputIter, window):
+
+    if MAX_WORKERS <= 1:
+        for item in inputIter:
+            yield func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        inFlight = deque()
+        for item in inputIter:
+            inFlight.append(executor.submit(func, item))
+            if len(inFlight) >= window:
+                yield inFlight.popleft().result()
+
+        while inFlight:
+            yield inFlight.popleft().result()
+
+def GetServiceArns(clusterArn):
+
+    dataItem = ClusterData()
+    serviceArnList = []
+
+    try:
+        serviceArnList = PaginateCall(
+            ecs_client.list_services,
+            'serviceArns',
+            cluster=clusterArn,
+            maxResults=LIST_PAGE_SIZE
+        )
+
+    except Exception as e:
+        HandleCallError(e, dataItem)
+
+    dataItem.clusterArn = clusterArn
+    dataItem.serviceArnList = serviceArnList
+
+    return dataItem
+
+# cluster whose service list did not come back before the deadline
+def GetUnfinishedClusterData(clusterArn):
+
+    return ClusterData(clusterArn=clusterArn, dataStatus='partial')
+
+@TimedStage
+def GetServiceList(clusterList, clusterIndex=None):
+
+    dataItemList = RunConcurrently(GetServiceArns, clusterList, unfinished=GetUnfinishedClusterData)
+    clusterIndex = clusterIndex or {}
+
+    for dataItem in dataItemList:
+        if dataItem.clusterArn in clusterIndex:
+            dataItem.metadata = clusterIndex[dataItem.clusterArn]
+        else:
+            dataItem.metadata = ClusterMetadata(clusterArn=dataItem.clusterArn)
+
+        # a cluster split across replicas keeps only this replica's services
+        if shardAssignment.isSplit(dataItem.metadata):
+            dataItem.owned = shardAssignment.owns(dataItem.clusterArn)
+            dataItem.serviceArnList = [arn for arn in dataItem.serviceArnList
+                                       if shardAssignment.owns(dataItem.clusterArn + '/' + arn.split('/')[-1])]
+
+    return dataItemList
+
+# a failed or cut off batch marks the cluster partial so its missing services are not taken as removed
+def GetServiceInfo(clusterArn, serviceList, cluster=None):
+
+    try: 
+        resp = ecs_client.describe_services(
+            cluster=clusterArn,
+            services=serviceList,
+            include=['TAGS']
+        )
+
+        # clean data
+        for item in resp['services']:
+            del item['events']
+
+        return resp['services']
+
+    except Exception as e:
+        HandleCallError(e, cluster)
+
+    return []
+
+# task counts of a service and the per minute task minutes / seconds / ms derived from them
+def SetServiceCounts(serviceData, desired, running, pending):
+
+    serviceData.desiredTasks = desired
+    serviceData.runningTasks = running
+    serviceData.pendingTasks = pending
+    serviceData.desiredTaskMinutes = desired * 1
+    serviceData.runningTaskMinutes = running * 1
+    serviceData.pendingTaskMinutes = pending * 1
+    serviceData.desiredTaskSeconds = desired * 60
+    serviceData.runningTaskSeconds = running * 60
+    serviceData.pendingTaskSeconds = pending * 60
+    serviceData.desiredTaskMs = (desired * 60) * 1000
+    serviceData.runningTaskMs = (running * 60) * 1000
+    serviceData.pendingTaskMs = (pending * 60) * 1000
+
+# SM_SERVICE_SELECTOR compiled once into one test per term, each alternative list into a single regex
+class ServiceSelector():
+
+    FIELDS = ['cluster', 'launchType', 'stack', 'service']
+
+    def __init__(self, expression):
+        self.tests = []
+        self.usesTags = False
+        self.lock = threading.Lock()
+        self.selected = 0
+        self.pruned = 0
+
+        for term in expression.split(','):
+            term = term.strip()
+            if term != '':
+                test = self.compileTerm(term)
+                if test != None:
+                    self.tests.append(test)
+
+    def compilePattern(self, patterns):
+        return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns.split('|')))
+
+    def compileTerm(self, term):
+        negate = term.startswith('!')
+        kind, sep, pattern = term.lstrip('!').partition(':')
+
+        if kind == 'tag' and sep != '':
+            self.usesTags = True
+            key, hasValue, valuePattern = pattern.partition('=')
+            regex = self.compilePattern(valuePattern) if hasValue != '' else None
+            if regex == None:
+                return lambda tags, values: (key in tags) != negate
+            return lambda tags, values: (key in tags and regex.match(tags[key]) != None) != negate
+
+        if kind in self.FIELDS and sep != '':
+            i = self.FIELDS.index(kind)
+            regex = self.compilePattern(pattern)
+            return lambda tags, values: (regex.match(values[i]) != None) != negate
+
+        print('unknown SM_SERVICE_SELECTOR term, ignored: ', term)
+        return None
+
+    def beginCycle(self):
+        with self.lock:
+            self.selected = 0
+            self.pruned = 0
+
+    # values in FIELDS order, services without a Service tag are never logged and always pruned
+    def match(self, serviceTag, tags, values):
+        selected = serviceTag != '' and all(test(tags, values) for test in self.tests)
+        with self.lock:
+            if selected:
+                self.selected+=1
+            else:
+                self.pruned+=1
+        return selected
+
+serviceSelector = ServiceSelector(SERVICE_SELECTOR)
+
+def BuildServiceData(item, entry):
+
+    serviceData = ServiceData()
+    serviceTag = ''
+    ec2InstanceType = ''
+    # safe guard tag check
+    try:
+        
+        if entry['tags']:
+            for index in entry['tags']:
+                if index['key'] == 'Service':
+                    serviceTag = index['value']
+
+    except Exception as e:
+        pass
+                    
+    serviceData.serviceTag = serviceTag
+    serviceData.serviceName = str(entry['serviceName'])
+    serviceData.serviceArn = str(entry['serviceArn'])
+    serviceData.cfStackName = item.metadata.cfStackName
+    serviceData.containerType = str(entry['launchType'])
+
+    tags = {}
+    if serviceSelector.usesTags:
+        tags = {tag['key']: tag['value'] for tag in entry.get('tags') or []}
+    values = [GetClusterName(item.clusterArn), serviceData.containerType, serviceData.cfStackName, serviceData.serviceName]
+    serviceData.selected = serviceSelector.match(serviceTag, tags, values)
+
+    if str(entry['launchType']) == 'EC2' and serviceData.selected:
+        # one inventory per cluster per cycle, shared by all EC2 services on it
+        if item.inventory == None:
+            item.inventory = GetClusterInventory(item.clusterArn)
+        ec2InstanceType = GetEc2InstanceTypeFromClusterId(item.inventory)
+    serviceData.ec2InstanceType = ec2InstanceType
+    SetServiceCounts(serviceData, int(entry['desiredCount']), int(entry['runningCount']), int(entry['pendingCount']))
+    serviceData.serviceCostPerMinute = float(0.00)
+    serviceData.stateFingerprint = GetServiceStateFingerprint(entry)
+    if INCREMENTAL:
+        serviceSnapshot.reuse(serviceData)
+
+    return serviceData
+
+# the capacity record of an owned cluster needs its inventory whichever services this replica
+# got, or if all of its EC2 services are pruned
+def GetOwnedClusterInventory(item):
+
+    if CLUSTER_RECORDS and item.owned and item.inventory == None:
+        item.inventory = GetClusterInventory(item.clusterArn)
+
+def CollectClusterServiceData(item):
+
+    servicesResp = []
+    serviceDataList = []
+
+    # describe_services takes at most 10 services per call
+    for batch in SplitIntoBatches(item.serviceArnList, DESCRIBE_SERVICES_BATCH_SIZE):
+        servicesResp += GetServiceInfo(item.clusterArn, batch, item)
+
+    # one malformed service (e.g. no launchType with a capacity provider strategy) must not drop the cluster
+    for entry in servicesResp:
+        try:
+            serviceDataList.append(BuildServiceData(item, entry))
+        except Exception as e:
+            print('error during service data build: ', entry.get('serviceArn', ''), repr(e))
+
+    item.serviceDataList = serviceDataList
+    GetOwnedClusterInventory(item)
+
+    return item
+
+@TimedStage
+def CollectServiceData(inputList):
+
+    return RunConcurrently(CollectClusterServiceData, inputList)
+
+# flatten the cluster list into (clusterArn, service) pairs so per service calls can fan out,
+# unchanged services already carry their task level fields and are left out
+def GetClusterServicePairs(clusterDataList):
+
+    pairs = []
+    for cluster in clusterDataList:
+        for service in cluster.serviceDataList:
+            if service.selected and not service.unchanged:
+                pairs.append((cluster.clusterArn, service))
+
+    return pairs
+
+@TimedStage
+def GetTaskArnsForService(pair):
+
+    clusterArn, service = pair
+    try:
+        taskArnList = PaginateCall(
+            ecs_client.list_tasks,
+            'taskArns',
+            cluster=clusterArn,
+            serviceName=service.serviceName,
+            launchType=service.containerType,
+            maxResults=LIST_PAGE_SIZE
+        )
+
+        #print(taskArnList)
+        service.taskArns = taskArnList
+
+    except Exception as e:
+        HandleCallError(e, service)
+
+    return service
+
+@TimedStage
+def GetTaskArns(clusterDataList):
+
+    RunConcurrently(GetTaskArnsForService, GetClusterServicePairs(clusterDataList), unfinished=MarkPairPartial)
+
+    return clusterDataList
+
+HEALTH_STATUS_CODES = {'UNKNOWN': 0, 'HEALTHY': 1, 'UNHEALTHY': 2}
+HEALTH_STATUSES = ['UNKNOWN', 'HEALTHY', 'UNHEALTHY']
+
+# task level cpu / memory, or the summed container reservations for EC2 tasks without task level sizes
+def GetTaskReservation(task, key):
+
+    value = task.get(key)
+    if value != None:
+        return int(value)
+
+    total = 0
+    for container in task.get('containers', []):
+        value = container.get(key)
+        if value == None and key == 'memory':
+            value = container.get('memoryReservation')
+        total += int(value or 0)
+
+    return total
+
+# nearest rank percentile of an ascending list
+def GetPercentile(sortedValues, p):
+
+    return sortedValues[max(int(-(-len(sortedValues) * p // 100)) - 1, 0)]
+
+# the described tasks of one service as typed columns (one array per field) filled a describe_tasks
+# page at a time. The aggregates run over whole columns (array count / sum) instead of task dicts and
+# the start times are sorted once, so the per cycle age percentiles are an index lookup
+class TaskColumns():
+
+    def __init__(self, keepTasks=False):
+        self.startedAt = array('d') # epoch seconds, nan until the task has started
+        self.cpu = array('l')
+        self.memory = array('l')
+        self.health = array('b')
+        self.zone = array('H')
+        self.zones = []
+        self.sortedStartedAt = None
+        # per task record fields, only kept for the task records
+        self.keepTasks = keepTasks
+        self.taskIds = []
+        self.lastStatus = []
+
+    def getZone(self, zoneName):
+        if zoneName not in self.zones:
+            self.zones.append(zoneName)
+        return self.zones.index(zoneName)
+
+    def addPage(self, tasks):
+        self.startedAt.extend([task['startedAt'].timestamp() if task.get('startedAt') != None else float('nan') for task in tasks])
+        self.cpu.extend([GetTaskReservation(task, 'cpu') for task in tasks])
+        self.memory.extend([GetTaskReservation(task, 'memory') for task in tasks])
+        self.health.extend([HEALTH_STATUS_CODES.get(task.get('healthStatus'), 0) for task in tasks])
+        self.zone.extend([self.getZone(task.get('availabilityZone', '')) for task in tasks])
+        if self.keepTasks:
+            self.taskIds += [task['taskArn'].split('/')[-1] for task in tasks]
+            self.lastStatus += [task.get('lastStatus', '') for task in tasks]
+        self.sortedStartedAt = None
+
+    def summary(self, now):
+        if self.sortedStartedAt == None:
+            # nan != nan drops the tasks that have not started
+            self.sortedStartedAt = array('d', sorted(s for s in self.startedAt if s == s))
+
+        jsonData = {}
+        started = self.sortedStartedAt
+        if len(started) != 0:
+            # the oldest task starts first, so the age percentile p is the start time percentile 100 - p
+            jsonData['taskAgeP50Secs'] = int(now - GetPercentile(started, 50))
+            jsonData['taskAgeP90Secs'] = int(now - GetPercentile(started, 10))
+            jsonData['taskAgeMaxSecs'] = int(now - started[0])
+        healthy = self.health.count(1)
+        unhealthy = self.health.count(2)
+        jsonData['healthyTasks'] = healthy
+        jsonData['unhealthyTasks'] = unhealthy
+        jsonData['unknownHealthTasks'] = len(self.health) - healthy - unhealthy
+        jsonData['reservedCpu'] = sum(self.cpu)
+        jsonData['reservedMemory'] = sum(self.memory)
+        jsonData['tasksPerAz'] = {self.zones[i]: self.zone.count(i) for i in range(len(self.zones)) if self.zones[i] != ''}
+
+        return jsonData
+
+    def formatTaskRecords(self, serviceTag, clusterName, now):
+        for i in range(len(self.taskIds)):
+            jsonData = {}
+            jsonData['recordType'] = 'task'
+            jsonData['serviceTag'] = serviceTag
+            jsonData['clusterName'] = clusterName
+            jsonData['taskId'] = self.taskIds[i]
+            jsonData['lastStatus'] = self.lastStatus[i]
+            jsonData['healthStatus'] = HEALTH_STATUSES[self.health[i]]
+            jsonData['availabilityZone'] = self.zones[self.zone[i]]
+            jsonData['cpu'] = self.cpu[i]
+            jsonData['memory'] = self.memory[i]
+            if self.startedAt[i] == self.startedAt[i]:
+                jsonData['ageSecs'] = int(now - self.startedAt[i])
+            yield jsonData
+
+@TimedStage
+def GetFargateInfoForService(pair):
+
+    clusterArn, service = pair
+
+    if service.taskArns != []:
+        try:
+            # the task columns are filled from each describe_tasks response as it comes in
+            columns = TaskColumns(keepTasks=TASK_METRICS == 'task') if TASK_METRICS != 'off' else None
+            tasks = []
+            for batch in SplitIntoBatches(service.taskArns, DESCRIBE_TASKS_BATCH_SIZE):
+                page = ecs_client.describe_tasks(cluster=clusterArn, tasks=batch, include=['TAGS'])['tasks']
+                if columns != None:
+                    columns.addPage(page)
+                tasks += page
+            service.taskColumns = columns
+
+            # the event index starts every task from the status it was described with
+            if EVENT_SOURCE != '':
+                service.taskStatuses = {task['taskArn']: task.get('lastStatus', '') for task in tasks}
+
+            taskDefs = []
+            # grab fargate and taskDef data
+            if service.containerType != 'EC2':
+
+                mem = 0
+                cpu = 0
+                for task in tasks:
+                    mem += int(task['memory'])
+                    cpu += int(task['cpu'])
+                    taskDefs.append(task['taskDefinitionArn'])
+
+                service.fargateMem =  mem
+                service.fargateVcpu = cpu
+                service.taskDefinitions = taskDefs
+
+            # grab taskDef data and where each task runs for the cost split
+            else:
+                containerInstanceArns = []
+                for task in tasks:
+                    taskDefs.append(task['taskDefinitionArn'])
+                    containerInstanceArns.append(task.get('containerInstanceArn', ''))
+
+                service.taskDefinitions = taskDefs
+                service.containerInstanceArns = containerInstanceArns
+
+        except Exception as e:
+            HandleCallError(e, service)
+
+    return service
+
+@TimedStage
+def GetFargateInfo(clusterDataList):
+
+    RunConcurrently(GetFargateInfoForService, GetClusterServicePairs(clusterDataList), unfinished=MarkPairPartial)
+
+    return clusterDataList
+
+# cluster list and metadata index from the collection state, refreshed once its stage expired
+def GetClusters():
+
+    if collectionState.clusterList == None:
+        shardAssignment.refresh()
+        clusterList = GetClusterList()
+        clusterIndex = GetClusterMetadata(clusterList) if clusterList != None else {}
+        # a failed list or one cut short by the cycle deadline is not kept, the last full one stands in
+        # for it and the list is read again next cycle
+        if clusterList == None or cycleDeadline.expired():
+            collectionState.clusterListFailed = True
+            if collectionState.lastClusterList != None:
+                return collectionState.lastClusterList, collectionState.clusterIndex
+            return GetShardClusterList(clusterList or [], clusterIndex), clusterIndex
+        collectionState.clusterListFailed = False
+        collectionState.clusterIndex = clusterIndex
+        collectionState.clusterList = GetShardClusterList(clusterList, collectionState.clusterIndex)
+        collectionState.clusterListTime = time.time()
+
+    return collectionState.clusterList, collectionState.clusterIndex
+
+# describe every cluster in batches and index the metadata the collector needs by cluster arn,
+# the cluster counts are always returned so only the tags need to be included. A failed batch only
+# loses the metadata of its own clusters
+@TimedStage
+def GetClusterMetadata(clusterList):
+
+    clusterIndex = {}
+
+    clusters = []
+    for batch in SplitIntoBatches(clusterList, DESCRIBE_CLUSTERS_BATCH_SIZE):
+        try:
+            clusters += ecs_client.describe_clusters(clusters=batch, include=['TAGS'])['clusters']
+
+        except Exception as e:
+            HandleCallError(e)
+
+    for item in clusters:
+        metadata = ClusterMetadata()
+        metadata.clusterArn = item['clusterArn']
+        metadata.clusterName = item.get('clusterName', '')
+        for tag in item.get('tags', []):
+            metadata.tags[tag['key']] = tag['value']
+        metadata.cfStackName = metadata.tags.get('aws:cloudformation:stack-name', '')
+        metadata.activeServicesCount = int(item.get('activeServicesCount', 0))
+        metadata.runningTasksCount = int(item.get('runningTasksCount', 0))
+        metadata.pendingTasksCount = int(item.get('pendingTasksCount', 0))
+        metadata.registeredContainerInstancesCount = int(item.get('registeredContainerInstancesCount', 0))
+
+        clusterIndex[metadata.clusterArn] = metadata
+
+    return clusterIndex
+
+# read an integer resource (CPU / MEMORY) out of a container instance resource list
+def GetResourceValue(resources, name):
+
+    for resource in resources:
+        if resource['name'] == name:
+            return int(resource.get('integerValue', 0))
+
+    return 0
+
+@TimedStage
+def GetContainerInstanceInventory(clusterArn):
+
+    inventory = ClusterInventory(clusterArn=clusterArn, collectedAt=time.time())
+
+    # list container instances for the cluster
+    # describe the container instances for their resources and task counts
+    # get the underlying EC2 instance type of each instance
+    containerList = []
+    try:
+        containerList = PaginateCall(
+            ecs_client.list_container_instances,
+            'containerInstanceArns',
+            cluster=clusterArn,
+            maxResults=LIST_PAGE_SIZE
+        )
+
+    except Exception as e:
+        HandleCallError(e)
+
+    if containerList != []:
+
+        containerInstances = []
+        try:
+            containerInstances = DescribeInBatches(
+                ecs_client.describe_container_instances,
+                'containerInstances',
+                containerList,
+                'containerInstances',
+                DESCRIBE_CONTAINER_INSTANCES_BATCH_SIZE,
+                cluster=clusterArn
+            )
+        except Exception as e:
+            HandleCallError(e)
+
+        for item in containerInstances:
+            instance = ContainerInstanceData()
+            instance.containerInstanceArn = item['containerInstanceArn']
+            instance.ec2InstanceId = item.get('ec2InstanceId', '')
+            instance.registeredCpu = GetResourceValue(item.get('registeredResources', []), 'CPU')
+            instance.registeredMemory = GetResourceValue(item.get('registeredResources', []), 'MEMORY')
+            instance.remainingCpu = GetResourceValue(item.get('remainingResources', []), 'CPU')
+            instance.remainingMemory = GetResourceValue(item.get('remainingResources', []), 'MEMORY')
+            instance.runningTasksCount = int(item.get('runningTasksCount', 0))
+
+            inventory.byContainerInstanceArn[instance.containerInstanceArn] = instance
+            inventory.byEc2InstanceId[instance.ec2InstanceId] = instance
+
+        reservations = []
+        try:
+            for batch in SplitIntoBatches(list(inventory.byEc2InstanceId), DESCRIBE_INSTANCES_BATCH_SIZE):
+                reservations += PaginateCall(
+                    ec2_client.describe_instances,
+                    'Reservations',
+                    InstanceIds=batch
+                )
+        except Exception as e:
+            HandleCallError(e)
+
+        for r in reservations:
+            for instances in r['Instances']:
+                if instances['InstanceId'] in inventory.byEc2InstanceId:
+                    inventory.byEc2InstanceId[instances['InstanceId']].instanceType = instances['InstanceType']
+
+    return inventory
+
+# inventory of the cluster from the collection state, rebuilt once its stage expired
+def GetClusterInventory(clusterArn):
+
+    inventory = collectionState.inventories.get(clusterArn)
+    if inventory == None:
+        inventory = GetContainerInstanceInventory(clusterArn)
+        # an inventory cut short by the cycle deadline is only used for this cycle
+        if not cycleDeadline.expired():
+            collectionState.inventories[clusterArn] = inventory
+
+    return inventory
+
+@TimedStage
+def GetEc2InstanceTypeFromClusterId(inventory):
+
+    return inventory.getInstanceType()
+
+# pull the torch serve settings out of the container environments of a task definition
+def ParseTaskDefinitionSettings(taskDef):
+
+    defaultWorkersKey = 'TS_DEFAULT_WORKERS_PER_MODEL'
+    requestTimeoutKey = 'MT_REQUEST_TIMEOUT'
+    queueSizeKey = 'TS_JOB_QUEUE_SIZE'
+    tsTimeoutSecs = 0
+    tsDefaultWorkersPerModel = 0
+    tsQueueSize = 0
+
+    for item in taskDef['containerDefinitions']:
+        for var in item.get('environment', []):
+            if var['name'] == defaultWorkersKey:
+                tsDefaultWorkersPerModel = var['value']
+            if var['name'] == requestTimeoutKey:
+                tsTimeoutSecs = var['value']
+            if var['name'] == queueSizeKey:
+                tsQueueSize = var['value']
+
+    settings = {}
+    settings['timeoutSecs'] = int(tsTimeoutSecs)
+    settings['defaultWorkersPerModel'] = int(tsDefaultWorkersPerModel)
+    settings['queueSize'] = int(tsQueueSize)
+
+    return settings
+
+@TimedStage
+def GetTaskDetailsForService(pair):
+
+    clusterArn, service = pair
+
+    # only GPU services are using torch serv ?!?!?!
+    #service.containerType != 'FARGATE' and 
+    if service.taskDefinitions != []:
+        # all tasks have the same config, grab the first and move on
+        taskDefArn = str(service.taskDefinitions[0])
+
+        try:
+            settings = taskDefCache.get(taskDefArn)
+
+            if settings == None:
+                resp = ecs_client.describe_task_definition(
+                    taskDefinition=taskDefArn,
+                    include=['TAGS']
+                )
+                settings = ParseTaskDefinitionSettings(resp['taskDefinition'])
+                taskDefCache.put(taskDefArn, settings)
+
+            service.timeoutSecs = settings['timeoutSecs']
+            service.defaultWorkersPerModel = settings['defaultWorkersPerModel']
+            service.queueSize = settings['queueSize']
+
+        except Exception as e:
+            HandleCallError(e, service)
+
+    return service
+
+@TimedStage
+def GetTaskDetails(clusterDataList):
+
+    RunConcurrently(GetTaskDetailsForService, GetClusterServicePairs(clusterDataList), unfinished=MarkPairPartial)
+
+    return clusterDataList
+
+# run every task level stage for one service
+def EnrichService(pair):
+
+    clusterArn, service = pair
+
+    if service.selected and not service.unchanged:
+        GetTaskArnsForService(pair)
+        GetFargateInfoForService(pair)
+        GetTaskDetailsForService(pair)
+
+    return pair
+
+# describe the services of one cluster a batch at a time and yield them as they are built
+def StreamClusterServices(cluster):
+
+    for batch in SplitIntoBatches(cluster.serviceArnList, DESCRIBE_SERVICES_BATCH_SIZE):
+        for entry in GetServiceInfo(cluster.clusterArn, batch, cluster):
+            yield (cluster.clusterArn, BuildServiceData(cluster, entry))
+
+# streaming version of the collection stages, every service is enriched and yielded as a
+# log record as soon as it is complete, nothing is kept for the rest of the cycle
+def StreamServiceRecords():
+
+    clusterList, clusterIndex = GetClusters()
+
+    for clusterArn in clusterList:
+        cluster = GetServiceList([clusterArn], clusterIndex)[0]
+        clusterName = GetClusterName(clusterArn)
+
+        if CLUSTER_RECORDS and cluster.owned:
+            yield FormatClusterRecord(cluster, clusterName)
+
+        for pair in StreamConcurrently(EnrichService, StreamClusterServices(cluster), MAX_WORKERS * 2):
+            service = pair[1]
+            if CYCLE_BUDGET > 0:
+                lastKnownServices.fillService(service)
+            if pricingTable.loaded:
+                ComputeServiceCost(service, cluster.inventory)
+            if INCREMENTAL:
+                serviceSnapshot.add(service)
+            # only log data with valid service tags (and matching SM_SERVICE_SELECTOR)
+            if service.selected:
+                if ROLLUP_MODE != 'only':
+                    yield from FormatServiceRecords(service, clusterName)
+                if ROLLUP_MODE != 'off':
+                    taskMinuteBuffer.record(service, clusterName, recordWriter.logMinute)
+                # the caller has logged the records of the service, write them out instead of waiting for a full buffer
+                recordWriter.flush()
+
+        # a describe_services batch of the cluster may have failed while the services streamed through
+        if EMIT_MODE == 'delta' and cluster.dataStatus != '':
+            serviceDeltaFilter.keepCluster(clusterName)
+
+        # the inventory is built while the services stream through
+        GetOwnedClusterInventory(cluster)
+        if CLUSTER_RECORDS and cluster.owned and cluster.inventory != None:
+            yield FormatCapacityRecord(cluster, clusterName)
+
+# per region fargate rates and ec2 on-demand prices, loaded once and indexed for the current region
+class PricingTable():
+
+    def __init__(self, pricingFile, region):
+        self.pricingFile = pricingFile
+        self.region = region
+        self.fargateVcpuHour = 0.0
+        self.fargateGbHour = 0.0
+        self.ec2Hourly = {}
+        self.loaded = False
+
+    def load(self):
+        try:
+            with open(self.pricingFile) as f:
+                pricing = json.load(f)
+
+            fargate = pricing.get('fargate', {}).get(self.region, {})
+            self.fargateVcpuHour = float(fargate.get('vcpuHour', 0.0))
+            self.fargateGbHour = float(fargate.get('gbHour', 0.0))
+            self.ec2Hourly = {k: float(v) for k, v in pricing.get('ec2', {}).get(self.region, {}).items()}
+            self.loaded = True
+
+        except Exception as e:
+            print('could not load pricing file, service costs will be 0: ', e)
+
+    # container instance arn -> hourly price of the instance split evenly across the tasks on it,
+    # built once per inventory and shared by every EC2 service in the cluster
+    def getHourlyCostPerTask(self, inventory):
+        if inventory.hourlyCostPerTask == None:
+            hourlyCostPerTask = {}
+            for arn, instance in inventory.byContainerInstanceArn.items():
+                hourlyCostPerTask[arn] = self.ec2Hourly.get(instance.instanceType, 0.0) / max(1, instance.runningTasksCount)
+            inventory.hourlyCostPerTask = hourlyCostPerTask
+
+        return inventory.hourlyCostPerTask
+
+pricingTable = PricingTable(PRICING_FILE, region or 'us-east-1')
+
+def ComputeServiceCost(service, inventory):
+
+    hourlyCost = 0.0
+
+    if service.containerType == 'FARGATE':
+        # fargateVcpu is in cpu units (1024 per vcpu), fargateMem in MiB, both summed over the tasks
+        hourlyCost = (service.fargateVcpu / 1024) * pricingTable.fargateVcpuHour + (service.fargateMem / 1024) * pricingTable.fargateGbHour
+
+    elif service.containerType == 'EC2' and inventory != None:
+        hourlyCostPerTask = pricingTable.getHourlyCostPerTask(inventory)
+        hourlyCost = sum(hourlyCostPerTask.get(arn, 0.0) for arn in service.containerInstanceArns)
+
+    service.serviceCostPerMinute = round(hourlyCost / 60, 6)
+
+    return service
+
+# one pass over every service of the cycle, the price lookups are all prebuilt per cluster
+@TimedStage
+def ComputeServiceCosts(clusterDataList):
+
+    if not pricingTable.loaded:
+        return clusterDataList
+
+    for cluster in clusterDataList:
+        for service in cluster.serviceDataList:
+            ComputeServiceCost(service, cluster.inventory)
+
+    return clusterDataList
+
+# fixed size, array backed history of the per minute task counts of each service with incremental
+# 5m / 1h / 1d rollups. Each service owns one row of the array:
+#   [slots x counters values][slots x minute stamps][per window: start, samples, sum / min / max per counter]
+# so memory is bounded by maxServices rows. With a ring file the array is a memory mapped file and the
+# row index is kept in a json file next to it, so history and open windows survive restarts.
+class TaskMinuteRingBuffer():
+
+    def __init__(self, maxServices, slots, ringFile=''):
+        self.maxServices = maxServices
+        self.slots = slots
+        self.ringFile = ringFile
+        self.counters = len(ROLLUP_COUNTERS)
+        self.stampOffset = slots * self.counters
+        self.windowOffset = self.stampOffset + slots
+        self.windowSize = 2 + 3 * self.counters
+        self.rowSize = self.windowOffset + len(ROLLUP_WINDOWS) * self.windowSize
+        self.rows = {} # service arn -> [row, serviceTag, clusterName, last minute]
+        self.freeRows = list(range(maxServices - 1, -1, -1))
+        self.values = None
+        self.mappedFile = None
+        # windows a later sample moved on from before they were closed, logged with the next closeWindows
+        self.closedWindows = []
+
+    def open(self):
+        size = self.maxServices * self.rowSize
+
+        if self.ringFile != '':
+            try:
+                indexFile = self.ringFile + '.json'
+                rows = {}
+                if os.path.exists(indexFile) and os.path.exists(self.ringFile) and os.path.getsize(self.ringFile) == size * 8:
+                    with open(indexFile) as f:
+                        index = json.load(f)
+                    if index.get('slots') == self.slots and index.get('maxServices') == self.maxServices:
+                        rows = index['rows']
+                else:
+                    with open(self.ringFile, 'wb') as f:
+                        f.truncate(size * 8)
+
+                with open(self.ringFile, 'r+b') as f:
+                    self.mappedFile = mmap.mmap(f.fileno(), size * 8)
+                self.values = memoryview(self.mappedFile).cast('d')
+                if rows == {}:
+                    self.values[:] = array('d', bytes(size * 8))
+                self.rows = rows
+                used = set(entry[0] for entry in rows.values())
+                self.freeRows = [row for row in range(self.maxServices - 1, -1, -1) if row not in used]
+                return
+
+            except Exception as e:
+                print('could not open rollup file, keeping rollups in memory: ', e)
+
+        self.values = array('d', bytes(size * 8))
+
+    def save(self):
+        if self.mappedFile == None:
+            return
+
+        try:
+            self.mappedFile.flush()
+            indexFile = self.ringFile + '.json'
+            with open(indexFile + '.tmp', 'w') as f:
+                json.dump({'slots': self.slots, 'maxServices': self.maxServices, 'rows': self.rows}, f)
+            os.replace(indexFile + '.tmp', indexFile)
+
+        except Exception as e:
+            print('could not save rollup index: ', e)
+
+    # rows are handed out in order, once full the least recently updated service gives up its row
+    def getRow(self, serviceArn, serviceTag, clusterName):
+        entry = self.rows.get(serviceArn)
+        if entry != None:
+            entry[1] = serviceTag
+            entry[2] = clusterName
+            return entry
+
+        if self.freeRows != []:
+            row = self.freeRows.pop()
+        else:
+            oldestArn = min(self.rows, key=lambda arn: self.rows[arn][3])
+            row = self.rows.pop(oldestArn)[0]
+
+        start = row * self.rowSize
+        self.values[start:start + self.rowSize] = array('d', bytes(self.rowSize * 8))
+        entry = [row, serviceTag, clusterName, -1]
+        self.rows[serviceArn] = entry
+
+        return entry
+
+    def record(self, service, clusterName, minute):
+        entry = self.getRow(service.serviceArn, service.serviceTag, clusterName)
+        # a second cycle in the same minute only refreshes the slot
+        duplicate = entry[3] == minute
+        entry[3] = minute
+
+        values = self.values
+        base = entry[0] * self.rowSize
+        slot = minute % self.slots
+        counts = [getattr(service, counter) for counter, sumKey in ROLLUP_COUNTERS]
+
+        for c in range(self.counters):
+            values[base + slot * self.counters + c] = counts[c]
+        values[base + self.stampOffset + slot] = minute
+
+        if duplicate:
+            return
+
+        for w in range(len(ROLLUP_WINDOWS)):
+            windowMinutes = ROLLUP_WINDOWS[w][1]
+            windowStart = minute - minute % windowMinutes
+            pos = base + self.windowOffset + w * self.windowSize
+            # the window's last minute had no sample (longer interval, skipped tick), close it here
+            if values[pos + 1] != 0 and values[pos] != windowStart:
+                self.closedWindows.append(self.formatWindow(entry, w, pos))
+            if values[pos + 1] == 0 or values[pos] != windowStart:
+                values[pos] = windowStart
+                values[pos + 1] = 0
+
+            samples = values[pos + 1]
+            for c in range(self.counters):
+                cpos = pos + 2 + c * 3
+                count = counts[c]
+                if samples == 0:
+                    values[cpos] = count
+                    values[cpos + 1] = count
+                    values[cpos + 2] = count
+                else:
+                    values[cpos] += count
+                    values[cpos + 1] = min(values[cpos + 1], count)
+                    values[cpos + 2] = max(values[cpos + 2], count)
+            values[pos + 1] = samples + 1
+
+    def formatWindow(self, entry, w, pos):
+        values = self.values
+        windowName, windowMinutes = ROLLUP_WINDOWS[w]
+        samples = values[pos + 1]
+
+        jsonData = {}
+        jsonData['recordType'] = 'rollup'
+        jsonData['serviceTag'] = entry[1]
+        jsonData['clusterName'] = entry[2]
+        jsonData['window'] = windowName
+        jsonData['windowStart'] = datetime.fromtimestamp(values[pos] * 60, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        jsonData['samples'] = int(samples)
+        for c in range(self.counters):
+            counter, sumKey = ROLLUP_COUNTERS[c]
+            cpos = pos + 2 + c * 3
+            jsonData[sumKey] = int(values[cpos])
+            jsonData[counter + 'Min'] = int(values[cpos + 1])
+            jsonData[counter + 'Max'] = int(values[cpos + 2])
+            jsonData[counter + 'Avg'] = round(values[cpos] / samples, 3)
+
+        return jsonData
+
+    # emit and reset every window that ended at or before the given minute
+    def closeWindows(self, minute):
+        records = self.closedWindows
+        self.closedWindows = []
+        values = self.values
+
+        for serviceArn, entry in self.rows.items():
+            base = entry[0] * self.rowSize
+            for w in range(len(ROLLUP_WINDOWS)):
+                windowName, windowMinutes = ROLLUP_WINDOWS[w]
+                pos = base + self.windowOffset + w * self.windowSize
+                samples = values[pos + 1]
+                if samples == 0 or values[pos] + windowMinutes > minute + 1:
+                    continue
+
+                records.append(self.formatWindow(entry, w, pos))
+                values[pos + 1] = 0
+
+        return records
+
+if ROLLUP_MODE not in ['off', 'append', 'only']:
+    print('unknown SM_ROLLUP_MODE value, using default value: off')
+    ROLLUP_MODE = 'off'
+
+taskMinuteBuffer = TaskMinuteRingBuffer(ROLLUP_MAX_SERVICES, ROLLUP_SLOTS, ROLLUP_FILE)
+
+@dataclass
+class ScheduledJob():
+    name: str = ''
+    interval: float = 60.0
+    func: object = None
+    policy: str = 'skip'
+    jitter: float = 0.0
+    tick: int = 0 # index of the next grid tick to run
+    nextRun: float = 0.0
+    runs: int = 0
+    skipped: int = 0
+    drift: LatencyHistogram = field(default_factory=LatencyHistogram) # actual start - scheduled start
+    duration: LatencyHistogram = field(default_factory=LatencyHistogram)
+
+# runs each job on its own fixed grid (start + tick * interval) so lateness never accumulates.
+# When a run ends past its next tick the job's overrun policy decides what happens:
+#   skip: wait for the next future tick, the missed ticks are counted as skipped
+#   coalesce: run once straight away for all the missed ticks, then continue on the grid
+#   catchup: run every missed tick back to back
+class Scheduler():
+
+    POLICIES = ['skip', 'coalesce', 'catchup']
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.jobs = []
+        self.startTime = None
+
+    def addJob(self, name, interval, func, policy='skip', jitter=0.0):
+        if policy not in self.POLICIES:
+            print('unknown overrun policy ' + policy + ', using default value: skip')
+            policy = 'skip'
+
+        job = ScheduledJob(name=name, interval=interval, func=func, policy=policy, jitter=jitter)
+        self.jobs.append(job)
+
+        return job
+
+    def getTickTime(self, job, tick):
+        return self.startTime + tick * job.interval
+
+    def scheduleNext(self, job, now):
+        # last grid tick that has already started
+        passedTick = int((now - self.startTime) // job.interval)
+
+        if job.policy == 'catchup' or passedTick <= job.tick:
+            job.tick+=1
+        elif job.policy == 'coalesce':
+            job.skipped += passedTick - job.tick - 1
+            job.tick = passedTick
+        else:
+            job.skipped += passedTick - job.tick
+            job.tick = passedTick + 1
+
+        job.nextRun = self.getTickTime(job, job.tick)
+        if job.jitter > 0:
+            job.nextRun += random.uniform(0, job.jitter)
+
+    # run the next due job (jobs due at the same time run in the order they were added)
+    def runNext(self):
+        if self.startTime == None:
+            self.startTime = self.clock()
+            for job in self.jobs:
+                job.nextRun = self.startTime + (random.uniform(0, job.jitter) if job.jitter > 0 else 0.0)
+
+        job = min(self.jobs, key=lambda j: j.nextRun)
+
+        delay = job.nextRun - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+
+        start = self.clock()
+        job.drift.observe(max(0.0, start - job.nextRun))
+        try:
+            job.func()
+        except Exception as e:
+            print('error during scheduled job ' + job.name + ': ', e)
+        end = self.clock()
+        job.duration.observe(end - start)
+        job.runs+=1
+
+        skippedBefore = job.skipped
+        self.scheduleNext(job, end)
+        if job.skipped != skippedBefore:
+            print('scheduled job ' + job.name + ' overran its interval, skipped ticks: ', job.skipped - skippedBefore)
+
+        return job
+
+    def run(self, maxRuns=None):
+        runs = 0
+        while maxRuns == None or runs < maxRuns:
+            self.runNext()
+            runs+=1
+
+# task statuses counted as pending by describe_services
+PENDING_TASK_STATUSES = ['PROVISIONING', 'PENDING', 'ACTIVATING']
+STOPPED_TASK_STATUSES = ['DEACTIVATING', 'STOPPING', 'DEPROVISIONING', 'STOPPED', 'DELETED']
+
+# last polled clusters / services with their task counts kept current by task state change events.
+# Task events move a task between pending / running / stopped, service and deployment events queue a
+# describe_services of just that service. Events for services the poll has not seen yet ask for an
+# early reconciliation poll
+class EventIndex():
+
+    def __init__(self):
+        self.clusters = None
+        self.services = {} # (cluster arn, service name) -> (cluster, service)
+        self.tasks = {} # task arn -> [service key, last status, event version]
+        self.refresh = set()
+        self.changed = set()
+        self.rebuiltAt = 0.0
+        self.reconcileRequested = False
+        self.applied = 0
+        self.ignored = 0
+
+    def rebuild(self, clusterDataList):
+        self.clusters = clusterDataList
+        self.services = {}
+        self.tasks = {}
+        for cluster in clusterDataList:
+            for service in cluster.serviceDataList:
+                key = (cluster.clusterArn, service.serviceName)
+                self.services[key] = (cluster, service)
+                # status of the poll's describe_tasks, list_tasks only returns tasks that are meant to run
+                # so a task that was not described is taken as running
+                for taskArn in service.taskArns:
+                    status = service.taskStatuses.get(taskArn, 'RUNNING')
+                    if status in STOPPED_TASK_STATUSES:
+                        status = 'STOPPED'
+                    self.tasks[taskArn] = [key, status, -1]
+        self.refresh = set()
+        self.rebuiltAt = time.time()
+        self.reconcileRequested = False
+
+    def apply(self, event):
+        detailType = event.get('detail-type', '')
+        detail = event.get('detail', {})
+
+        if detailType == 'ECS Task State Change':
+            self.applyTaskEvent(detail)
+        elif detailType in ['ECS Service Action', 'ECS Deployment State Change']:
+            for arn in event.get('resources', []):
+                if ':service/' in arn:
+                    self.refresh.add((detail.get('clusterArn', ''), arn.split('/')[-1]))
+            self.applied+=1
+        else:
+            self.ignored+=1
+
+    def applyTaskEvent(self, detail):
+        group = detail.get('group', '')
+        key = (detail.get('clusterArn', ''), group[len('service:'):])
+        entry = self.services.get(key)
+        if not group.startswith('service:') or entry == None:
+            # stand alone task, another replica's service or a service created since the last poll
+            if group.startswith('service:') and shardAssignment.ownsService(key[0], key[1], collectionState.clusterIndex.get(key[0])):
+                self.reconcileRequested = True
+            self.ignored+=1
+            return
+
+        taskArn = detail.get('taskArn', '')
+        version = int(detail.get('version', 0))
+        known = self.tasks.get(taskArn)
+        if known != None and version <= known[2]:
+            self.ignored+=1
+            return
+
+        oldStatus = known[1] if known != None else None
+        newStatus = detail.get('lastStatus', '')
+        if newStatus in STOPPED_TASK_STATUSES:
+            newStatus = 'STOPPED'
+
+        service = entry[1]
+        running = service.runningTasks + (newStatus == 'RUNNING') - (oldStatus == 'RUNNING')
+        pending = service.pendingTasks + (newStatus in PENDING_TASK_STATUSES) - (oldStatus in PENDING_TASK_STATUSES)
+
+        # stopped tasks stay in the index until the next rebuild so late events of them are dropped
+        self.tasks[taskArn] = [key, newStatus, version]
+        if newStatus == 'STOPPED':
+            if taskArn in service.taskArns:
+                service.taskArns.remove(taskArn)
+        elif taskArn not in service.taskArns:
+            service.taskArns.append(taskArn)
+
+        if running != service.runningTasks or pending != service.pendingTasks:
+            SetServiceCounts(service, service.desiredTasks, max(running, 0), max(pending, 0))
+            self.changed.add(key)
+        self.applied+=1
+
+    # describe_services for the services named by service events, ten at a time per cluster
+    def refreshServices(self):
+        byCluster = {}
+        for key in self.refresh:
+            if key in self.services:
+                byCluster.setdefault(key[0], []).append(self.services[key][1].serviceArn)
+            elif shardAssignment.ownsService(key[0], key[1], collectionState.clusterIndex.get(key[0])):
+                self.reconcileRequested = True
+        self.refresh = set()
+
+        for clusterArn, serviceArns in byCluster.items():
+            for batch in SplitIntoBatches(sorted(serviceArns), DESCRIBE_SERVICES_BATCH_SIZE):
+                for entry in GetServiceInfo(clusterArn, batch):
+                    key = (clusterArn, entry['serviceName'])
+                    service = self.services[key][1]
+                    counts = (int(entry['desiredCount']), int(entry['runningCount']), int(entry['pendingCount']))
+                    if counts != (service.desiredTasks, service.runningTasks, service.pendingTasks):
+                        SetServiceCounts(service, *counts)
+                        self.changed.add(key)
+
+    def drainChanges(self):
+        changed = [self.services[key] for key in sorted(self.changed) if key in self.services]
+        self.changed = set()
+        return changed
+
+eventIndex = EventIndex()
+
+def ParseEvent(line):
+
+    line = line.strip()
+    if line == '':
+        return None
+
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        print('invalid event: ', e)
+
+    return None
+
+# every file dropped in the directory holds one event or json lines, files are read in name order
+# and removed once applied, like messages taken off a queue
+class DirectoryEventSource():
+
+    def __init__(self, path):
+        self.path = path
+
+    def poll(self):
+        events = []
+        try:
+            fileNames = sorted(f for f in os.listdir(self.path) if not f.startswith('.'))
+        except Exception as e:
+            print('could not read event directory: ', e)
+            return events
+
+        for fileName in fileNames:
+            fullPath = os.path.join(self.path, fileName)
+            try:
+                with open(fullPath) as f:
+                    text = f.read()
+                os.remove(fullPath)
+            except Exception as e:
+                print('could not read event file: ', e)
+                continue
+
+            try:
+                events.append(json.loads(text))
+            except ValueError:
+                for line in text.splitlines():
+                    event = ParseEvent(line)
+                    if event != None:
+                        events.append(event)
+
+        return events
+
+# json lines appended to a file, read from the end like tail -f and reopened when rotated or truncated
+class FileTailEventSource():
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.inode = None
+        self.partial = ''
+
+    def open(self, fromEnd):
+        if self.file != None:
+            self.file.close()
+        self.file = open(self.path)
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        if fromEnd:
+            self.file.seek(0, os.SEEK_END)
+        self.partial = ''
+
+    def poll(self):
+        try:
+            if self.file == None:
+                self.open(fromEnd=True)
+            else:
+                stat = os.stat(self.path)
+                if stat.st_ino != self.inode or stat.st_size < self.file.tell():
+                    self.open(fromEnd=False)
+        except OSError:
+            # not created yet or mid rotation, try again on the next poll
+            return []
+
+        lines = (self.partial + self.file.read()).split('\n')
+        # keep a line that is still being written for the next poll
+        self.partial = lines.pop()
+
+        return [event for event in map(ParseEvent, lines) if event != None]
+
+# json lines on stdin, read by a background thread so a poll never blocks
+class StdinEventSource():
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdin
+        self.events = queue.Queue()
+        self.thread = threading.Thread(target=self.read, daemon=True)
+        self.thread.start()
+
+    def read(self):
+        for line in self.stream:
+            event = ParseEvent(line)
+            if event != None:
+                self.events.put(event)
+
+    def poll(self):
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+def OpenEventSource(source):
+
+    if source == 'stdin':
+        return StdinEventSource()
+    if source.startswith('dir:'):
+        return DirectoryEventSource(source[len('dir:'):])
+    if source.startswith('file:'):
+        return FileTailEventSource(source[len('file:'):])
+
+    print('unknown SM_EVENT_SOURCE value: ', source)
+
+    return None
+
+# apply the pending events and log a recordType: serviceChange record for every service whose
+# counts moved, so changes show up within seconds instead of at the next collection tick
+def ProcessEvents(eventSource):
+
+    if eventIndex.clusters == None:
+        return
+
+    for event in eventSource.poll():
+        eventIndex.apply(event)
+    eventIndex.refreshServices()
+
+    changes = eventIndex.drainChanges()
+    if changes == []:
+        return
+
+    recordWriter.beginCycle()
+    for cluster, service in changes:
+        if service.selected:
+            jsonData = {}
+            jsonData['recordType'] = 'serviceChange'
+            jsonData['serviceTag'] = service.serviceTag
+            jsonData['clusterName'] = GetClusterName(cluster.clusterArn)
+            jsonData['desiredTasks'] = service.desiredTasks
+            jsonData['runningTasks'] = service.runningTasks
+            jsonData['pendingTasks'] = service.pendingTasks
+            LogRecord(jsonData)
+    recordWriter.flush()
+
+# collection tick with an event source: a full poll when the index is due for reconciliation,
+# otherwise the per minute records are logged straight from the event updated index
+def RunEventCycle():
+
+    if eventIndex.clusters == None or eventIndex.reconcileRequested or time.time() - eventIndex.rebuiltAt >= RECONCILE_INTERVAL:
+        RunCollectionCycle()
+    else:
+        CollectServiceMetrics(useCachedStages=True, indexed=True)
+
+def logToScreen(inputList):
+
+    for item in inputList:
+        item.printData()
+
+
+# useCachedStages keeps the cluster list and inventories the scheduler has not expired yet,
+# otherwise every stage is collected fresh
+# indexed logs the services of the event index instead of collecting them
+def CollectServiceMetrics(useCachedStages=False, indexed=False):
+
+    if not useCachedStages:
+        collectionState.expireAll()
+    if INCREMENTAL:
+        serviceSnapshot.beginCycle()
+    recordWriter.beginCycle()
+    collectorMetrics.beginCycle()
+    if EMIT_MODE == 'delta':
+        serviceDeltaFilter.beginCycle()
+    if CYCLE_BUDGET > 0:
+        cycleDeadline.begin()
+        lastKnownServices.beginCycle()
+    serviceSelector.beginCycle()
+
+    if indexed:
+        ConvertListToJsonLogFormat(ComputeServiceCosts(eventIndex.clusters))
+
+    # the event index needs every service of the poll, event mode always uses the batch stages
+    elif STREAMING and EVENT_SOURCE == '':
+        for jsonData in StreamServiceRecords():
+            LogRecord(jsonData)
+        if INCREMENTAL:
+            serviceSnapshot.commit()
+
+    else:
+        cycleDeadline.beginStage('GetClusters')
+        clusterList, clusterIndex = GetClusters()
+        cycleDeadline.beginStage('GetServiceList')
+        clusterDataList = GetServiceList(clusterList, clusterIndex)
+        cycleDeadline.beginStage('CollectServiceData')
+        clusterAndServiceDataList = CollectServiceData(clusterDataList)
+        cycleDeadline.beginStage('GetTaskArns')
+        cstDataList = GetTaskArns(clusterAndServiceDataList)
+        cycleDeadline.beginStage('GetFargateInfo')
+        cstUpdatedDataList = GetFargateInfo(cstDataList)
+        cycleDeadline.beginStage('GetTaskDetails')
+        cstUpdatedDataList = GetTaskDetails(cstUpdatedDataList)
+        if CYCLE_BUDGET > 0:
+            lastKnownServices.fill(cstUpdatedDataList)
+        cstUpdatedDataList = ComputeServiceCosts(cstUpdatedDataList)
+        if INCREMENTAL:
+            serviceSnapshot.update(cstUpdatedDataList)
+        if EVENT_SOURCE != '':
+            eventIndex.rebuild(cstUpdatedDataList)
+        ConvertListToJsonLogFormat(cstUpdatedDataList)
+
+    cycleDeadline.endCycle()
+    if EMIT_MODE == 'delta':
+        for jsonData in serviceDeltaFilter.endCycle(keepAll=collectionState.clusterListFailed):
+            LogRecord(jsonData)
+
+    if ROLLUP_MODE != 'off':
+        for jsonData in taskMinuteBuffer.closeWindows(recordWriter.logMinute):
+            LogRecord(jsonData)
+        taskMinuteBuffer.save()
+
+    collectorMetrics.endCycle(recordWriter.records)
+    if STATS_RECORDS:
+        jsonData = collectorMetrics.formatCycleRecord()
+        if sinkWriter != None:
+            jsonData['sinks'] = sinkWriter.getStats()
+        jsonData['prunedServices'] = serviceSelector.pruned
+        jsonData['taskDefCacheHits'] = taskDefCache.hits
+        jsonData['taskDefCacheMisses'] = taskDefCache.misses
+        if CYCLE_BUDGET > 0:
+            jsonData['expiredStages'] = cycleDeadline.expiredStages
+            jsonData['abandonedCalls'] = cycleDeadline.abandoned
+            jsonData['staleServices'] = lastKnownServices.stale
+            jsonData['partialServices'] = lastKnownServices.partial
+        LogRecord(jsonData)
+
+    recordWriter.flush()
+    if RECORD_FILE != '':
+        apiRecorder.flush()
+
+def RunCollectionCycle():
+
+    start = time.time()
+    taskDefCache.resetStats()
+
+    CollectServiceMetrics(useCachedStages=True)
+    taskDefCache.save()
+    warmState.save()
+
+    if DEBUG:
+        print()
+        print('elapsed: ', time.time() - start)
+        print('task definition cache hits: ', taskDefCache.hits, ' misses: ', taskDefCache.misses)
+        if recordWriter.records != 0:
+            print('records: ', recordWriter.records, ' encode time per record: ', recordWriter.encodeSeconds / recordWriter.records * 1000000, 'us')
+        if INCREMENTAL:
+            print('unchanged services reused: ', serviceSnapshot.reused, ' full refresh: ', serviceSnapshot.fullRefresh)
+        print('stage seconds: ', collectorMetrics.stageSeconds)
+        print('selected services: ', serviceSelector.selected, ' pruned: ', serviceSelector.pruned)
+        if CYCLE_BUDGET > 0:
+            print('deadline expired stages: ', cycleDeadline.expiredStages, ' abandoned calls: ', cycleDeadline.abandoned, ' stale services: ', lastKnownServices.stale, ' partial services: ', lastKnownServices.partial)
+        print('import to first record: ', GetFirstRecordSeconds())
+        for job in scheduler.jobs:
+            print('job ' + job.name + ' runs: ', job.runs, ' skipped: ', job.skipped, ' drift: ', job.drift.summary(), ' duration: ', job.duration.summary())
+        print()
+
+# the only classes a warm start state holds besides the builtin types
+WARM_STATE_CLASSES = ['ServiceData', 'TaskColumns', 'ClusterMetadata', 'ClusterInventory', 'ContainerInstanceData']
+WARM_STATE_GLOBALS = [('array', 'array'), ('array', '_array_reconstructor'), ('collections', 'OrderedDict')]
+
+# the state file is written by this module, possibly running as __main__, map its classes back here.
+# anything else is refused so a tampered state file cannot run code
+class WarmStateUnpickler(pickle.Unpickler):
+
+    def find_class(self, module, name):
+        if module in ['__main__', '__mp_main__', __name__] and name in WARM_STATE_CLASSES:
+            return globals()[name]
+        if (module, name) in WARM_STATE_GLOBALS:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError('warm start state refers to ' + module + '.' + name)
+
+# caches and snapshots saved after every cycle so the next run (a restart, cron job or lambda cold
+# start) starts warm. Stages older than their refresh interval are left to be collected again
+class WarmState():
+
+    def __init__(self, stateFile):
+        self.stateFile = stateFile
+
+    def save(self):
+        if self.stateFile == '':
+            return
+
+        state = {
+            'savedAt': time.time(),
+            'taskDefinitions': dict(taskDefCache.entries),
+            'services': serviceSnapshot.services,
+            'snapshotRefreshedAt': serviceSnapshot.refreshedAt,
+            'clusterList': collectionState.clusterList,
+            'clusterListTime': collectionState.clusterListTime,
+            'clusterIndex': collectionState.clusterIndex,
+            'inventories': collectionState.inventories,
+            'emittedServices': serviceDeltaFilter.services,
+            'deltaCycles': serviceDeltaFilter.cycles
+        }
+        try:
+            tmpFile = self.stateFile + '.tmp'
+            with open(tmpFile, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpFile, self.stateFile)
+
+        except Exception as e:
+            print('could not save warm start state: ', e)
+
+    def load(self):
+        if self.stateFile == '' or not os.path.exists(self.stateFile):
+            return
+
+        try:
+            with open(self.stateFile, 'rb') as f:
+                state = WarmStateUnpickler(f).load()
+
+        except Exception as e:
+            print('could not load warm start state: ', e)
+            return
+
+        now = time.time()
+        for taskDefArn, entry in state['taskDefinitions'].items():
+            taskDefCache.put(taskDefArn, entry)
+        if INCREMENTAL:
+            serviceSnapshot.services = state['services']
+            serviceSnapshot.refreshedAt = state.get('snapshotRefreshedAt')
+        if state['clusterList'] != None:
+            collectionState.clusterList = state['clusterList']
+            collectionState.clusterListTime = state['clusterListTime']
+            collectionState.clusterIndex = state['clusterIndex']
+        collectionState.inventories = state['inventories']
+        collectionState.expireAged(now)
+        # a one-shot run only logs what changed since the last run
+        if EMIT_MODE == 'delta' and 'emittedServices' in state:
+            serviceDeltaFilter.services = state['emittedServices']
+            serviceDeltaFilter.cycles = state['deltaCycles']
+            serviceDeltaFilter.beginCycle()
+
+warmState = WarmState(STATE_FILE)
+
+# seconds from the start of the import to the first record written to stdout
+def GetFirstRecordSeconds():
+
+    if recordWriter.firstRecordTime == None:
+        return None
+
+    return recordWriter.firstRecordTime - IMPORT_TIME
+
+# one collection cycle from the warm start state, for cron jobs and scheduled lambdas
+def RunOneShot():
+
+    start = time.perf_counter()
+
+    taskDefCache.load()
+    pricingTable.load()
+    if ROLLUP_MODE != 'off':
+        taskMinuteBuffer.open()
+    warmState.load()
+
+    RunCollectionCycle()
+    if sinkWriter != None:
+        sinkWriter.drain(SINK_CLOSE_SECONDS)
+
+    return {
+        'records': recordWriter.records,
+        'seconds': round(time.perf_counter() - start, 3),
+        'firstRecordSeconds': GetFirstRecordSeconds()
+    }
+
+# lambda entry point, a warm container keeps the module state so only a cold start reads the state file
+lambdaState = {'loaded': False}
+
+def lambda_handler(event, context):
+
+    if not lambdaState['loaded']:
+        lambdaState['loaded'] = True
+        return RunOneShot()
+
+    # a warm container keeps the stages of earlier invocations, collect the ones that aged out again
+    start = time.perf_counter()
+    collectionState.expireAged(time.time())
+    RunCollectionCycle()
+    if sinkWriter != None:
+        sinkWriter.drain(SINK_CLOSE_SECONDS)
+
+    return {
+        'records': recordWriter.records,
+        'seconds': round(time.perf_counter() - start, 3),
+        'firstRecordSeconds': GetFirstRecordSeconds()
+    }
+
+# account id of an iam role arn (arn:aws:iam::<account>:role/<name>)
+def GetAccountIdFromRoleArn(roleArn):
+
+    parts = roleArn.split(':')
+    if len(parts) > 4:
+        return parts[4]
+
+    return ''
+
+# per target file name of the cache / ring buffer / recording files so workers never share one
+def GetTargetFileName(fileName, accountId, region):
+
+    if fileName == '':
+        return ''
+
+    root, ext = os.path.splitext(fileName)
+
+    return root + '.' + (accountId or 'default') + '.' + region + ext
+
+# one region / account pair collected by a fan out worker, with its own session and clients
+class CollectionTarget():
+
+    def __init__(self, region, roleArn=''):
+        self.region = region
+        self.roleArn = roleArn
+        self.accountId = GetAccountIdFromRoleArn(roleArn)
+        self.expiration = None
+
+    def connect(self):
+        if REPLAY_FILE != '':
+            SetClients(ReplayClient('ecs', apiReplay), ReplayClient('ec2', apiReplay))
+            return
+
+        import boto3
+
+        session = boto3.Session(region_name=self.region)
+        if self.roleArn != '':
+            resp = session.client('sts').assume_role(
+                RoleArn=self.roleArn,
+                RoleSessionName='service-metrics',
+                DurationSeconds=ROLE_SESSION_SECONDS
+            )
+            credentials = resp['Credentials']
+            self.expiration = credentials['Expiration']
+            session = boto3.Session(
+                aws_access_key_id=credentials['AccessKeyId'],
+                aws_secret_access_key=credentials['SecretAccessKey'],
+                aws_session_token=credentials['SessionToken'],
+                region_name=self.region
+            )
+        elif self.accountId == '':
+            try:
+                self.accountId = session.client('sts').get_caller_identity()['Account']
+            except Exception as e:
+                print('error during client call: ', e)
+
+        SetClients(session.client('ecs', config=GetClientConfig()), session.client('ec2', config=GetClientConfig()))
+
+    # renew the assumed role credentials shortly before they expire
+    def refresh(self):
+        if self.expiration != None and (self.expiration - datetime.now(timezone.utc)).total_seconds() < ROLE_RENEW_SECONDS:
+            self.connect()
+
+# collection loop of a fan out worker process: waits for the list of expired stages of each cycle,
+# collects its target and sends back the cycle's output so the parent can merge it in target order
+def RunTargetWorker(connection, region, roleArn):
+
+    # only the records go back to the parent, errors and debug output go to stderr
+    stream = io.StringIO()
+    sys.stdout = sys.stderr
+
+    target = CollectionTarget(region, roleArn)
+    try:
+        target.connect()
+    except Exception as e:
+        print('error during client call: ', e)
+
+    # the parent hands the merged output to the sinks
+    recordWriter.sink = None
+    recordWriter.stream = stream
+    recordWriter.tags = {'region': region, 'accountId': target.accountId}
+    recordWriter.writeHeader = False
+    pricingTable.region = region
+    taskDefCache.cacheFile = GetTargetFileName(taskDefCache.cacheFile, target.accountId, region)
+    taskMinuteBuffer.ringFile = GetTargetFileName(taskMinuteBuffer.ringFile, target.accountId, region)
+    apiRecorder.fileName = GetTargetFileName(apiRecorder.fileName, target.accountId, region)
+    apiReplay.fileName = GetTargetFileName(apiReplay.fileName, target.accountId, region)
+    warmState.stateFile = GetTargetFileName(warmState.stateFile, target.accountId, region)
+
+    taskDefCache.load()
+    pricingTable.load()
+    if ROLLUP_MODE != 'off':
+        taskMinuteBuffer.open()
+    warmState.load()
+
+    while True:
+        expired = connection.recv()
+        if expired == None:
+            break
+
+        if 'clusterList' in expired:
+            collectionState.expireClusters()
+        if 'inventory' in expired:
+            collectionState.expireInventories()
+        if 'taskRefresh' in expired:
+            serviceSnapshot.requestFullRefresh()
+
+        try:
+            target.refresh()
+            RunCollectionCycle()
+        except Exception as e:
+            print('error during collection of ' + region + ' ' + target.accountId + ': ', e)
+
+        connection.send(stream.getvalue())
+        stream.seek(0)
+        stream.truncate()
+
+# runs one worker process per region / account pair and merges their output in target order,
+# a cycle takes about as long as the slowest target. A target that has not answered within the
+# cycle budget (the collection interval without one) is logged partial and its worker restarted
+class FanOutCollector():
+
+    def __init__(self, targets, worker=RunTargetWorker, timeout=None):
+        self.targets = targets
+        import multiprocessing
+
+        self.context = multiprocessing.get_context('spawn')
+        self.worker = worker
+        self.timeout = timeout or CYCLE_BUDGET or PROC_INTERVAL
+        self.workers = [None] * len(targets)
+        self.pending = set()
+
+    def startWorker(self, i):
+        region, roleArn = self.targets[i]
+        connection, workerConnection = self.context.Pipe()
+        process = self.context.Process(target=self.worker, args=(workerConnection, region, roleArn), daemon=True)
+        process.start()
+        self.workers[i] = (process, connection)
+
+    def expireClusters(self):
+        self.pending.add('clusterList')
+
+    def expireInventories(self):
+        self.pending.add('inventory')
+
+    def requestFullRefresh(self):
+        self.pending.add('taskRefresh')
+
+    def collect(self):
+        expired = sorted(self.pending)
+        self.pending = set()
+
+        # the csv header is written once for the merged stream
+        header = recordWriter.encoder.header()
+        if header != None:
+            self.write(header + '\n')
+
+        deadline = time.monotonic() + self.timeout + DEADLINE_GRACE_SECONDS
+        for i in range(len(self.targets)):
+            if self.workers[i] == None or not self.workers[i][0].is_alive():
+                self.startWorker(i)
+            self.workers[i][1].send(expired)
+
+        recordWriter.beginCycle()
+        for i, (region, roleArn) in enumerate(self.targets):
+            try:
+                text = self.receive(i, deadline)
+            except (EOFError, OSError) as e:
+                print('error during collection of ' + region + ' ' + roleArn + ': worker exited')
+                text = None
+            if text != None:
+                self.write(text)
+                continue
+
+            # exited or out of time, a late answer must not end up in the next cycle
+            self.stopWorker(i)
+            jsonData = {'recordType': 'target', 'dataStatus': 'partial'}
+            jsonData['region'] = region
+            jsonData['accountId'] = GetAccountIdFromRoleArn(roleArn)
+            jsonData['dateTime1'] = recordWriter.logTime
+            self.write(recordWriter.encoder.encode(jsonData, recordWriter.logTimeMs) + '\n')
+
+    # output of a worker's cycle, None once the deadline passed
+    def receive(self, i, deadline):
+        process, connection = self.workers[i]
+        while True:
+            remaining = deadline - time.monotonic()
+            if connection.poll(min(max(remaining, 0.0), 1.0)):
+                return connection.recv()
+            if not process.is_alive():
+                raise EOFError('worker exited')
+            if remaining <= 0:
+                region, roleArn = self.targets[i]
+                print('error during collection of ' + region + ' ' + roleArn + ': no answer within ' + str(self.timeout) + ' seconds')
+                return None
+
+    def stopWorker(self, i):
+        if self.workers[i] != None:
+            process = self.workers[i][0]
+            process.terminate()
+            process.join(1.0)
+            self.workers[i] = None
+
+    def write(self, text):
+        if sinkWriter != None:
+            sinkWriter.put(text.splitlines())
+        else:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+    def stop(self):
+        for worker in self.workers:
+            if worker != None:
+                worker[1].send(None)
+                worker[0].join()
+
+def GetCollectionTargets():
+
+    regions = REGIONS or [region or 'us-east-1']
+    roleArns = ROLE_ARNS or ['']
+
+    return [(r, roleArn) for roleArn in roleArns for r in regions]
+
+scheduler = Scheduler()
+
+if __name__ == "__main__":
+
+    if METRICS_PORT != 0:
+        StartMetricsServer(METRICS_PORT)
+
+    targets = GetCollectionTargets()
+    if ONE_SHOT:
+        if len(targets) > 1 or ROLE_ARNS != []:
+            fanOut = FanOutCollector(targets)
+            fanOut.collect()
+            fanOut.stop()
+        else:
+            RunOneShot()
+        sys.exit(0)
+
+    if len(targets) > 1 or ROLE_ARNS != []:
+        # each worker keeps its own caches, the expiry jobs are passed on with the next cycle
+        fanOut = FanOutCollector(targets)
+        scheduler.addJob('clusterList', CLUSTER_LIST_INTERVAL, fanOut.expireClusters)
+        scheduler.addJob('inventory', INVENTORY_INTERVAL, fanOut.expireInventories)
+        scheduler.addJob('taskRefresh', TASK_REFRESH_INTERVAL, fanOut.requestFullRefresh)
+        scheduler.addJob('counts', PROC_INTERVAL, fanOut.collect, policy=OVERRUN_POLICY, jitter=SCHEDULE_JITTER)
+
+    else:
+        taskDefCache.load()
+        pricingTable.load()
+        if ROLLUP_MODE != 'off':
+            taskMinuteBuffer.open()
+        warmState.load()
+
+        # the slower stages only expire their cached results, the next collection cycle rebuilds them.
+        # they are added first so a stage due on the same tick expires before the cycle runs
+        scheduler.addJob('clusterList', CLUSTER_LIST_INTERVAL, collectionState.expireClusters)
+        scheduler.addJob('inventory', INVENTORY_INTERVAL, collectionState.expireInventories)
+        scheduler.addJob('taskRefresh', TASK_REFRESH_INTERVAL, serviceSnapshot.requestFullRefresh)
+
+        eventSource = OpenEventSource(EVENT_SOURCE) if EVENT_SOURCE != '' else None
+        if eventSource != None:
+            scheduler.addJob('events', EVENT_INTERVAL, functools.partial(ProcessEvents, eventSource))
+            scheduler.addJob('counts', PROC_INTERVAL, RunEventCycle, policy=OVERRUN_POLICY, jitter=SCHEDULE_JITTER)
+        else:
+            scheduler.addJob('counts', PROC_INTERVAL, RunCollectionCycle, policy=OVERRUN_POLICY, jitter=SCHEDULE_JITTER)
 
-    startTime = time.monotonic()
-    PROC_INTERVAL = 60.0
-    DEBUG = 0
-    cycles = 0
-    driftSumSeconds = 0
-    runtimeSumSeconds = 0
-
-    while(True):
-
-        cycles+=1
-        start = time.time()
-
-        CollectServiceMetrics()
-
-        end = time.time()
-        elapsedTime = end - start
-        runtimeSumSeconds += elapsedTime
-        avgRuntime = runtimeSumSeconds / cycles
-       
-        if DEBUG:
-            print()
-            print('elapsed: ', end - start)
-            print('avg runtime: ', avgRuntime)
-            drift = abs(avgRuntime - elapsedTime)
-            driftSumSeconds+=drift
-            print('drift: ', drift * 1000, 'ms')
-            print('avg drift: ', (driftSumSeconds / cycles) * 1000, 'ms')
-            print()
-
-        time.sleep(PROC_INTERVAL - ((time.monotonic() - startTime) % PROC_INTERVAL))
+    scheduler.run()
@@ -0,0 +1,39 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('AWS_REGION', 'us-east-1')
+
+import serviceMetrics
+from fakeFleet import FakeFleet
+
+# FakeFleet behind the collector's client layers, with fresh collection state for every test
+@pytest.fixture
+def fleet(monkeypatch):
+
+    fleet = FakeFleet(clusters=2, services=6, tasks=3)
+    monkeypatch.setattr(serviceMetrics, 'ecs_client', serviceMetrics.ecs_client)
+    monkeypatch.setattr(serviceMetrics, 'ec2_client', serviceMetrics.ec2_client)
+    serviceMetrics.SetClients(fleet, fleet)
+
+    monkeypatch.setattr(serviceMetrics, 'collectionState', serviceMetrics.CollectionState())
+    monkeypatch.setattr(serviceMetrics, 'lastKnownServices', serviceMetrics.LastKnownServices())
+    monkeypatch.setattr(serviceMetrics, 'serviceSnapshot', serviceMetrics.ServiceSnapshot(serviceMetrics.TASK_REFRESH_INTERVAL))
+    monkeypatch.setattr(serviceMetrics, 'serviceDeltaFilter', serviceMetrics.ServiceDeltaFilter(serviceMetrics.HEARTBEAT_CYCLES))
+    monkeypatch.setattr(serviceMetrics, 'taskDefCache', serviceMetrics.TaskDefinitionCache(serviceMetrics.TASKDEF_CACHE_SIZE))
+
+    return fleet
+
+# runs one collection cycle and returns the logged records
+@pytest.fixture
+def collect(fleet, capsys):
+
+    def Collect(**kwargs):
+        capsys.readouterr()
+        serviceMetrics.CollectServiceMetrics(**kwargs)
+        return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{')]
+
+    return Collect
@@ -0,0 +1,39 @@
+import serviceMetrics
+from fakeFleet import FakeFleet
+
+def test_cluster_metadata_is_described_in_batches(fleet):
+
+    clusterIndex = serviceMetrics.GetClusterMetadata(fleet.clusterArns)
+
+    assert sorted(clusterIndex) == sorted(fleet.clusterArns)
+    assert fleet.calls['describe_clusters'] == 1
+    assert all(metadata.cfStackName != '' for metadata in clusterIndex.values())
+
+def test_failed_batch_only_loses_its_own_clusters(fleet, monkeypatch, capsys):
+
+    monkeypatch.setattr(serviceMetrics, 'DESCRIBE_CLUSTERS_BATCH_SIZE', 1)
+    describeClusters = fleet.describe_clusters
+    def DescribeClusters(clusters, include=None):
+        if clusters == [fleet.clusterArns[0]]:
+            raise TimeoutError('describe_clusters timed out')
+        return describeClusters(clusters, include)
+    fleet.describe_clusters = DescribeClusters
+    serviceMetrics.SetClients(fleet, fleet)
+
+    clusterIndex = serviceMetrics.GetClusterMetadata(fleet.clusterArns)
+
+    assert sorted(clusterIndex) == sorted(fleet.clusterArns[1:])
+    assert 'describe_clusters timed out' in capsys.readouterr().out
+
+def test_cycle_describes_every_cluster_in_one_call(collect, monkeypatch):
+
+    fleet = FakeFleet(clusters=5, services=2, tasks=1)
+    serviceMetrics.SetClients(fleet, fleet)
+    monkeypatch.setattr(serviceMetrics, 'CLUSTER_RECORDS', 1)
+
+    records = collect()
+
+    assert fleet.calls['describe_clusters'] == 1
+    clusters = {r['clusterName']: r for r in records if r.get('recordType') == 'cluster'}
+    assert sorted(clusters) == sorted(cluster['clusterName'] for cluster in fleet.clusters.values())
+    assert all(r['cloudFormationStackName'] == 'stack-' + clusterName for clusterName, r in clusters.items())
@@ -0,0 +1,44 @@
+import threading
+
+from serviceMetrics import ThrottledClient, collectorMetrics
+
+class SlowClient():
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def describe_services(self, **kwargs):
+        self.calls+=1
+        self.started.set()
+        self.release.wait(5)
+        return {'services': [{'serviceName': 'web'}], 'events': ['deployed']}
+
+def test_identical_calls_in_flight_share_one_response():
+
+    slow = SlowClient()
+    client = ThrottledClient(slow)
+    collectorMetrics.beginCycle()
+    results = {}
+
+    def Leader():
+        resp = client.describe_services(cluster='c', services=['web'])
+        del resp['events']
+        results['leader'] = resp
+
+    leader = threading.Thread(target=Leader)
+    leader.start()
+    slow.started.wait(5)
+    follower = threading.Thread(target=lambda: results.setdefault('follower', client.describe_services(cluster='c', services=['web'])))
+    follower.start()
+    while client.inFlight and client.inFlight[next(iter(client.inFlight))][1] == 0:
+        pass
+    slow.release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert slow.calls == 1
+    assert results['follower']['events'] == ['deployed']
+    assert results['follower'] is not results['leader']
+    assert collectorMetrics.formatCycleRecord()['apiCoalesced'] == 1
@@ -0,0 +1,43 @@
+import serviceMetrics
+from serviceMetrics import CollectorMetrics, LatencyHistogram
+from fakeFleet import ClientErrorFor
+
+def test_latency_percentiles_are_bucket_bounds():
+
+    histogram = LatencyHistogram()
+    for ms in [0.5, 3, 3, 4, 40, 70]:
+        histogram.observe(ms / 1000)
+
+    assert histogram.percentile(50) == 5
+    assert histogram.percentile(99) == 70
+    assert histogram.total == 6
+
+def test_throttled_call_is_an_error_and_a_throttle():
+
+    metrics = CollectorMetrics()
+    metrics.beginCycle()
+    metrics.recordApiCall('list_tasks', 0.01, {'ResponseMetadata': {'RetryAttempts': 2}})
+    metrics.recordApiCall('list_tasks', 0.02, error=ClientErrorFor('ThrottlingException', 'list_tasks'))
+    metrics.endCycle(5)
+
+    record = metrics.formatCycleRecord()
+    assert (record['apiCalls'], record['apiErrors'], record['apiThrottles'], record['apiRetries']) == (2, 1, 1, 2)
+    assert record['records'] == 5
+    text = metrics.renderPrometheus()
+    assert 'service_metrics_api_throttles_total{operation="list_tasks"} 1' in text
+    assert 'service_metrics_api_latency_seconds_count{operation="list_tasks"} 2' in text
+
+def test_cycle_record_counts_the_api_calls(collect, fleet, monkeypatch):
+
+    monkeypatch.setattr(serviceMetrics, 'collectorMetrics', CollectorMetrics())
+    monkeypatch.setattr(serviceMetrics, 'STATS_RECORDS', 1)
+
+    records = collect()
+
+    stats = records[-1]
+    assert stats['recordType'] == 'collectorStats'
+    assert stats['records'] == len(records) - 1
+    assert stats['apiCalls'] == sum(fleet.calls.values())
+    assert {operation: api['calls'] for operation, api in stats['api'].items()} == fleet.calls
+    assert stats['stageSeconds'] != {}
+    assert 'service_metrics_cycles_total 1' in serviceMetrics.collectorMetrics.renderPrometheus()
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+import serviceMetrics
+from serviceMetrics import PricingTable, ComputeServiceCost, ServiceData, ClusterInventory, ContainerInstanceData
+
+PRICING = {
+    'fargate': {'us-east-1': {'vcpuHour': 0.04, 'gbHour': 0.004}},
+    'ec2': {'us-east-1': {'m5.large': 0.096, 'm5.xlarge': 0.192, 'c5.xlarge': 0.17, 'c5.2xlarge': 0.34, 'r5.large': 0.126}}
+}
+
+@pytest.fixture
+def pricing(tmp_path, monkeypatch):
+
+    pricingFile = tmp_path / 'pricing.json'
+    pricingFile.write_text(json.dumps(PRICING))
+    table = PricingTable(str(pricingFile), 'us-east-1')
+    table.load()
+    monkeypatch.setattr(serviceMetrics, 'pricingTable', table)
+
+    return table
+
+def test_fargate_cost_from_the_reserved_vcpu_and_memory(pricing):
+
+    service = ComputeServiceCost(ServiceData(containerType='FARGATE', fargateVcpu=2048, fargateMem=4096), None)
+
+    assert service.serviceCostPerMinute == round((2 * 0.04 + 4 * 0.004) / 60, 6)
+
+def test_ec2_instance_price_is_split_across_its_tasks(pricing):
+
+    inventory = ClusterInventory(byContainerInstanceArn={
+        'ci-1': ContainerInstanceData(instanceType='m5.large', runningTasksCount=4),
+        'ci-2': ContainerInstanceData(instanceType='c5.xlarge', runningTasksCount=1),
+        'ci-3': ContainerInstanceData(instanceType='unknown', runningTasksCount=1)
+    })
+    service = ServiceData(containerType='EC2', containerInstanceArns=['ci-1', 'ci-1', 'ci-2', 'ci-3'])
+
+    ComputeServiceCost(service, inventory)
+
+    assert service.serviceCostPerMinute == round((2 * 0.096 / 4 + 0.17) / 60, 6)
+
+def test_other_region_costs_nothing(tmp_path):
+
+    pricingFile = tmp_path / 'pricing.json'
+    pricingFile.write_text(json.dumps(PRICING))
+    table = PricingTable(str(pricingFile), 'eu-west-1')
+    table.load()
+
+    assert table.loaded and (table.fargateVcpuHour, table.ec2Hourly) == (0.0, {})
+
+def test_missing_pricing_file_leaves_the_costs_off(tmp_path, capsys):
+
+    table = PricingTable(str(tmp_path / 'missing.json'), 'us-east-1')
+    table.load()
+
+    assert table.loaded == False
+    assert 'could not load pricing file' in capsys.readouterr().out
+
+def test_cycle_logs_the_service_costs(collect, pricing):
+
+    records = collect()
+
+    services = [r for r in records if 'recordType' not in r]
+    assert services != [] and all(r['serviceCostPerMinute'] > 0 for r in services)
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import serviceMetrics
+from serviceMetrics import RunConcurrently, MarkPairPartial, ServiceData, ClusterData, LastKnownServices
+
+def test_abandoned_worker_does_not_write_to_the_logged_service(monkeypatch):
+
+    monkeypatch.setattr(serviceMetrics, 'MAX_WORKERS', 2)
+    monkeypatch.setattr(serviceMetrics, 'DEADLINE_GRACE_SECONDS', 0.0)
+    monkeypatch.setattr(serviceMetrics.cycleDeadline, 'remaining', lambda: 0.05)
+    release = threading.Event()
+    written = threading.Event()
+
+    def GetTaskArns(pair):
+        if pair[1].serviceName == 'slow':
+            release.wait(5)
+        pair[1].taskArns = ['t1']
+        written.set()
+        return pair[1]
+
+    fast = ServiceData(serviceName='fast')
+    slow = ServiceData(serviceName='slow')
+    RunConcurrently(GetTaskArns, [('c', fast), ('c', slow)], unfinished=MarkPairPartial)
+    written.clear()
+    release.set()
+    written.wait(5)
+    time.sleep(0.05)
+
+    assert fast.taskArns == ['t1'] and fast.dataStatus == ''
+    assert slow.taskArns == [] and slow.dataStatus == 'partial'
+
+def FailDescribeServices(fleet, clusterArn):
+
+    describeServices = fleet.describe_services
+
+    def DescribeServices(cluster, services, include=None):
+        if cluster == clusterArn:
+            raise TimeoutError('describe_services timed out')
+        return describeServices(cluster, services, include)
+
+    fleet.describe_services = DescribeServices
+    # the client layers keep the methods they already called
+    serviceMetrics.SetClients(fleet, fleet)
+
+def test_failed_describe_services_marks_the_cluster_partial(fleet):
+
+    clusterArn = fleet.clusterArns[0]
+    FailDescribeServices(fleet, clusterArn)
+    cluster = serviceMetrics.ClusterData(clusterArn=clusterArn, serviceArnList=fleet.serviceArnsByCluster[clusterArn])
+
+    serviceMetrics.CollectClusterServiceData(cluster)
+
+    assert cluster.serviceDataList == []
+    assert cluster.dataStatus == 'partial'
+
+def test_services_of_a_partial_cluster_are_logged_stale(fleet):
+
+    clusterArn = fleet.clusterArns[0]
+    cluster = serviceMetrics.ClusterData(clusterArn=clusterArn, serviceArnList=fleet.serviceArnsByCluster[clusterArn])
+    serviceMetrics.CollectClusterServiceData(cluster)
+    serviceMetrics.lastKnownServices.fillCluster(cluster)
+    described = len(cluster.serviceDataList)
+
+    FailDescribeServices(fleet, clusterArn)
+    cluster = serviceMetrics.ClusterData(clusterArn=clusterArn, serviceArnList=fleet.serviceArnsByCluster[clusterArn])
+    serviceMetrics.CollectClusterServiceData(cluster)
+    serviceMetrics.lastKnownServices.fillCluster(cluster)
+
+    assert len(cluster.serviceDataList) == described
+    assert set(service.dataStatus for service in cluster.serviceDataList) == {'stale'}
+
+def test_partial_service_takes_the_last_known_task_fields():
+
+    lastKnown = LastKnownServices()
+    lastKnown.fillService(ServiceData(serviceArn='s1', taskArns=['t1', 't2'], fargateVcpu=512))
+    lastKnown.beginCycle()
+
+    service = lastKnown.fillService(ServiceData(serviceArn='s1', dataStatus='partial'))
+    unknown = lastKnown.fillService(ServiceData(serviceArn='s2', dataStatus='partial'))
+
+    assert (service.taskArns, service.fargateVcpu, service.dataStatus) == (['t1', 't2'], 512, 'stale')
+    assert (unknown.taskArns, unknown.dataStatus) == ([], 'partial')
+    assert (lastKnown.stale, lastKnown.partial) == (1, 1)
+
+def test_service_missing_from_a_full_list_is_forgotten():
+
+    lastKnown = LastKnownServices()
+    lastKnown.fillCluster(ClusterData(clusterArn='c', serviceArnList=['s1', 's2'],
+                                      serviceDataList=[ServiceData(serviceArn='s1'), ServiceData(serviceArn='s2')]))
+
+    lastKnown.fillCluster(ClusterData(clusterArn='c', serviceArnList=['s1'], serviceDataList=[ServiceData(serviceArn='s1')]))
+    cluster = ClusterData(clusterArn='c', dataStatus='partial')
+    lastKnown.fillCluster(cluster)
+
+    assert [(service.serviceArn, service.dataStatus) for service in cluster.serviceDataList] == [('s1', 'stale')]
+    assert 's2' not in lastKnown.services
+
+def test_stale_services_are_logged_and_counted(collect, fleet, monkeypatch):
+
+    monkeypatch.setattr(serviceMetrics, 'CYCLE_BUDGET', 30.0)
+    monkeypatch.setattr(serviceMetrics, 'CLUSTER_RECORDS', 1)
+    monkeypatch.setattr(serviceMetrics, 'STATS_RECORDS', 1)
+    before = [r for r in collect() if 'recordType' not in r and r['clusterName'] == 'cluster-0']
+
+    FailDescribeServices(fleet, fleet.clusterArns[0])
+    records = collect()
+
+    stale = [r for r in records if 'recordType' not in r and r['clusterName'] == 'cluster-0']
+    assert [r['serviceTag'] for r in stale] == [r['serviceTag'] for r in before]
+    assert [r['dataStatus'] for r in records if r.get('recordType') == 'cluster' and r['clusterName'] == 'cluster-0'] == ['partial']
+    # untagged services are refilled as well, the selector leaves them out of the log
+    assert [r['staleServices'] for r in records if r.get('recordType') == 'collectorStats'] == [len(fleet.serviceArnsByCluster[fleet.clusterArns[0]])]
@@ -0,0 +1,58 @@
+from serviceMetrics import ServiceDeltaFilter
+
+def RunCycle(deltaFilter, services, keptClusters=(), keepAll=False):
+
+    deltaFilter.beginCycle()
+    for serviceArn, clusterName in services:
+        deltaFilter.check(serviceArn, {'serviceTag': serviceArn, 'runningTasks': 1}, clusterName)
+    for clusterName in keptClusters:
+        deltaFilter.keepCluster(clusterName)
+
+    return list(deltaFilter.endCycle(keepAll=keepAll))
+
+def GetRemoved(records):
+
+    return [r['serviceTag'] for r in records if r['recordType'] == 'serviceRemoved']
+
+def test_missing_service_of_a_listed_cluster_is_removed():
+
+    deltaFilter = ServiceDeltaFilter(10)
+    RunCycle(deltaFilter, [('a', 'c1'), ('b', 'c2')])
+
+    records = RunCycle(deltaFilter, [('a', 'c1')])
+
+    assert GetRemoved(records) == ['b']
+    assert records[-1]['removedServices'] == 1
+
+def test_services_of_an_unread_cluster_are_kept():
+
+    deltaFilter = ServiceDeltaFilter(10)
+    RunCycle(deltaFilter, [('a', 'c1'), ('b', 'c2')])
+
+    assert GetRemoved(RunCycle(deltaFilter, [('a', 'c1')], keptClusters=['c2'])) == []
+    assert GetRemoved(RunCycle(deltaFilter, [], keepAll=True)) == []
+    assert GetRemoved(RunCycle(deltaFilter, [('a', 'c1'), ('b', 'c2')])) == []
+
+import pytest
+
+import serviceMetrics
+
+@pytest.mark.parametrize('streaming', [0, 1])
+def test_failed_describe_services_removes_nothing(collect, fleet, monkeypatch, streaming):
+
+    monkeypatch.setattr(serviceMetrics, 'EMIT_MODE', 'delta')
+    monkeypatch.setattr(serviceMetrics, 'STREAMING', streaming)
+    collect()
+
+    describeServices = fleet.describe_services
+    def DescribeServices(cluster, services, include=None):
+        if cluster == fleet.clusterArns[0]:
+            raise TimeoutError('describe_services timed out')
+        return describeServices(cluster, services, include)
+    fleet.describe_services = DescribeServices
+    serviceMetrics.SetClients(fleet, fleet)
+
+    records = collect()
+
+    assert GetRemoved(records) == []
+    assert records[-1]['recordType'] == 'deltaCycle'
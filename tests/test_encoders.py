@@ -0,0 +1,68 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+import serviceMetrics
+from serviceMetrics import JsonLinesEncoder, LogfmtEncoder, CsvEncoder, EmfEncoder, RecordWriter
+
+RECORD = {'serviceTag': 'web', 'clusterName': 'c0', 'runningTasks': 3, 'timeoutSecs': 30.5, 'dataStatus': ''}
+
+def test_json_lines_match_json_dumps():
+
+    record = dict(RECORD, createdAt=datetime(2026, 1, 1, tzinfo=timezone.utc))
+
+    assert JsonLinesEncoder().encode(record, 0) == json.dumps(record, default=str)
+
+def test_logfmt_quotes_only_where_needed():
+
+    record = dict(RECORD, serviceTag='web api', tasksPerAz={'a': 1}, heartbeat=True)
+
+    assert LogfmtEncoder().encode(record, 0) == (
+        'serviceTag="web api" clusterName=c0 runningTasks=3 timeoutSecs=30.5 dataStatus="" tasksPerAz={"a": 1} heartbeat=true'
+    )
+
+def test_csv_header_is_written_once():
+
+    encoder = CsvEncoder()
+    header = encoder.header()
+    line = encoder.encode(dict(RECORD, unknownKey=1), 0)
+
+    assert encoder.header() == None
+    row = next(csv.DictReader([header, line]))
+    assert (row['serviceTag'], row['runningTasks'], row['FarGateMemory']) == ('web', '3', '')
+    assert 'unknownKey' not in row
+
+def test_emf_declares_the_numeric_keys():
+
+    emf = json.loads(EmfEncoder().encode(dict(RECORD), 1000))
+
+    directive = emf['_aws']['CloudWatchMetrics'][0]
+    assert emf['_aws']['Timestamp'] == 1000
+    assert directive['Dimensions'] == [['clusterName', 'serviceTag']]
+    assert directive['Metrics'] == [{'Name': 'runningTasks', 'Unit': 'Count'}]
+    assert emf['runningTasks'] == 3
+
+def test_records_are_written_in_batches():
+
+    stream = io.StringIO()
+    writer = RecordWriter(JsonLinesEncoder(), 3, stream=stream)
+    for i in range(4):
+        writer.write({'runningTasks': i})
+
+    assert len(stream.getvalue().splitlines()) == 3
+    writer.flush()
+    lines = stream.getvalue().splitlines()
+    assert [json.loads(line)['runningTasks'] for line in lines] == [0, 1, 2, 3]
+    assert len(set(json.loads(line)['dateTime1'] for line in lines)) == 1
+
+def test_csv_cycle_logs_the_json_records(collect, capsys, monkeypatch):
+
+    records = collect()
+
+    monkeypatch.setattr(serviceMetrics.recordWriter, 'encoder', CsvEncoder())
+    monkeypatch.setattr(serviceMetrics, 'collectionState', serviceMetrics.CollectionState())
+    serviceMetrics.CollectServiceMetrics()
+    rows = list(csv.DictReader(capsys.readouterr().out.splitlines()))
+
+    assert [(row['serviceTag'], row['runningTasks']) for row in rows] == [(r['serviceTag'], str(r['runningTasks'])) for r in records]
@@ -0,0 +1,39 @@
+from serviceMetrics import EventIndex, ClusterData, ServiceData, SetServiceCounts
+
+CLUSTER_ARN = 'arn:aws:ecs:us-east-1:123:cluster/c0'
+
+def TaskEvent(taskArn, lastStatus, version):
+
+    return {
+        'detail-type': 'ECS Task State Change',
+        'detail': {'clusterArn': CLUSTER_ARN, 'group': 'service:web', 'taskArn': taskArn, 'lastStatus': lastStatus, 'version': version}
+    }
+
+def BuildIndex():
+
+    service = ServiceData(serviceName='web', serviceArn='arn:aws:ecs:us-east-1:123:service/c0/web', serviceTag='web')
+    SetServiceCounts(service, 3, 2, 1)
+    service.taskArns = ['t1', 't2', 't3']
+    service.taskStatuses = {'t1': 'RUNNING', 't2': 'RUNNING', 't3': 'PENDING'}
+    index = EventIndex()
+    index.rebuild([ClusterData(clusterArn=CLUSTER_ARN, serviceDataList=[service])])
+
+    return index, service
+
+def test_pending_task_starting_moves_from_pending_to_running():
+
+    index, service = BuildIndex()
+
+    index.apply(TaskEvent('t3', 'RUNNING', 2))
+
+    assert (service.runningTasks, service.pendingTasks) == (3, 0)
+    assert [service for cluster, service in index.drainChanges()] == [service]
+
+def test_running_task_stopping_lowers_the_running_count():
+
+    index, service = BuildIndex()
+
+    index.apply(TaskEvent('t1', 'STOPPED', 3))
+
+    assert (service.runningTasks, service.pendingTasks) == (1, 1)
+    assert service.taskArns == ['t2', 't3']
@@ -0,0 +1,66 @@
+import json
+import sys
+import time
+
+import serviceMetrics
+from serviceMetrics import FanOutCollector
+
+TARGETS = [('us-east-1', ''), ('eu-west-1', 'arn:aws:iam::456:role/collector')]
+
+# answers every cycle with one record, debug output goes to stderr like in RunTargetWorker
+def EchoWorker(connection, region, roleArn):
+
+    sys.stdout = sys.stderr
+    while True:
+        expired = connection.recv()
+        if expired == None:
+            break
+        print('DEBUG collecting ' + region)
+        connection.send(json.dumps({'recordType': 'echo', 'region': region, 'expired': expired}) + '\n')
+
+# never answers for the second target
+def HangingWorker(connection, region, roleArn):
+
+    while True:
+        expired = connection.recv()
+        if expired == None:
+            break
+        if region == 'eu-west-1':
+            time.sleep(60)
+        connection.send(json.dumps({'recordType': 'echo', 'region': region}) + '\n')
+
+def Collect(collector, capsys):
+
+    capsys.readouterr()
+    collector.collect()
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{')]
+
+def test_output_of_the_targets_is_merged_in_target_order(capsys):
+
+    collector = FanOutCollector(TARGETS, worker=EchoWorker, timeout=30)
+    collector.expireClusters()
+    try:
+        records = Collect(collector, capsys)
+        assert records == [
+            {'recordType': 'echo', 'region': 'us-east-1', 'expired': ['clusterList']},
+            {'recordType': 'echo', 'region': 'eu-west-1', 'expired': ['clusterList']},
+        ]
+        assert [record['expired'] for record in Collect(collector, capsys)] == [[], []]
+    finally:
+        collector.stop()
+
+def test_target_without_answer_is_logged_partial_and_restarted(capsys, monkeypatch):
+
+    monkeypatch.setattr(serviceMetrics, 'DEADLINE_GRACE_SECONDS', 0.0)
+    collector = FanOutCollector(TARGETS, worker=HangingWorker, timeout=5)
+    try:
+        start = time.monotonic()
+        records = Collect(collector, capsys)
+        assert time.monotonic() - start < 15
+        assert records[0] == {'recordType': 'echo', 'region': 'us-east-1'}
+        assert {key: records[1][key] for key in ('recordType', 'region', 'accountId', 'dataStatus')} == {
+            'recordType': 'target', 'region': 'eu-west-1', 'accountId': '456', 'dataStatus': 'partial'
+        }
+        assert collector.workers[1] == None
+    finally:
+        collector.stop()
@@ -0,0 +1,43 @@
+import serviceMetrics
+
+def GetRecords(collect):
+
+    records = collect(useCachedStages=True)
+    for record in records:
+        del record['dateTime1']
+
+    return records
+
+def test_unchanged_services_skip_the_task_calls(collect, fleet, monkeypatch):
+
+    monkeypatch.setattr(serviceMetrics, 'INCREMENTAL', 1)
+    first = GetRecords(collect)
+    fleet.calls = {}
+
+    assert GetRecords(collect) == first
+    assert 'list_tasks' not in fleet.calls and 'describe_tasks' not in fleet.calls
+    assert serviceMetrics.serviceSnapshot.reused == len(fleet.services)
+
+def test_changed_service_is_collected_again(collect, fleet, monkeypatch):
+
+    monkeypatch.setattr(serviceMetrics, 'INCREMENTAL', 1)
+    GetRecords(collect)
+    serviceArn = fleet.serviceArnsByCluster[fleet.clusterArns[0]][1]
+    fleet.services[serviceArn]['runningCount'] -= 1
+    fleet.calls = {}
+
+    GetRecords(collect)
+
+    assert fleet.calls['list_tasks'] == 1
+
+def test_full_refresh_collects_every_service(collect, fleet, monkeypatch):
+
+    monkeypatch.setattr(serviceMetrics, 'INCREMENTAL', 1)
+    records = GetRecords(collect)
+    serviceMetrics.serviceSnapshot.requestFullRefresh()
+    fleet.calls = {}
+
+    GetRecords(collect)
+
+    assert fleet.calls['list_tasks'] == len(records)
+    assert serviceMetrics.serviceSnapshot.reused == 0
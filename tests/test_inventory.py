@@ -0,0 +1,42 @@
+import serviceMetrics
+from fakeFleet import FakeFleet
+
+def UseFleet(fleet):
+
+    serviceMetrics.SetClients(fleet, fleet)
+    return fleet
+
+def test_one_inventory_per_cluster(collect):
+
+    fleet = UseFleet(FakeFleet(clusters=2, services=8, tasks=2, ec2Ratio=1.0))
+
+    records = collect()
+
+    ec2 = [r for r in records if r.get('containerType') == 'EC2']
+    assert len(ec2) > 2
+    assert all(r['EC2InstanceType'] in fleet.instances.values() for r in ec2)
+    assert fleet.calls['list_container_instances'] == 2
+    assert fleet.calls['describe_container_instances'] == 2
+    assert fleet.calls['describe_instances'] == 2
+
+def test_capacity_record_sums_the_cluster_instances(collect, monkeypatch):
+
+    fleet = UseFleet(FakeFleet(clusters=1, services=4, tasks=2, ec2Ratio=1.0, instancesPerCluster=3))
+    monkeypatch.setattr(serviceMetrics, 'CLUSTER_RECORDS', 1)
+
+    records = collect()
+
+    instances = fleet.containerInstances.values()
+    remainingCpu = sum(i['remainingResources'][0]['integerValue'] for i in instances)
+    capacity = [r for r in records if r.get('recordType') == 'capacity']
+    assert len(capacity) == 1
+    assert (capacity[0]['containerInstances'], capacity[0]['registeredCpu'], capacity[0]['remainingCpu']) == (3, 3 * 4096, remainingCpu)
+    assert capacity[0]['runningTasks'] == sum(i['runningTasksCount'] for i in instances)
+
+def test_fargate_only_cluster_has_no_inventory_calls(collect):
+
+    fleet = UseFleet(FakeFleet(clusters=2, services=4, tasks=2, ec2Ratio=0.0))
+
+    collect()
+
+    assert 'list_container_instances' not in fleet.calls
@@ -0,0 +1,48 @@
+import serviceMetrics
+from serviceMetrics import OperationLimiter
+
+def test_unlimited_operation_recovers_after_throttling_stops():
+
+    limiter = OperationLimiter(0, 20)
+    for i in range(3):
+        assert limiter.reserve() == 0.0
+
+    limiter.onThrottle()
+    throttledRate = limiter.rate
+    assert 0 < throttledRate < 3.0
+
+    # a minute of successful calls at the allowed rate
+    for i in range(2000):
+        limiter.onSuccess()
+
+    assert limiter.rate > throttledRate * 10
+
+def test_configured_rate_is_the_ceiling():
+
+    limiter = OperationLimiter(5.0, 5)
+
+    limiter.onThrottle()
+    assert limiter.rate == 5.0 * serviceMetrics.API_RATE_DECREASE
+
+    for i in range(100):
+        limiter.onSuccess()
+    assert limiter.rate == 5.0
+
+def test_throttles_of_one_period_cut_once():
+
+    limiter = OperationLimiter(10.0, 10)
+
+    for i in range(5):
+        limiter.onThrottle()
+
+    assert limiter.rate == 10.0 * serviceMetrics.API_RATE_DECREASE
+
+def test_throttles_keep_cutting_down_to_the_minimum_rate(monkeypatch):
+
+    monkeypatch.setattr(serviceMetrics, 'API_CUT_SECONDS', 0.0)
+    limiter = OperationLimiter(10.0, 10)
+
+    for i in range(50):
+        limiter.onThrottle()
+
+    assert limiter.rate == serviceMetrics.API_MIN_RATE
@@ -0,0 +1,48 @@
+import serviceMetrics
+from serviceMetrics import PaginateCall, DescribeInBatches
+from fakeFleet import FakeFleet
+
+def test_every_page_is_read():
+
+    fleet = FakeFleet(clusters=1, services=25, tasks=1)
+    clusterArn = fleet.clusterArns[0]
+
+    serviceArns = PaginateCall(fleet.list_services, 'serviceArns', cluster=clusterArn, maxResults=7)
+
+    assert serviceArns == fleet.serviceArnsByCluster[clusterArn]
+    assert fleet.calls['list_services'] == 4
+
+def test_ec2_pages_follow_the_pascal_case_token():
+
+    pages = {None: {'Reservations': [1, 2], 'NextToken': 'a'}, 'a': {'Reservations': [3]}}
+
+    def DescribeInstances(NextToken=None):
+        return pages[NextToken]
+
+    assert PaginateCall(DescribeInstances, 'Reservations') == [1, 2, 3]
+
+def test_describe_calls_are_batched_to_the_api_maximum():
+
+    fleet = FakeFleet(clusters=1, services=25, tasks=1)
+    clusterArn = fleet.clusterArns[0]
+    serviceArns = fleet.serviceArnsByCluster[clusterArn]
+
+    services = DescribeInBatches(fleet.describe_services, 'services', serviceArns, 'services',
+                                 serviceMetrics.DESCRIBE_SERVICES_BATCH_SIZE, cluster=clusterArn)
+
+    assert [service['serviceArn'] for service in services] == serviceArns
+    assert fleet.calls['describe_services'] == 3
+
+def test_cycle_uses_one_call_per_page_or_batch(collect, fleet):
+
+    fleet = FakeFleet(clusters=1, services=25, tasks=3)
+    serviceMetrics.SetClients(fleet, fleet)
+
+    records = collect()
+
+    assert len([r for r in records if 'recordType' not in r]) == 20
+    assert fleet.calls['list_clusters'] == 1
+    assert fleet.calls['list_services'] == 1
+    assert fleet.calls['describe_services'] == 3
+    # the untagged services are pruned before their task calls
+    assert fleet.calls['list_tasks'] == 20
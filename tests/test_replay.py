@@ -0,0 +1,46 @@
+import botocore.exceptions
+import pytest
+
+import serviceMetrics
+from serviceMetrics import ApiRecorder, ApiReplay, RecordingClient, ReplayClient
+
+def GetRecords(collect):
+
+    records = collect()
+    for record in records:
+        del record['dateTime1']
+
+    return records
+
+def test_replayed_cycle_logs_the_recorded_records(collect, fleet, tmp_path, monkeypatch):
+
+    monkeypatch.setattr(serviceMetrics, 'CLUSTER_RECORDS', 1)
+    recorder = ApiRecorder(str(tmp_path / 'calls.jsonl.gz'))
+    serviceMetrics.SetClients(RecordingClient(fleet, 'ecs', recorder), RecordingClient(fleet, 'ec2', recorder))
+    recorded = GetRecords(collect)
+    recorder.flush()
+
+    replay = ApiReplay(recorder.fileName)
+    serviceMetrics.SetClients(ReplayClient('ecs', replay), ReplayClient('ec2', replay))
+    fleet.calls = {}
+    monkeypatch.setattr(serviceMetrics, 'collectionState', serviceMetrics.CollectionState())
+    monkeypatch.setattr(serviceMetrics, 'taskDefCache', serviceMetrics.TaskDefinitionCache(serviceMetrics.TASKDEF_CACHE_SIZE))
+
+    assert GetRecords(collect) == recorded
+    assert fleet.calls == {}
+
+def test_recorded_errors_are_raised_again(fleet, tmp_path):
+
+    recorder = ApiRecorder(str(tmp_path / 'calls.jsonl.gz'))
+    client = RecordingClient(fleet, 'ecs', recorder)
+    with pytest.raises(botocore.exceptions.ClientError):
+        client.describe_task_definition(taskDefinition='missing:1')
+    recorder.flush()
+
+    replay = ReplayClient('ecs', ApiReplay(recorder.fileName))
+    with pytest.raises(botocore.exceptions.ClientError) as error:
+        replay.describe_task_definition(taskDefinition='missing:1')
+    assert error.value.response['Error']['Code'] == 'ClientException'
+    with pytest.raises(botocore.exceptions.ClientError) as error:
+        replay.describe_task_definition(taskDefinition='other:1')
+    assert error.value.response['Error']['Code'] == 'ReplayMissingCall'
@@ -0,0 +1,46 @@
+from serviceMetrics import TaskMinuteRingBuffer, ServiceData, SetServiceCounts
+
+def RecordMinutes(buffer, minutes, running=2):
+
+    service = ServiceData(serviceArn='arn:service/a', serviceTag='a')
+    SetServiceCounts(service, running, running, 0)
+    records = []
+    for minute in minutes:
+        buffer.record(service, 'cluster', minute)
+        records += buffer.closeWindows(minute)
+
+    return records
+
+def GetWindows(records, window):
+
+    return [(r['windowStart'], r['samples']) for r in records if r['window'] == window]
+
+def test_window_closes_on_its_last_minute():
+
+    buffer = TaskMinuteRingBuffer(4, 60)
+    buffer.open()
+
+    records = RecordMinutes(buffer, range(10))
+
+    assert GetWindows(records, '5m') == [('1970-01-01T00:00:00Z', 5), ('1970-01-01T00:05:00Z', 5)]
+    assert records[0]['runningTaskMinutes'] == 10
+    assert records[0]['runningTasksAvg'] == 2.0
+
+def test_window_without_a_sample_in_its_last_minute_is_not_dropped():
+
+    buffer = TaskMinuteRingBuffer(4, 60)
+    buffer.open()
+
+    records = RecordMinutes(buffer, [0, 1, 2, 3, 5])
+
+    assert GetWindows(records, '5m') == [('1970-01-01T00:00:00Z', 4)]
+
+def test_two_minute_interval_keeps_every_window():
+
+    buffer = TaskMinuteRingBuffer(4, 60)
+    buffer.open()
+
+    records = RecordMinutes(buffer, range(0, 62, 2))
+
+    assert len(GetWindows(records, '5m')) == 12
+    assert GetWindows(records, '1h') == [('1970-01-01T00:00:00Z', 30)]
@@ -0,0 +1,85 @@
+import serviceMetrics
+from serviceMetrics import Scheduler, ServiceSnapshot
+
+class FakeClock():
+
+    def __init__(self):
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def RunCycles(scheduler, results, cycles):
+
+    while len(results) < cycles:
+        scheduler.runNext()
+
+# the main loop wiring: the taskRefresh job runs before the counts job on the same tick
+def test_default_task_refresh_keeps_incremental_cycles():
+
+    fake = FakeClock()
+    scheduler = Scheduler(clock=fake.clock, sleep=fake.sleep)
+    snapshot = ServiceSnapshot(serviceMetrics.TASK_REFRESH_INTERVAL, clock=fake.clock)
+    fullRefresh = []
+
+    def counts():
+        snapshot.beginCycle()
+        fullRefresh.append(snapshot.fullRefresh)
+
+    scheduler.addJob('taskRefresh', serviceMetrics.TASK_REFRESH_INTERVAL, snapshot.requestFullRefresh)
+    scheduler.addJob('counts', serviceMetrics.PROC_INTERVAL, counts)
+    RunCycles(scheduler, fullRefresh, 3 * serviceMetrics.FULL_REFRESH_CYCLES)
+
+    assert fullRefresh.count(True) == 3
+    assert fullRefresh[0] and fullRefresh[serviceMetrics.FULL_REFRESH_CYCLES]
+
+# a refresh interval longer than SM_FULL_REFRESH_CYCLES cycles is what the refresh follows
+def test_task_refresh_interval_is_the_only_refresh_setting():
+
+    fake = FakeClock()
+    scheduler = Scheduler(clock=fake.clock, sleep=fake.sleep)
+    snapshot = ServiceSnapshot(20 * 60.0, clock=fake.clock)
+    fullRefresh = []
+
+    def counts():
+        snapshot.beginCycle()
+        fullRefresh.append(snapshot.fullRefresh)
+
+    scheduler.addJob('taskRefresh', 20 * 60.0, snapshot.requestFullRefresh)
+    scheduler.addJob('counts', 60.0, counts)
+    RunCycles(scheduler, fullRefresh, 40)
+
+    assert [i for i, refresh in enumerate(fullRefresh) if refresh] == [0, 20]
+
+# one-shot runs have no scheduler, the snapshot's age brings the refresh
+def test_task_refresh_without_a_scheduler_follows_the_age():
+
+    fake = FakeClock()
+    snapshot = ServiceSnapshot(300.0, clock=fake.clock)
+    fullRefresh = []
+
+    for i in range(12):
+        snapshot.beginCycle()
+        fullRefresh.append(snapshot.fullRefresh)
+        fake.now += 60.0
+
+    assert [i for i, refresh in enumerate(fullRefresh) if refresh] == [0, 5, 10]
+
+def test_skip_policy_counts_missed_ticks():
+
+    fake = FakeClock()
+    scheduler = Scheduler(clock=fake.clock, sleep=fake.sleep)
+    runs = []
+
+    def slow():
+        runs.append(fake.now)
+        fake.now += 25.0
+
+    job = scheduler.addJob('counts', 10.0, slow)
+    RunCycles(scheduler, runs, 3)
+
+    assert runs == [0.0, 30.0, 60.0]
+    assert job.skipped == 6
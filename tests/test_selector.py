@@ -0,0 +1,20 @@
+from serviceMetrics import ServiceSelector
+
+VALUES = ['prod-1', 'FARGATE', 'stack-a', 'web']
+
+def test_untagged_services_are_counted_as_pruned():
+
+    selector = ServiceSelector('')
+
+    assert selector.match('web', {}, VALUES)
+    assert not selector.match('', {}, VALUES)
+    assert (selector.selected, selector.pruned) == (1, 1)
+
+def test_all_terms_have_to_match():
+
+    selector = ServiceSelector('cluster:prod-*,launchType:FARGATE,!tag:Team=legacy')
+
+    assert selector.match('web', {'Team': 'core'}, VALUES)
+    assert not selector.match('web', {'Team': 'legacy'}, VALUES)
+    assert not selector.match('web', {}, ['dev-1', 'FARGATE', 'stack-a', 'web'])
+    assert (selector.selected, selector.pruned) == (1, 2)
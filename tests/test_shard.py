@@ -0,0 +1,71 @@
+import pytest
+
+import serviceMetrics
+from serviceMetrics import ShardAssignment, ClusterMetadata
+
+KEYS = ['arn:aws:ecs:us-east-1:123:cluster/c' + str(i) for i in range(300)]
+
+def GetOwners(count):
+
+    replicas = [ShardAssignment(index, str(count)) for index in range(count)]
+    owners = {}
+    for key in KEYS:
+        owners[key] = [replica.index for replica in replicas if replica.owns(key)]
+
+    return owners
+
+def test_every_key_has_one_owner():
+
+    owners = GetOwners(3)
+
+    assert all(len(replicas) == 1 for replicas in owners.values())
+    for index in range(3):
+        assert len([key for key in KEYS if owners[key] == [index]]) > len(KEYS) / 6
+
+def test_added_replica_only_takes_keys_over():
+
+    before = GetOwners(3)
+    after = GetOwners(4)
+
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert moved != []
+    assert all(after[key] == [3] for key in moved)
+
+    # and removing it hands its keys back to the previous owners
+    assert GetOwners(3) == before
+
+def test_large_cluster_is_split_by_service():
+
+    clusterArn = KEYS[0]
+    small = ClusterMetadata(clusterArn=clusterArn, activeServicesCount=serviceMetrics.SHARD_SERVICES_THRESHOLD)
+    large = ClusterMetadata(clusterArn=clusterArn, activeServicesCount=serviceMetrics.SHARD_SERVICES_THRESHOLD + 1)
+    replicas = [ShardAssignment(index, '2') for index in range(2)]
+    serviceNames = ['svc-' + str(i) for i in range(50)]
+
+    for serviceName in serviceNames:
+        assert [r.ownsService(clusterArn, serviceName, small) for r in replicas] == [r.owns(clusterArn) for r in replicas]
+    split = [[r.ownsService(clusterArn, serviceName, large) for r in replicas] for serviceName in serviceNames]
+    assert all(owned.count(True) == 1 for owned in split)
+    assert [True, False] in split and [False, True] in split
+
+def GetServiceKeys(records):
+
+    return sorted((r['clusterName'], r['serviceTag']) for r in records if 'recordType' not in r)
+
+@pytest.mark.parametrize('threshold', [3, 200])
+def test_replicas_together_log_every_service_once(collect, monkeypatch, threshold):
+
+    monkeypatch.setattr(serviceMetrics, 'SHARD_SERVICES_THRESHOLD', threshold)
+    everything = GetServiceKeys(collect())
+
+    shards = []
+    for index in range(2):
+        monkeypatch.setattr(serviceMetrics, 'shardAssignment', ShardAssignment(index, '2'))
+        monkeypatch.setattr(serviceMetrics, 'collectionState', serviceMetrics.CollectionState())
+        shards.append(GetServiceKeys(collect()))
+
+    assert sorted(shards[0] + shards[1]) == everything
+    if threshold == 3:
+        # both clusters are split, each replica logs a part of each
+        for shard in shards:
+            assert sorted(set(clusterName for clusterName, serviceTag in shard)) == ['cluster-0', 'cluster-1']
@@ -0,0 +1,23 @@
+import socket
+
+import pytest
+
+from serviceMetrics import TcpSink
+
+def GetClosedPort():
+
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    return port
+
+def test_tcp_sink_waits_before_reconnecting():
+
+    sink = TcpSink('127.0.0.1', GetClosedPort())
+
+    with pytest.raises(OSError):
+        sink.write(['a'])
+    with pytest.raises(OSError, match='waiting to reconnect'):
+        sink.write(['b'])
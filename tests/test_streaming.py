@@ -0,0 +1,49 @@
+import io
+import json
+
+import pytest
+
+import serviceMetrics
+
+def GetRecords(collect):
+
+    records = collect()
+    for record in records:
+        del record['dateTime1']
+
+    return records
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_streaming_logs_the_batch_records(collect, monkeypatch, workers):
+
+    monkeypatch.setattr(serviceMetrics, 'CLUSTER_RECORDS', 1)
+    monkeypatch.setattr(serviceMetrics, 'MAX_WORKERS', workers)
+    batch = GetRecords(collect)
+
+    monkeypatch.setattr(serviceMetrics, 'STREAMING', 1)
+    monkeypatch.setattr(serviceMetrics, 'collectionState', serviceMetrics.CollectionState())
+
+    # the capacity record follows the services of its cluster, their inventory is built while they stream through
+    streamed = GetRecords(collect)
+    assert [r for r in streamed if r.get('recordType') != 'capacity'] == [r for r in batch if r.get('recordType') != 'capacity']
+    assert sorted(map(json.dumps, streamed)) == sorted(map(json.dumps, batch))
+
+def test_services_are_written_before_the_next_cluster_is_read(collect, fleet, monkeypatch):
+
+    monkeypatch.setattr(serviceMetrics, 'STREAMING', 1)
+    monkeypatch.setattr(serviceMetrics, 'MAX_WORKERS', 1)
+    stream = io.StringIO()
+    monkeypatch.setattr(serviceMetrics.recordWriter, 'stream', stream)
+    written = []
+
+    listTasks = fleet.list_tasks
+    def ListTasks(cluster, **kwargs):
+        if cluster == fleet.clusterArns[1] and written == []:
+            written.append([json.loads(line)['clusterName'] for line in stream.getvalue().splitlines()])
+        return listTasks(cluster, **kwargs)
+    fleet.list_tasks = ListTasks
+    serviceMetrics.SetClients(fleet, fleet)
+
+    collect()
+
+    assert written[0] != [] and set(written[0]) == {'cluster-0'}
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+import serviceMetrics
+from serviceMetrics import TaskColumns
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def Task(taskId, startedAt, healthStatus, zone, cpu='256', memory='512'):
+
+    return {
+        'taskArn': 'arn:aws:ecs:us-east-1:123:task/c0/' + taskId,
+        'lastStatus': 'RUNNING' if startedAt != None else 'PENDING',
+        'startedAt': datetime.fromtimestamp(startedAt, timezone.utc) if startedAt != None else None,
+        'healthStatus': healthStatus,
+        'availabilityZone': zone,
+        'cpu': cpu,
+        'memory': memory
+    }
+
+def test_unknown_settings_fall_back_to_off():
+
+    env = dict(os.environ, SM_TASK_METRICS='containers', SM_ROLLUP_MODE='daily', AWS_REGION='us-east-1')
+    output = subprocess.run([sys.executable, '-c', 'import serviceMetrics; print(serviceMetrics.TASK_METRICS, serviceMetrics.ROLLUP_MODE)'],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout.splitlines()
+
+    assert 'unknown SM_TASK_METRICS value, using default value: off' in output
+    assert 'unknown SM_ROLLUP_MODE value, using default value: off' in output
+    assert output[-1] == 'off off'
+
+def test_summary_of_the_task_columns():
+
+    columns = TaskColumns()
+    columns.addPage([Task('t1', 1000, 'HEALTHY', 'us-east-1a'), Task('t2', 1600, 'UNHEALTHY', 'us-east-1b', cpu='512')])
+    columns.addPage([Task('t3', 1900, 'HEALTHY', 'us-east-1a'), Task('t4', None, None, '')])
+
+    summary = columns.summary(2000)
+
+    assert summary['taskAgeMaxSecs'] == 1000
+    assert summary['taskAgeP50Secs'] == 400
+    assert (summary['healthyTasks'], summary['unhealthyTasks'], summary['unknownHealthTasks']) == (2, 1, 1)
+    assert (summary['reservedCpu'], summary['reservedMemory']) == (256 * 3 + 512, 512 * 4)
+    assert summary['tasksPerAz'] == {'us-east-1a': 2, 'us-east-1b': 1}
+
+def test_task_mode_logs_one_record_per_task(collect, fleet, monkeypatch):
+
+    monkeypatch.setattr(serviceMetrics, 'TASK_METRICS', 'task')
+
+    records = collect()
+
+    services = [r for r in records if 'recordType' not in r]
+    tasks = [r for r in records if r.get('recordType') == 'task']
+    assert tasks != []
+    assert set(r['taskId'] for r in tasks) <= set(taskArn.split('/')[-1] for taskArn in fleet.tasks)
+    for service in services:
+        taskRecords = [r for r in tasks if r['serviceTag'] == service['serviceTag'] and r['clusterName'] == service['clusterName']]
+        assert service['healthyTasks'] + service['unhealthyTasks'] + service['unknownHealthTasks'] == len(taskRecords)
+        assert service['reservedCpu'] == sum(r['cpu'] for r in taskRecords)
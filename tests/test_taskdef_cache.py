@@ -0,0 +1,39 @@
+from serviceMetrics import TaskDefinitionCache
+
+def test_least_recently_used_revision_is_dropped():
+
+    cache = TaskDefinitionCache(2)
+    cache.put('td:1', {'queueSize': 1})
+    cache.put('td:2', {'queueSize': 2})
+    cache.get('td:1')
+    cache.put('td:3', {'queueSize': 3})
+
+    assert list(cache.entries) == ['td:1', 'td:3']
+    assert cache.get('td:2') == None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_cache_file_keeps_the_lru_order(tmp_path):
+
+    cacheFile = str(tmp_path / 'taskdefs.json')
+    cache = TaskDefinitionCache(3, cacheFile)
+    for revision in range(1, 4):
+        cache.put('td:' + str(revision), {'queueSize': revision})
+    cache.get('td:1')
+    cache.save()
+
+    loaded = TaskDefinitionCache(2, cacheFile)
+    loaded.load()
+
+    assert list(loaded.entries) == ['td:3', 'td:1']
+    assert loaded.dirty == False
+
+def test_each_revision_is_described_once(collect, fleet):
+
+    collect()
+    described = fleet.calls['describe_task_definition']
+    revisions = len(set(task['taskDefinitionArn'] for task in fleet.tasks.values()))
+
+    collect()
+
+    assert described <= revisions
+    assert fleet.calls['describe_task_definition'] == described
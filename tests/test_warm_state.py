@@ -0,0 +1,87 @@
+import io
+import os
+import pickle
+import time
+
+import pytest
+
+import serviceMetrics
+from serviceMetrics import WarmState, WarmStateUnpickler, CollectionState, ClusterInventory, ServiceData, CLUSTER_LIST_INTERVAL, INVENTORY_INTERVAL
+
+class RunsCode():
+
+    def __reduce__(self):
+        return (os.system, ('true',))
+
+def Unpickle(value):
+
+    return WarmStateUnpickler(io.BytesIO(pickle.dumps(value))).load()
+
+def test_unpickler_loads_the_state_classes():
+
+    state = {'services': {'arn': ServiceData(serviceArn='arn', taskArns=['t1'])}}
+
+    assert Unpickle(state)['services']['arn'].taskArns == ['t1']
+
+def test_unpickler_refuses_other_globals():
+
+    with pytest.raises(pickle.UnpicklingError):
+        Unpickle({'services': RunsCode()})
+
+def test_aged_stages_are_expired():
+
+    now = time.time()
+    state = CollectionState()
+    state.clusterList = ['c1']
+    state.clusterListTime = now - CLUSTER_LIST_INTERVAL
+    state.inventories = {
+        'c1': ClusterInventory(clusterArn='c1', collectedAt=now - INVENTORY_INTERVAL),
+        'c2': ClusterInventory(clusterArn='c2', collectedAt=now)
+    }
+
+    state.expireAged(now)
+
+    assert state.clusterList == None
+    assert state.lastClusterList == ['c1']
+    assert list(state.inventories) == ['c2']
+
+def test_fresh_cluster_list_is_kept():
+
+    now = time.time()
+    state = CollectionState()
+    state.clusterList = ['c1']
+    state.clusterListTime = now - CLUSTER_LIST_INTERVAL / 2
+
+    state.expireAged(now)
+
+    assert state.clusterList == ['c1']
+
+def test_saved_state_warms_the_next_run(collect, fleet, tmp_path, monkeypatch):
+
+    collect()
+    WarmState(str(tmp_path / 'state.pickle')).save()
+    clusterList = serviceMetrics.collectionState.clusterList
+    taskDefinitions = dict(serviceMetrics.taskDefCache.entries)
+
+    monkeypatch.setattr(serviceMetrics, 'collectionState', CollectionState())
+    monkeypatch.setattr(serviceMetrics, 'taskDefCache', serviceMetrics.TaskDefinitionCache(serviceMetrics.TASKDEF_CACHE_SIZE))
+    WarmState(str(tmp_path / 'state.pickle')).load()
+
+    assert clusterList != None and serviceMetrics.collectionState.clusterList == clusterList
+    assert dict(serviceMetrics.taskDefCache.entries) == taskDefinitions
+    fleet.calls = {}
+    collect(useCachedStages=True)
+    assert 'list_clusters' not in fleet.calls and 'describe_task_definition' not in fleet.calls
+
+def test_tampered_state_file_is_not_loaded(fleet, tmp_path, monkeypatch, capsys):
+
+    commands = []
+    monkeypatch.setattr(os, 'system', commands.append)
+    stateFile = tmp_path / 'state.pickle'
+    stateFile.write_bytes(pickle.dumps({'taskDefinitions': {}, 'services': RunsCode(), 'clusterList': ['c1']}))
+
+    WarmState(str(stateFile)).load()
+
+    assert commands == []
+    assert 'could not load warm start state' in capsys.readouterr().out
+    assert serviceMetrics.collectionState.clusterList == None
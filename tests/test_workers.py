@@ -0,0 +1,37 @@
+import threading
+import time
+
+import serviceMetrics
+from serviceMetrics import RunConcurrently
+
+def GetRecords(collect):
+
+    records = collect()
+    for record in records:
+        del record['dateTime1']
+
+    return records
+
+def test_results_keep_the_input_order(monkeypatch):
+
+    monkeypatch.setattr(serviceMetrics, 'MAX_WORKERS', 4)
+    threads = set()
+
+    def Square(value):
+        threads.add(threading.get_ident())
+        time.sleep((10 - value) * 0.002)
+        return value * value
+
+    assert RunConcurrently(Square, list(range(10))) == [value * value for value in range(10)]
+    assert len(threads) > 1
+
+def test_worker_pool_logs_the_serial_records(collect, monkeypatch):
+
+    monkeypatch.setattr(serviceMetrics, 'CLUSTER_RECORDS', 1)
+    monkeypatch.setattr(serviceMetrics, 'MAX_WORKERS', 1)
+    serial = GetRecords(collect)
+
+    monkeypatch.setattr(serviceMetrics, 'MAX_WORKERS', 8)
+    monkeypatch.setattr(serviceMetrics, 'collectionState', serviceMetrics.CollectionState())
+
+    assert GetRecords(collect) == serial
@@ -1,27 +1,37 @@
-import time
-from datetime import datetime
-import pytz
+'''
+Check the drift of the collection scheduler: run a no-op job on the scheduler for a number of ticks
+and fail if the tick start latency goes over the allowed drift
 
-UTC = pytz.UTC
+usage: python3 timing.py [interval seconds] [ticks] [max p99 drift ms]
+'''
 
-startTime = time.monotonic()
+import sys
+from serviceMetrics import Scheduler
 
-driftSum = 0
-cycles = 0
 PROC_INTERVAL = 5.0
+TICKS = 12
+MAX_DRIFT_MS = 50.0
 
-while(True):
-
-    cycles+=1
-    start = time.time()
-    dateTime = datetime.now(UTC)
-    formatted = dateTime.strftime("%Y-%m-%d %H:%M:%S")
-    print('tick: ', formatted)
-    time.sleep(PROC_INTERVAL - ((time.monotonic() - startTime) % PROC_INTERVAL))
-    end = time.time()
-    elapsed = end - start
-    print('elapsed: ', end - start)
-    drift = abs(PROC_INTERVAL - elapsed)
-    driftSum+=drift
-    print('drift: ', drift * 1000, 'ms')
-    print('avg drift: ', (driftSum / cycles) * 1000, 'ms')     
\ No newline at end of file
+if len(sys.argv) > 1:
+    PROC_INTERVAL = float(sys.argv[1])
+if len(sys.argv) > 2:
+    TICKS = int(sys.argv[2])
+if len(sys.argv) > 3:
+    MAX_DRIFT_MS = float(sys.argv[3])
+
+def tick():
+    print('tick: ', job.runs + 1, '/', TICKS)
+
+scheduler = Scheduler()
+job = scheduler.addJob('tick', PROC_INTERVAL, tick)
+scheduler.run(TICKS)
+
+drift = job.drift.summary()
+print('drift: ', drift)
+print('skipped ticks: ', job.skipped)
+
+if drift['p99Ms'] > MAX_DRIFT_MS or job.skipped != 0:
+    print('FAIL: p99 drift over ', MAX_DRIFT_MS, 'ms')
+    sys.exit(1)
+
+print('OK')